@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import numpy as np
+
+"""
+Benchmark of the indicator backends of quantlib.indicators_cal on
+(dates x instruments) arrays: TA-Lib (one instrument at a time), the NumPy port
+(all instruments at once) and the same port compiled with Numba.
+
+The backend is chosen when quantlib.indicators_cal is imported, so every
+backend is timed in its own process. Run from the root of the repository:
+
+    python -m benchmarks.indicators --instruments 500 --days 2520
+"""
+
+BACKENDS = ["talib", "numpy", "numba"]
+
+
+def get_ohlc(n_days, n_instruments, seed=0):
+    """
+    This function returns random walk high, low and close prices as
+    (dates x instruments) arrays
+    """
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(
+        np.cumsum(rng.normal(0, 0.02, (n_days, n_instruments)), axis=0)
+    )
+    spread = np.abs(rng.normal(0, 0.01, (n_days, n_instruments))) * close
+    return close + spread, close - spread, close
+
+
+def get_min_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_backend(n_days, n_instruments, repeat):
+    """
+    This function times the indicators with the backend of this process and
+    compares them to TA-Lib when it is installed
+    """
+    import quantlib.indicators_cal as indicators_cal
+
+    high, low, close = get_ohlc(n_days, n_instruments)
+    talib = indicators_cal.talib
+    calls = {
+        "adx(14)": (
+            lambda: indicators_cal.adx_series(high, low, close, 14),
+            lambda: indicators_cal.by_column(
+                talib.ADX, [high, low, close], timeperiod=14
+            ),
+        ),
+        "ema(21)": (
+            lambda: indicators_cal.ema_series(close, 21),
+            lambda: indicators_cal.by_column(talib.EMA, [close], timeperiod=21),
+        ),
+        "ema(283)": (
+            lambda: indicators_cal.ema_series(close, 283),
+            lambda: indicators_cal.by_column(talib.EMA, [close], timeperiod=283),
+        ),
+        "sma(30)": (
+            lambda: indicators_cal.sma_series(close, 30),
+            lambda: indicators_cal.by_column(talib.SMA, [close], timeperiod=30),
+        ),
+    }
+    results = {}
+    for name, (call, talib_call) in calls.items():
+        # the first call also compiles the Numba kernels
+        values = call()
+        results[name] = {"seconds": get_min_time(call, repeat)}
+        if talib is not None:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                diff = np.abs(values - talib_call()) / np.abs(values)
+            results[name]["max rel diff"] = float(np.nanmax(diff))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--instruments", type=int, default=500)
+    parser.add_argument("--days", type=int, default=2520)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_backend(args.days, args.instruments, args.repeat)))
+        return
+
+    results = {}
+    for backend in args.backends.split(","):
+        process = subprocess.run(
+            [sys.executable, "-m", "benchmarks.indicators", "--child"]
+            + ["--instruments", str(args.instruments), "--days", str(args.days)]
+            + ["--repeat", str(args.repeat)],
+            env=dict(os.environ, QUANTLIB_INDICATORS=backend),
+            capture_output=True,
+            text=True,
+        )
+        if process.returncode != 0:
+            print(f"{backend}: skipped ({process.stderr.strip().splitlines()[-1]})")
+            continue
+        results[backend] = json.loads(process.stdout)
+
+    print(f"{args.days} days x {args.instruments} instruments, best of {args.repeat}")
+    for name in next(iter(results.values()), {}):
+        for backend, timings in results.items():
+            line = f"{name:>10} {backend:>6}: {timings[name]['seconds'] * 1000:9.2f} ms"
+            if "talib" in results and backend != "talib":
+                speedup = results["talib"][name]["seconds"] / timings[name]["seconds"]
+                line += f" ({speedup:.1f}x TA-Lib)"
+            if "max rel diff" in timings[name]:
+                line += f", max rel diff {timings[name]['max rel diff']:.1e}"
+            print(line)
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(
+                {"days": args.days, "instruments": args.instruments, **results},
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
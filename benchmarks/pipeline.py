@@ -0,0 +1,390 @@
+import os
+import sys
+import json
+import argparse
+import platform
+import datetime
+import tempfile
+import itertools
+import subprocess
+import numpy as np
+import pandas as pd
+
+from benchmarks.indicators import get_ohlc, get_min_time
+
+"""
+Benchmark of the data -> indicator -> simulation pipeline of the subsystems on
+synthetic OHLCV data.
+
+Each case (number of instruments, years of daily bars, share of FX-denominated
+instruments, subsystem and simulation engine) runs in its own process and
+times every stage:
+- 'extend_dataframe': data_utils.extend_dataframe() of the raw OHLCV
+- 'extend_historicals': the ADX and EMA crossovers of the subsystem
+- 'simulation': run_simulation() with the pandas engine, or
+  run_array_simulation() with the numpy engine
+- 'day_stats': the PnL and returns of a day as the day loop computes them,
+  'backtest_utils.get_ledger_day_stats()' with the pandas engine and
+  'backtest_utils.get_day_stats()' with the numpy engine, in seconds per day
+- 'strat_scalar': the 'backtest_utils.RollingStratScalar' of the day loop fed
+  every day of the simulated 'portfolio_df', in seconds per day
+- 'get_backtest_day_stats' and 'get_strat_scalar': the reference functions
+  the day loops replaced, as a baseline, in seconds per day
+- 'get_subsys_pos': the whole backtest, end to end, over the second half of
+  the history
+together with the peak resident memory of the process after the stage.
+
+The results are written as JSON with --json. Passing an earlier file with
+--baseline reports the stages that got slower by more than --tolerance and
+exits with status 1 if there are any. Run from the root of the repository:
+
+    python -m benchmarks.pipeline --instruments 10,50 --years 1,3 --fx-share 0.3
+"""
+
+STAGES = [
+    "extend_dataframe",
+    "extend_historicals",
+    "simulation",
+    "day_stats",
+    "strat_scalar",
+    "get_backtest_day_stats",
+    "get_strat_scalar",
+    "get_subsys_pos",
+]
+# the stages timed per day
+PER_DAY_STAGES = [
+    "day_stats",
+    "strat_scalar",
+    "get_backtest_day_stats",
+    "get_strat_scalar",
+]
+# quote currencies of the synthetic FX pairs and FX-denominated CFDs
+CURRENCIES = ["EUR", "GBP", "JPY", "AUD", "CHF", "HKD", "CAD", "NZD", "SGD"]
+# the days of the simulated 'portfolio_df' timed by the per day stages, but for
+# 'strat_scalar' which is fed every day
+SAMPLE_DAYS = 50
+
+
+def get_instruments(n_instruments, fx_share):
+    """
+    This function returns the instrument names of a synthetic universe and its
+    'fx_codes'. A share 'fx_share' of the instruments is FX-denominated: FX
+    pairs '{ccy}_USD' first, then CFDs quoted in the currency of one of the
+    pairs (e.g. 'I003_EUR'), the rest are USD instruments ('S000', ...).
+    """
+    n_fx = int(round(n_instruments * fx_share))
+    pairs = [f"{ccy}_USD" for ccy in CURRENCIES[: min(n_fx, len(CURRENCIES))]]
+    cfds = [f"I{k:03d}_{CURRENCIES[k % len(pairs)]}" for k in range(n_fx - len(pairs))]
+    stocks = [f"S{k:03d}" for k in range(n_instruments - n_fx)]
+    fx_codes = ["USD"] + [pair.split("_")[0] for pair in pairs]
+    return pairs + cfds + stocks, fx_codes
+
+
+def get_ohlcv_df(n_instruments, years, fx_share=0.0, seed=0):
+    """
+    This function returns a synthetic OHLCV frame in the layout of the pull
+    scripts ('{inst} {field}' columns, one row per weekday over 'years' years),
+    the traded instruments and the 'fx_codes' to extend it with
+    """
+    instruments, fx_codes = get_instruments(n_instruments, fx_share)
+    dates = pd.bdate_range(end="2024-12-31", periods=int(years * 252))
+    high, low, close = get_ohlc(len(dates), len(instruments), seed=seed)
+    rng = np.random.default_rng(seed)
+    fields = {
+        "open": np.vstack([close[:1], close[:-1]]),
+        "high": high,
+        "low": low,
+        "close": close,
+        "volume": rng.integers(1000, 100000, close.shape).astype(np.float64),
+    }
+    df = pd.DataFrame(
+        {
+            f"{inst} {field}": values[:, j]
+            for field, values in fields.items()
+            for j, inst in enumerate(instruments)
+        },
+        # 'datetime.date' labels, as 'data_utils.format_dates()' leaves them
+        index=pd.Index(dates.date, name="date"),
+    )
+    return df, instruments, fx_codes
+
+
+def get_peak_rss_mb():
+    import quantlib.memory_utils as memory_utils
+
+    peak = memory_utils.get_peak_rss()
+    return peak / 2**20 if peak is not None else None
+
+
+def run_case(n_instruments, years, fx_share, subsystem, engine, repeat):
+    """
+    This function times the stages of one case in this process and returns
+    {stage: {"seconds": ..., "peak rss MB": ...}}
+    """
+    import quantlib.array_engine as array_engine
+    import quantlib.backtest_utils as backtest_utils
+    import quantlib.data_utils as data_utils
+    import quantlib.ledger as ledger
+
+    from subsystems.lbmom.subsys import Lbmom
+    from subsystems.lsmom.subsys import Lsmom
+
+    df, instruments, fx_codes = get_ohlcv_df(n_instruments, years, fx_share)
+    stages = {}
+
+    def record(stage, seconds):
+        stages[stage] = {"seconds": seconds, "peak rss MB": get_peak_rss_mb()}
+
+    record(
+        "extend_dataframe",
+        get_min_time(
+            lambda: data_utils.extend_dataframe(instruments, df, fx_codes), repeat
+        ),
+    )
+    historical_df = data_utils.extend_dataframe(instruments, df, fx_codes)
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump({"instruments": instruments}, f)
+    try:
+        strat = {"lbmom": Lbmom, "lsmom": Lsmom}[subsystem](
+            instruments_config=f.name,
+            historical_df=historical_df,
+            # the second half of the history is simulated
+            simulation_start=historical_df.index[len(historical_df.index) // 2],
+            vol_target=0.2,
+            engine=engine,
+        )
+    finally:
+        os.remove(f.name)
+
+    record(
+        "extend_historicals",
+        get_min_time(
+            lambda: strat.extend_historicals(instruments, historical_df), repeat
+        ),
+    )
+    extended = strat.extend_historicals(instruments, historical_df)
+
+    if engine == "numpy":
+        simulate = lambda: strat.run_array_simulation(historical_df)
+    else:
+        simulate = lambda: strat.run_simulation(historical_df)
+    record("simulation", get_min_time(simulate, repeat))
+    portfolio_df, _ = simulate()
+
+    days = np.linspace(1, len(portfolio_df.index) - 1, SAMPLE_DAYS).astype(int)
+    days = sorted(set(days.tolist()))
+
+    # the day loops read the arrays of the run and the previous day's row of the
+    # ledger, here a ledger filled with the simulated 'portfolio_df'
+    start = len(historical_df.index) - len(portfolio_df.index)
+    close = array_engine.get_panel(historical_df, instruments, "close")
+    rets = array_engine.get_panel(historical_df, instruments, "% ret")
+    val_fx, _ = backtest_utils.get_unit_conversions(historical_df, instruments)
+    portfolio_ledger = ledger.PortfolioLedger(portfolio_df["date"], instruments)
+    for field, values in [
+        ("units", portfolio_ledger.units),
+        ("w", portfolio_ledger.weights),
+    ]:
+        values[:] = portfolio_df[[f"{inst} {field}" for inst in instruments]]
+    for field in ledger.FIELDS:
+        portfolio_ledger.values[field][:] = portfolio_df[field]
+
+    def get_day_stats(i):
+        if engine == "numpy":
+            return backtest_utils.get_day_stats(
+                prev_units=portfolio_ledger.units[i - 1],
+                prev_weights=portfolio_ledger.weights[i - 1],
+                price_change=close[start + i] - close[start + i - 1],
+                val_fx=val_fx[start + i - 1],
+                rets=rets[start + i],
+                prev_leverage=portfolio_ledger.get(i - 1, "leverage"),
+            )
+        return backtest_utils.get_ledger_day_stats(
+            portfolio_ledger,
+            i,
+            price_change=close[start + i] - close[start + i - 1],
+            val_fx=val_fx[start + i - 1],
+            rets=rets[start + i],
+        )
+
+    record(
+        "day_stats",
+        get_min_time(lambda: [get_day_stats(i) for i in days], repeat) / len(days),
+    )
+
+    def feed_strat_scalar():
+        scalar_calculator = backtest_utils.RollingStratScalar(
+            lookback=100, vol_target=0.2, default=2
+        )
+        for i in range(1, len(portfolio_ledger)):
+            scalar_calculator.get_strat_scalar()
+            if not portfolio_ledger.has_nan(i):
+                scalar_calculator.update(
+                    portfolio_ledger.get(i, "capital ret"),
+                    portfolio_ledger.get(i, "strat scalar"),
+                )
+
+    record(
+        "strat_scalar",
+        get_min_time(feed_strat_scalar, repeat) / (len(portfolio_ledger) - 1),
+    )
+
+    dates = portfolio_df["date"]
+    scratch_df = portfolio_df.copy()
+    record(
+        "get_backtest_day_stats",
+        get_min_time(
+            lambda: [
+                backtest_utils.get_backtest_day_stats(
+                    scratch_df, instruments, dates[i], dates[i - 1], i, extended
+                )
+                for i in days
+            ],
+            repeat,
+        )
+        / len(days),
+    )
+    record(
+        "get_strat_scalar",
+        get_min_time(
+            lambda: [
+                backtest_utils.get_strat_scalar(portfolio_df, 100, 0.2, i, 2)
+                for i in days
+            ],
+            repeat,
+        )
+        / len(days),
+    )
+
+    record("get_subsys_pos", get_min_time(strat.get_subsys_pos, repeat))
+    return stages
+
+
+def get_cases(args):
+    return [
+        {
+            "instruments": n_instruments,
+            "years": years,
+            "fx share": args.fx_share,
+            "subsystem": subsystem,
+            "engine": engine,
+        }
+        for n_instruments, years, subsystem, engine in itertools.product(
+            [int(n) for n in args.instruments.split(",")],
+            [float(years) for years in args.years.split(",")],
+            args.subsystems.split(","),
+            args.engines.split(","),
+        )
+    ]
+
+
+def get_case_key(case):
+    return tuple(
+        case[name]
+        for name in ["instruments", "years", "fx share", "subsystem", "engine"]
+    )
+
+
+def get_regressions(cases, baseline, tolerance):
+    """
+    This function returns the (case, stage, ratio) of every stage that takes
+    more than (1 + tolerance) times its time in 'baseline'
+    """
+    baseline_cases = {get_case_key(case): case for case in baseline["cases"]}
+    regressions = []
+    for case in cases:
+        previous = baseline_cases.get(get_case_key(case))
+        if previous is None:
+            continue
+        for stage, timing in case["stages"].items():
+            if stage not in previous["stages"]:
+                continue
+            ratio = timing["seconds"] / previous["stages"][stage]["seconds"]
+            if ratio > 1 + tolerance:
+                regressions.append((case, stage, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--instruments", default="20", help="e.g. 10,50,200")
+    parser.add_argument("--years", default="3", help="e.g. 1,3,10")
+    parser.add_argument("--fx-share", type=float, default=0.3)
+    parser.add_argument("--subsystems", default="lbmom")
+    parser.add_argument("--engines", default="numpy,pandas")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case is not None:
+        case = json.loads(args.case)
+        stages = run_case(
+            case["instruments"],
+            case["years"],
+            case["fx share"],
+            case["subsystem"],
+            case["engine"],
+            args.repeat,
+        )
+        print(json.dumps(stages))
+        return 0
+
+    cases = []
+    for case in get_cases(args):
+        process = subprocess.run(
+            [sys.executable, "-m", "benchmarks.pipeline", "--case", json.dumps(case)]
+            + ["--repeat", str(args.repeat)],
+            capture_output=True,
+            text=True,
+        )
+        name = ", ".join(f"{key} {value}" for key, value in case.items())
+        if process.returncode != 0:
+            print(f"{name}: failed ({process.stderr.strip().splitlines()[-1]})")
+            continue
+        case["stages"] = json.loads(process.stdout.strip().splitlines()[-1])
+        cases.append(case)
+        print(name)
+        for stage in STAGES:
+            timing = case["stages"][stage]
+            line = f"{stage:>24}: {timing['seconds'] * 1000:10.3f} ms"
+            if stage in PER_DAY_STAGES:
+                line += " per day"
+            if timing["peak rss MB"] is not None:
+                line += f", peak rss {timing['peak rss MB']:.0f} MB"
+            print(line)
+
+    import quantlib.indicators_cal as indicators_cal
+
+    results = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "indicators backend": indicators_cal.BACKEND,
+        "repeat": args.repeat,
+        "cases": cases,
+    }
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = get_regressions(cases, baseline, args.tolerance)
+        for case, stage, ratio in regressions:
+            print(
+                f"regression: {stage} {ratio:.2f}x slower "
+                f"({', '.join(f'{key} {value}' for key, value in case.items() if key != 'stages')})"
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
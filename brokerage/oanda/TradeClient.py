@@ -1,6 +1,7 @@
 import json
 import pandas as pd
 import datetime
+import quantlib.fetch_utils as fetch_utils
 
 import oandapyV20
 import oandapyV20.endpoints.orders as orders
@@ -140,5 +141,27 @@ class TradeClient:
         except Exception as err:
             raise Exception(f"Some err message from get ohlcv: {str(err)}")
 
+    def get_ohlcvs(self, insts, count, granularity, max_workers=8, calls_per_second=20):
+        """
+        Fetch the OHLCV data of the instruments 'insts' concurrently, with rate
+        limiting and retries, and join them into one wide DataFrame with
+        '{inst} {field}' columns
+        """
+        ohlcvs = fetch_utils.fetch_all(
+            insts,
+            lambda inst: self.get_ohlcv(
+                instrument=inst, count=count, granularity=granularity
+            ).set_index("date"),
+            max_workers=max_workers,
+            calls_per_second=calls_per_second,
+        )
+        return pd.concat(
+            [
+                df.rename(columns=lambda x, inst=inst: f"{inst} {x}")
+                for inst, df in ohlcvs.items()
+            ],
+            axis=1,
+        ).sort_index()
+
     def market_order(self, inst, order_config={}):
         pass
@@ -0,0 +1 @@
+# The tests import quantlib and the subsystems from the repository root
@@ -1,43 +1,109 @@
+import os
 import json
 import quantlib.data_utils as data_utils
+import quantlib.storage as storage
+import quantlib.profiling_utils as profiling_utils
+import quantlib.batch_utils as batch_utils
 
 from dateutil.relativedelta import relativedelta
+from quantlib.indicator_cache import IndicatorCache
+from quantlib.memory_utils import MemoryReport
 from subsystems.lbmom.subsys import Lbmom
 from subsystems.lsmom.subsys import Lsmom
 
-with open("config/crypto_config.json") as f:
-    crypto_config = json.load(f)
-
 """
 THIS SCRIPT IS FOR WORKING WITH CRYPTO instruments
 
-In subsys for both lbmom and lsmom we should inside 'run_simulation()' method set
-variable instruments to this -> instruments = self.instruments_config["crypto_tickers"]
+The subsystems trade every instrument listed in their instruments config (all
+of its lists, see 'get_instruments()'), or only the lists named by their
+'instruments_keys' argument. run_batch.py runs this script with the other
+markets, with the instruments keys of config/portfolio_config.json.
 """
 
-df, instruments = data_utils.get_crypto_df(crypto_config=crypto_config)
-historical_df = data_utils.extend_dataframe(traded=instruments, df=df, fx_codes=[])
-historical_df.to_excel("./Data/crypto/historical_df.xlsx")
+# With INCREMENTAL the raw OHLCV history is kept in OHLCV_PATH and each run only
+# downloads the missing bars and extends the new rows of the stored historical_df
+INCREMENTAL = True
+OHLCV_PATH = "./Data/crypto/ohlcv.parquet"
+HISTORICAL_PATH = "./Data/crypto/historical_df.parquet"
+# With LEAN historical_df and the subsystem frames are kept in float32 without the
+# raw columns the simulation does not use (see data_utils.extend_dataframe)
+LEAN = False
+# historical_df is stored in Parquet, set EXPORT_EXCEL to also export it to Excel
+EXPORT_EXCEL = False
 VOL_TARGET = 0.2
+# None runs each subsystem in its own process, 1 runs them one after the other
+MAX_WORKERS = None
+
+
+def main(instruments_keys=None, max_workers=MAX_WORKERS):
+    """
+    Downloads and extends the crypto history, runs both subsystems and stores
+    their 'portfolio_df', returns the run summary (see 'batch_utils.get_summary()')
+    """
+    with open("config/crypto_config.json") as f:
+        crypto_config = json.load(f)
+
+    memory_report = MemoryReport()
+    # Run with QUANTLIB_PROFILE=1 (or =cprofile) for a summary of the time spent
+    # in each stage, see quantlib.profiling_utils
+    profiling_utils.start_cprofile()
+
+    df, instruments = data_utils.get_crypto_df(
+        crypto_config=crypto_config, ohlcv_path=OHLCV_PATH if INCREMENTAL else None
+    )
+    memory_report.record("ohlcv", df)
+    historical_df = data_utils.extend_dataframe_tail(
+        traded=instruments,
+        df=df,
+        fx_codes=[],
+        historical_data=(
+            storage.load_historical_df(HISTORICAL_PATH)
+            if INCREMENTAL and os.path.exists(HISTORICAL_PATH)
+            else None
+        ),
+        lean=LEAN,
+    )
+    memory_report.record("historical_df", historical_df)
+    storage.save_historical_df(
+        historical_df,
+        HISTORICAL_PATH,
+        excel_path="./Data/crypto/historical_df.xlsx" if EXPORT_EXCEL else None,
+    )
+
+    # Both subsystems compute the same ADX and EMA series, share them (and keep
+    # them on disk for reruns)
+    indicator_cache = IndicatorCache(disk_dir="./Data/crypto/indicator_cache")
 
-simulation_start = historical_df.index[-1] - relativedelta(years=3)
+    simulation_start = historical_df.index[-1] - relativedelta(years=3)
 
-lbmom_strat = Lbmom(
-    instruments_config="./subsystems/lbmom/crypto_instruments.json",
-    historical_df=historical_df,
-    simulation_start=simulation_start,
-    vol_target=VOL_TARGET,
-)
+    strats = [
+        subsys(
+            instruments_config=f"./subsystems/{name}/crypto_instruments.json",
+            historical_df=historical_df,
+            simulation_start=simulation_start,
+            vol_target=VOL_TARGET,
+            indicator_cache=indicator_cache,
+            lean=LEAN,
+            memory_report=memory_report,
+            instruments_keys=instruments_keys,
+        )
+        for name, subsys in [("lbmom", Lbmom), ("lsmom", Lsmom)]
+    ]
+    results = batch_utils.run_subsystems(strats, max_workers=max_workers)
+    for sysname, (portfolio_df, instruments) in results.items():
+        storage.save_portfolio_df(
+            portfolio_df,
+            f"./Data/crypto/{sysname.lower()}_strat.parquet",
+            csv_path=f"./Data/crypto/{sysname.lower()}_strat.csv",
+        )
 
-portfolio_lbmom_df, instruments = lbmom_strat.get_subsys_pos()
-portfolio_lbmom_df.to_csv("./Data/crypto/lbmom_strat.csv")
+    # the indicators of earlier histories are never hit again, see
+    # 'IndicatorCache.prune()'
+    indicator_cache.prune()
+    memory_report.print_report()
+    profiling_utils.print_summary()
+    return batch_utils.get_summary("crypto", results)
 
-lsmom_strat = Lsmom(
-    instruments_config="./subsystems/lsmom/crypto_instruments.json",
-    historical_df=historical_df,
-    simulation_start=simulation_start,
-    vol_target=VOL_TARGET,
-)
 
-portfolio_lsmom_df, instruments = lsmom_strat.get_subsys_pos()
-portfolio_lsmom_df.to_csv("./Data/crypto/lsmom_strat.csv")
+if __name__ == "__main__":
+    main()
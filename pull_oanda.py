@@ -1,76 +1,117 @@
 import json
-import pandas as pd
 
 import quantlib.data_utils as data_utils
+import quantlib.storage as storage
+import quantlib.profiling_utils as profiling_utils
+import quantlib.batch_utils as batch_utils
 
 from brokerage.oanda.oanda import Oanda
+from quantlib.indicator_cache import IndicatorCache
+from quantlib.memory_utils import MemoryReport
 from subsystems.lbmom.subsys import Lbmom
 from subsystems.lsmom.subsys import Lsmom
 from dateutil.relativedelta import relativedelta
 
-
-with open("config/auth_config.json") as f:
-    auth_config = json.load(f)
-
-with open("config/oan_config.json") as f:
-    brokerage_config = json.load(f)
-
 """
 THIS SCRIPT IS FOR WORKING WITH OANDA BROKER
 
-In subsys for, both, lbmom and lsmom we should inside 'run_simulation()' method set
-variable instruments to this -> instruments = self.instruments_config["indices"] + self.instruments_config['bonds'] (for our example)
+The subsystems trade every instrument listed in their instruments config (all
+of its lists, see 'get_instruments()'), or only the lists named by their
+'instruments_keys' argument. run_batch.py runs this script with the other
+markets, with the instruments keys of config/portfolio_config.json.
 """
 
-brokerage = Oanda(auth_config=auth_config)
-trade_client = brokerage.get_trade_client()
-
-db_instruments = (
-    brokerage_config["currencies"]
-    + brokerage_config["indices"]
-    + brokerage_config["commodities"]
-    + brokerage_config["metals"]
-    + brokerage_config["bonds"]
-)
-
-oan_ohlcv = pd.DataFrame()
-for db_inst in db_instruments:
-    df = trade_client.get_ohlcv(
-        instrument=db_inst, count=2500, granularity="D"
-    ).set_index("date")
-    cols = list(map(lambda x: f"{db_inst} {x}", df.columns))
-    df.columns = cols
-    if len(oan_ohlcv) == 0:
-        oan_ohlcv = df
-    else:
-        oan_ohlcv = oan_ohlcv.combine_first(df)
-
-historical_df = data_utils.extend_dataframe(
-    traded=db_instruments, df=oan_ohlcv, fx_codes=brokerage_config["fx_codes"]
-)
-
-historical_df.to_excel("./Data/oanda/historical_df.xlsx")
-
+# With LEAN historical_df and the subsystem frames are kept in float32 without the
+# raw columns the simulation does not use (see data_utils.extend_dataframe)
+LEAN = False
+# historical_df is stored in Parquet, set EXPORT_EXCEL to also export it to Excel
+EXPORT_EXCEL = False
 VOL_TARGET = 0.2
-
-simulation_start = historical_df.index[-1] - relativedelta(years=3)
-
-lbmom_strat = Lbmom(
-    instruments_config="./subsystems/lbmom/oan_instruments.json",
-    historical_df=historical_df,
-    simulation_start=simulation_start,
-    vol_target=VOL_TARGET,
-)
-
-portfolio_lbmom_df, instruments = lbmom_strat.get_subsys_pos()
-portfolio_lbmom_df.to_csv("./Data/oanda/lbmom_strat.csv")
-
-lsmom_strat = Lsmom(
-    instruments_config="./subsystems/lsmom/oan_instruments.json",
-    historical_df=historical_df,
-    simulation_start=simulation_start,
-    vol_target=VOL_TARGET,
-)
-
-portfolio_lsmom_df, instruments = lsmom_strat.get_subsys_pos()
-portfolio_lsmom_df.to_csv("./Data/oanda/lsmom_strat.csv")
+# None runs each subsystem in its own process, 1 runs them one after the other
+MAX_WORKERS = None
+
+
+def main(instruments_keys=None, max_workers=MAX_WORKERS):
+    """
+    Downloads and extends the Oanda history, runs both subsystems and stores
+    their 'portfolio_df', returns the run summary (see 'batch_utils.get_summary()')
+    """
+    with open("config/auth_config.json") as f:
+        auth_config = json.load(f)
+
+    with open("config/oan_config.json") as f:
+        brokerage_config = json.load(f)
+
+    brokerage = Oanda(auth_config=auth_config)
+    trade_client = brokerage.get_trade_client()
+
+    db_instruments = (
+        brokerage_config["currencies"]
+        + brokerage_config["indices"]
+        + brokerage_config["commodities"]
+        + brokerage_config["metals"]
+        + brokerage_config["bonds"]
+    )
+
+    memory_report = MemoryReport()
+    # Run with QUANTLIB_PROFILE=1 (or =cprofile) for a summary of the time spent
+    # in each stage, see quantlib.profiling_utils
+    profiling_utils.start_cprofile()
+
+    with profiling_utils.timer("get_ohlcvs"):
+        oan_ohlcv = trade_client.get_ohlcvs(
+            insts=db_instruments, count=2500, granularity="D"
+        )
+    memory_report.record("ohlcv", oan_ohlcv)
+
+    historical_df = data_utils.extend_dataframe(
+        traded=db_instruments,
+        df=oan_ohlcv,
+        fx_codes=brokerage_config["fx_codes"],
+        lean=LEAN,
+    )
+    memory_report.record("historical_df", historical_df)
+
+    storage.save_historical_df(
+        historical_df,
+        "./Data/oanda/historical_df.parquet",
+        excel_path="./Data/oanda/historical_df.xlsx" if EXPORT_EXCEL else None,
+    )
+
+    # Both subsystems compute the same ADX and EMA series, share them (and keep
+    # them on disk for reruns)
+    indicator_cache = IndicatorCache(disk_dir="./Data/oanda/indicator_cache")
+
+    simulation_start = historical_df.index[-1] - relativedelta(years=3)
+
+    strats = [
+        subsys(
+            instruments_config=f"./subsystems/{name}/oan_instruments.json",
+            historical_df=historical_df,
+            simulation_start=simulation_start,
+            vol_target=VOL_TARGET,
+            indicator_cache=indicator_cache,
+            lean=LEAN,
+            memory_report=memory_report,
+            instruments_keys=instruments_keys,
+        )
+        for name, subsys in [("lbmom", Lbmom), ("lsmom", Lsmom)]
+    ]
+    results = batch_utils.run_subsystems(strats, max_workers=max_workers)
+    for sysname, (portfolio_df, instruments) in results.items():
+        storage.save_portfolio_df(
+            portfolio_df,
+            f"./Data/oanda/{sysname.lower()}_strat.parquet",
+            csv_path=f"./Data/oanda/{sysname.lower()}_strat.csv",
+        )
+
+    # the indicators of earlier histories are never hit again, see
+    # 'IndicatorCache.prune()'
+    indicator_cache.prune()
+    memory_report.print_report()
+    profiling_utils.print_summary()
+    return batch_utils.get_summary("oan", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,158 @@
+import os
 import quantlib.data_utils as data_utils
+import quantlib.storage as storage
+import quantlib.profiling_utils as profiling_utils
+import quantlib.chunked_engine as chunked_engine
+import quantlib.batch_utils as batch_utils
 
 from dateutil.relativedelta import relativedelta
+from quantlib.indicator_cache import IndicatorCache
+from quantlib.memory_utils import MemoryReport
 from subsystems.lbmom.subsys import Lbmom
 from subsystems.lsmom.subsys import Lsmom
 
 """
 THIS SCRIPT IS FOR WORKING WITH SP500 instruments
 
-In subsys for both lbmom and lsmom we should inside 'run_simulation()' method set
-variable instruments to this -> instruments = self.instruments_config["instruments"]
+The subsystems trade every instrument listed in their instruments config (all
+of its lists, see 'get_instruments()'), or only the lists named by their
+'instruments_keys' argument. The chunked run trades the whole index unless
+'instruments_keys' is given. run_batch.py runs this script with the other
+markets, with the instruments keys of config/portfolio_config.json.
 """
 
-df, instruments = data_utils.get_sp500_df()
-historical_df = data_utils.extend_dataframe(traded=instruments, df=df, fx_codes=[])
-historical_df.to_excel("./Data/sp500/historical_df.xlsx")
-
+# With CHUNK_SIZE the whole index is run in chunks of CHUNK_SIZE instruments, with
+# the intermediate results spilled to SPILL_DIR (see quantlib.chunked_engine), set
+# it to None to run the first 30 constituents in memory. Both modes store the
+# historical_df of all instruments in HISTORICAL_PATH for run_portfolio.py.
+CHUNK_SIZE = 50
+SPILL_DIR = "./Data/sp500/chunks"
+# With INCREMENTAL the raw OHLCV history is kept in OHLCV_PATH and each run only
+# downloads the missing bars and extends the new rows of the stored historical_df.
+# The chunked run keeps the history of every chunk in OHLCV_CHUNK_PATH and only
+# downloads the missing bars, the chunks are then extended in full.
+INCREMENTAL = True
+OHLCV_PATH = "./Data/sp500/ohlcv.parquet"
+OHLCV_CHUNK_PATH = "./Data/sp500/ohlcv/ohlcv_{:04d}.parquet"
+HISTORICAL_PATH = "./Data/sp500/historical_df.parquet"
+# With LEAN historical_df and the subsystem frames are kept in float32 without the
+# raw columns the simulation does not use (see data_utils.extend_dataframe)
+LEAN = False
+# historical_df is stored in Parquet, set EXPORT_EXCEL to also export it to Excel
+EXPORT_EXCEL = False
 VOL_TARGET = 0.2
+# the subsystems simulate the last SIM_YEARS of the history
+SIM_YEARS = 5
+# None runs each subsystem in its own process, 1 runs them one after the other
+# (in the chunked run only their simulations over the joined panels)
+MAX_WORKERS = None
+
+
+def main(instruments_keys=None, max_workers=MAX_WORKERS):
+    """
+    Downloads and extends the S&P 500 history, runs both subsystems and stores
+    their 'portfolio_df', returns the run summary (see 'batch_utils.get_summary()')
+    """
+    memory_report = MemoryReport()
+    # Run with QUANTLIB_PROFILE=1 (or =cprofile) for a summary of the time spent
+    # in each stage, see quantlib.profiling_utils
+    profiling_utils.start_cprofile()
+
+    if CHUNK_SIZE is None:
+        df, instruments = data_utils.get_sp500_df(
+            ohlcv_path=OHLCV_PATH if INCREMENTAL else None
+        )
+        memory_report.record("ohlcv", df)
+        historical_df = data_utils.extend_dataframe_tail(
+            traded=instruments,
+            df=df,
+            fx_codes=[],
+            historical_data=(
+                storage.load_historical_df(HISTORICAL_PATH)
+                if INCREMENTAL and os.path.exists(HISTORICAL_PATH)
+                else None
+            ),
+            lean=LEAN,
+        )
+        memory_report.record("historical_df", historical_df)
+        storage.save_historical_df(
+            historical_df,
+            HISTORICAL_PATH,
+            excel_path="./Data/sp500/historical_df.xlsx" if EXPORT_EXCEL else None,
+        )
+        simulation_start = historical_df.index[-1] - relativedelta(years=SIM_YEARS)
+    else:
+        # the historical_df of every chunk is spilled to SPILL_DIR and joined
+        # into HISTORICAL_PATH after the simulation, the simulation start is
+        # set from the dates of the first chunk
+        historical_df = None
+        simulation_start = None
+
+    # Both subsystems compute the same ADX and EMA series, share them (and keep
+    # them on disk for reruns)
+    indicator_cache = IndicatorCache(disk_dir="./Data/sp500/indicator_cache")
 
-simulation_start = historical_df.index[-1] - relativedelta(years=5)
+    strats = [
+        subsys(
+            instruments_config=f"./subsystems/{name}/sp500_instruments.json",
+            historical_df=historical_df,
+            simulation_start=simulation_start,
+            vol_target=VOL_TARGET,
+            indicator_cache=indicator_cache,
+            lean=LEAN,
+            memory_report=memory_report,
+            instruments_keys=instruments_keys,
+        )
+        for name, subsys in [("lbmom", Lbmom), ("lsmom", Lsmom)]
+    ]
 
-lbmom_strat = Lbmom(
-    instruments_config="./subsystems/lbmom/sp500_instruments.json",
-    historical_df=historical_df,
-    simulation_start=simulation_start,
-    vol_target=VOL_TARGET,
-)
+    if CHUNK_SIZE is None:
+        results = batch_utils.run_subsystems(strats, max_workers=max_workers)
+    else:
+        # the whole index, or only the instruments of the 'instruments_keys'
+        # lists of the instruments configs
+        instruments = (
+            data_utils.get_sp500_instruments()
+            if instruments_keys is None
+            else list(
+                dict.fromkeys(
+                    inst for strat in strats for inst in strat.get_instruments()
+                )
+            )
+        )
+        results = chunked_engine.run_chunked(
+            instruments=instruments,
+            get_chunk_df=lambda chunk_idx, chunk: data_utils.get_chunk_df(
+                chunk,
+                index_ticker="AMZN",
+                period="5y",
+                ohlcv_path=(
+                    OHLCV_CHUNK_PATH.format(chunk_idx) if INCREMENTAL else None
+                ),
+            ),
+            subsystems=strats,
+            spill_dir=SPILL_DIR,
+            chunk_size=CHUNK_SIZE,
+            lean=LEAN,
+            sim_years=SIM_YEARS,
+            historical_path=HISTORICAL_PATH,
+            max_workers=max_workers,
+            memory_report=memory_report,
+        )
+    for sysname, (portfolio_df, instruments) in results.items():
+        storage.save_portfolio_df(
+            portfolio_df,
+            f"./Data/sp500/{sysname.lower()}_strat.parquet",
+            csv_path=f"./Data/sp500/{sysname.lower()}_strat.csv",
+        )
 
-portfolio_lbmom_df, instruments = lbmom_strat.get_subsys_pos()
-portfolio_lbmom_df.to_csv("./Data/sp500/lbmom_strat.csv")
+    # the indicators of earlier histories are never hit again, see
+    # 'IndicatorCache.prune()'
+    indicator_cache.prune()
+    memory_report.print_report()
+    profiling_utils.print_summary()
+    return batch_utils.get_summary("sp500", results)
 
-lsmom_strat = Lsmom(
-    instruments_config="./subsystems/lsmom/sp500_instruments.json",
-    historical_df=historical_df,
-    simulation_start=simulation_start,
-    vol_target=VOL_TARGET,
-)
 
-portfolio_lsmom_df, instruments = lsmom_strat.get_subsys_pos()
-portfolio_lsmom_df.to_csv("./Data/sp500/lsmom_strat.csv")
+if __name__ == "__main__":
+    main()
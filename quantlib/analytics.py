@@ -0,0 +1,214 @@
+import numpy as np
+
+from numpy.lib.stride_tricks import sliding_window_view
+
+"""
+Performance analytics of backtest outputs, for many portfolios at once.
+
+Every function takes the daily series of P portfolios stacked along the first
+axis, (portfolios x days) arrays such as 'capital' and 'capital ret', or
+(portfolios x days x instruments) arrays such as 'units', and returns one value
+(or one series) per portfolio, without looping over the portfolios. A single
+portfolio is a stack of one. Series of different lengths, e.g. the windows of a
+walk-forward run, are padded with NaN at their end by 'stack_series()'; the
+metrics ignore NaN. As in 'portfolio_df' the first day has no return, PnL or
+trades, so the metrics start from the second day.
+
+The parameter sweeps, walk-forward runs and the portfolio reduce each backtest
+to the series of 'get_series()' in their workers and score them in bulk with
+'get_metrics()'.
+"""
+
+TRADING_DAYS = 253
+
+
+def get_traded(units, dollar_value):
+    """
+    This function returns the nominal traded every day, the change of the
+    'units' (NaN counting as 0) valued at 'dollar_value' (see
+    'backtest_utils.get_unit_conversions()'), summed over the instruments.
+    'dollar_value' is a (days x instruments) array shared by all portfolios or
+    one array per portfolio. The first day is NaN.
+    """
+    units = np.nan_to_num(units)
+    with np.errstate(invalid="ignore"):
+        traded = np.nansum(
+            np.abs(np.diff(units, axis=1)) * dollar_value[..., 1:, :], axis=2
+        )
+    return np.concatenate([np.full((len(units), 1), np.nan), traded], axis=1)
+
+
+def get_series(results, dollar_value):
+    """
+    This function reduces the results of one backtest (see
+    'array_engine.simulate_arrays()') to the daily series the metrics are
+    computed from: 'capital', 'capital ret' and 'traded' (see 'get_traded()')
+    """
+    return {
+        "capital": results["capital"],
+        "capital ret": results["capital ret"],
+        "traded": get_traded(results["units"][np.newaxis], dollar_value)[0],
+    }
+
+
+def get_frame_series(portfolio_df, dollar_value=None):
+    """
+    This function takes the series of 'get_series()' from a 'portfolio_df'
+    (e.g. read from lbmom_strat.csv). 'portfolio_df' does not hold the dollar
+    values of the instruments, without 'dollar_value' (ordered as its units
+    columns) 'traded' is NaN.
+    """
+    units = portfolio_df[
+        [col for col in portfolio_df.columns if col.endswith(" units")]
+    ].to_numpy(dtype=np.float64)
+    return {
+        "capital": portfolio_df["capital"].to_numpy(dtype=np.float64),
+        "capital ret": portfolio_df["capital ret"].to_numpy(dtype=np.float64),
+        "traded": (
+            get_traded(units[np.newaxis], dollar_value)[0]
+            if dollar_value is not None
+            else np.full(len(units), np.nan)
+        ),
+    }
+
+
+def stack_series(series_list):
+    """
+    This function stacks the series of several portfolios, dicts of 1-D
+    arrays as returned by 'get_series()', into (portfolios x days) arrays,
+    padding the shorter series with NaN at their end
+    """
+    n_days = max(len(series["capital"]) for series in series_list)
+    stacked = {}
+    for name in series_list[0]:
+        stacked[name] = np.full((len(series_list), n_days), np.nan)
+        for k, series in enumerate(series_list):
+            stacked[name][k, : len(series[name])] = series[name]
+    return stacked
+
+
+def get_annual_return(rets):
+    return np.nanmean(rets, axis=-1) * TRADING_DAYS
+
+
+def get_annual_vol(rets):
+    return np.nanstd(rets, axis=-1, ddof=1) * np.sqrt(TRADING_DAYS)
+
+
+def get_sharpe(rets):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return get_annual_return(rets) / get_annual_vol(rets)
+
+
+def get_drawdowns(capital):
+    """
+    This function returns the drawdown of the capital every day, the loss
+    from its running maximum as a fraction of it
+    """
+    return 1 - capital / np.fmax.accumulate(capital, axis=-1)
+
+
+def get_max_drawdown(capital):
+    return np.nanmax(get_drawdowns(capital), axis=-1)
+
+
+def get_drawdown_days(capital):
+    """
+    This function returns the longest time under water, the largest number of
+    days between a maximum of the capital and the day it is first exceeded (or
+    the last day)
+    """
+    days = np.arange(capital.shape[-1])
+    # the last day the capital was at its running maximum
+    at_max = ~(get_drawdowns(capital) > 0)
+    last_max = np.maximum.accumulate(np.where(at_max, days, 0), axis=-1)
+    return np.max(days - last_max, axis=-1)
+
+
+def get_turnover(traded, capital):
+    """
+    This function returns the annualised turnover, the nominal traded every
+    day as a multiple of the capital
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.nanmean(traded[..., 1:] / capital[..., 1:], axis=-1) * TRADING_DAYS
+
+
+def get_metrics(series):
+    """
+    This function returns the metrics of the portfolios of 'series' (see
+    'stack_series()'), one array over the portfolios each: the annualised
+    return, volatility and Sharpe ratio of the capital returns, the maximum
+    drawdown of the capital and its duration in days, and the annualised
+    turnover
+    """
+    capital, rets = series["capital"], series["capital ret"][..., 1:]
+    return {
+        "return": get_annual_return(rets),
+        "vol": get_annual_vol(rets),
+        "sharpe": get_sharpe(rets),
+        "max drawdown": get_max_drawdown(capital),
+        "drawdown days": get_drawdown_days(capital),
+        "turnover": get_turnover(series["traded"], capital),
+    }
+
+
+def get_rolling_windows(values, window):
+    """
+    This function returns the trailing windows of 'window' days of every day,
+    (portfolios x days x window), the days before the first complete window
+    being padded with NaN
+    """
+    padded = np.concatenate(
+        [np.full(values.shape[:-1] + (window - 1,), np.nan), values], axis=-1
+    )
+    return sliding_window_view(padded, window, axis=-1)
+
+
+def get_rolling_return(rets, window):
+    """
+    This function returns the annualised return over the trailing 'window'
+    days, NaN unless the window holds 'window' returns (as pandas' rolling
+    functions do by default)
+    """
+    return np.mean(get_rolling_windows(rets, window), axis=-1) * TRADING_DAYS
+
+
+def get_rolling_vol(rets, window):
+    return np.std(get_rolling_windows(rets, window), axis=-1, ddof=1) * np.sqrt(
+        TRADING_DAYS
+    )
+
+
+def get_rolling_sharpe(rets, window):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return get_rolling_return(rets, window) / get_rolling_vol(rets, window)
+
+
+def get_attribution(units, close, val_fx):
+    """
+    This function returns the PnL of every instrument every day, (portfolios
+    x days x instruments): the previous day's units times the price change,
+    converted to USD with the previous day's 'val_fx' (see
+    'backtest_utils.get_day_stats()'). Summed over the instruments it gives the
+    'daily pnl' of the portfolio. 'close' and 'val_fx' are (days x instruments)
+    arrays shared by all portfolios or one array per portfolio. The first day
+    is NaN.
+    """
+    prev_units = units[..., :-1, :]
+    with np.errstate(invalid="ignore"):
+        inst_pnl = np.where(
+            prev_units != 0,
+            np.diff(close, axis=-2) * val_fx[..., :-1, :] * prev_units,
+            0,
+        )
+    first = np.full(inst_pnl.shape[:-2] + (1,) + inst_pnl.shape[-1:], np.nan)
+    return np.concatenate([first, inst_pnl], axis=-2)
+
+
+def get_inst_pnl(units, close, val_fx):
+    """
+    This function returns the total PnL of every instrument over the whole
+    backtest, (portfolios x instruments), see 'get_attribution()'
+    """
+    return np.nansum(get_attribution(units, close, val_fx), axis=-2)
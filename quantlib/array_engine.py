@@ -0,0 +1,294 @@
+import os
+import numpy as np
+import pandas as pd
+import quantlib.backtest_utils as backtest_utils
+import quantlib.ledger as ledger
+
+"""
+Array-backed simulation engine for the momentum subsystems.
+
+The pandas path in the subsystems reads and writes single cells with `.loc` for
+every instrument on every day. Here all inputs the day loop needs are pulled
+out of `historical_data` once as contiguous (dates x instruments) NumPy arrays,
+the loop runs over integer positions and `portfolio_df` is only built at the
+end, with the same columns, column order and values as the pandas path.
+"""
+
+# the (dates x instruments) arrays the day loop reads, see `build_panels()`
+PANEL_FIELDS = [
+    "halted",
+    "close",
+    "ret",
+    "ret_vol",
+    "forecasts",
+    "val_fx",
+    "dollar_value",
+]
+
+
+def get_panel(historical_data, instruments, field):
+    """
+    This function extracts the `{inst} {field}` columns for all instruments
+    as a float (dates x instruments) array
+    """
+    columns = [f"{inst} {field}" for inst in instruments]
+    return historical_data[columns].to_numpy(dtype=np.float64)
+
+
+def build_panels(historical_data, instruments, simulation_start, pairs, get_votes):
+    """
+    This function extracts from `historical_data` (already extended with the
+    `adx` and `ema` columns) every input of the day loop as a (dates x
+    instruments) array over the simulation period, and returns them in a dict
+    together with the simulation `dates` and the `instruments`.
+    `get_votes` maps a (dates x instruments) array of EMA differences for one
+    pair to the votes that pair casts, which is the only place where the
+    subsystems differ.
+    Every array only depends on the columns of its own instrument (and of the
+    `{quote}_USD close` column of denominated instruments), so the panels of
+    disjoint groups of instruments can be built separately and joined with
+    `concat_panels()`.
+    """
+    sim_index = historical_data[simulation_start:].index
+    start = len(historical_data.index) - len(sim_index)
+    n_days, n_inst = len(sim_index), len(instruments)
+
+    # Activity masks are computed over the full history so that the trailing
+    # windows at the start of the simulation look back before `simulation_start`
+    halted, all_active = backtest_utils.get_activity_masks(
+        historical_data, instruments, halt_window=5, active_window=25
+    )
+    halted, all_active = halted[start:], all_active[start:]
+
+    close = get_panel(historical_data, instruments, "close")[start:]
+    val_fx, dollar_value = backtest_utils.get_unit_conversions(
+        historical_data, instruments
+    )
+    val_fx, dollar_value = val_fx[start:], dollar_value[start:]
+    ret = get_panel(historical_data, instruments, "% ret")[start:]
+    ret_vol = np.where(
+        all_active,
+        get_panel(historical_data, instruments, "% ret vol")[start:],
+        0.025,
+    )
+
+    votes = np.zeros((n_days, n_inst))
+    for pair in pairs:
+        votes += get_votes(
+            get_panel(historical_data, instruments, f"ema{str(pair)}")[start:]
+        )
+    adx = get_panel(historical_data, instruments, "adx")[start:]
+    forecasts = np.where(adx < 25, 0, votes / len(pairs))
+
+    return {
+        "dates": sim_index,
+        "instruments": list(instruments),
+        "halted": halted,
+        "close": close,
+        "ret": ret,
+        "ret_vol": ret_vol,
+        "forecasts": forecasts,
+        "val_fx": val_fx,
+        "dollar_value": dollar_value,
+    }
+
+
+def concat_panels(panels_list):
+    """
+    This function joins the panels of disjoint groups of instruments, built
+    over the same simulation dates, into the panels of all instruments
+    """
+    dates = panels_list[0]["dates"]
+    for panels in panels_list[1:]:
+        if not dates.equals(panels["dates"]):
+            raise Exception("Panels cover different simulation dates")
+    joined = {
+        "dates": dates,
+        "instruments": [
+            inst for panels in panels_list for inst in panels["instruments"]
+        ],
+    }
+    for field in PANEL_FIELDS:
+        joined[field] = np.hstack([panels[field] for panels in panels_list])
+    return joined
+
+
+def save_panels(path, panels):
+    """
+    This function spills panels to disk as an uncompressed .npz file
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    np.savez(
+        path,
+        dates=np.array(panels["dates"], dtype="datetime64[D]"),
+        instruments=np.array(panels["instruments"], dtype=str),
+        **{field: panels[field] for field in PANEL_FIELDS},
+    )
+
+
+def load_panels(path):
+    """
+    This function loads panels saved with `save_panels()`
+    """
+    with np.load(path) as data:
+        panels = {field: data[field] for field in PANEL_FIELDS}
+        panels["dates"] = pd.Index(data["dates"].astype(object), name="date")
+        panels["instruments"] = data["instruments"].tolist()
+    return panels
+
+
+def run_simulation(
+    historical_data,
+    instruments,
+    simulation_start,
+    pairs,
+    get_votes,
+    vol_target,
+    capital=10000,
+    debug=False,
+):
+    """
+    This function runs the momentum backtest over `historical_data` (already
+    extended with the `adx` and `ema` columns) and returns `portfolio_df`,
+    see `build_panels()` and `simulate_panels()`.
+    """
+    panels = build_panels(
+        historical_data, instruments, simulation_start, pairs, get_votes
+    )
+    return simulate_panels(panels, vol_target, capital=capital, debug=debug)
+
+
+def simulate_day(day, prev_day, vol_target, scalar_calculator, capital=10000):
+    """
+    This function runs one day of the day loop. `day` holds the day's rows of
+    the panels (see `PANEL_FIELDS`) and `prev_day` is what this function
+    returned for the previous day, or None on the first day of the simulation.
+    Returns `day` completed with the day's capital, strategy scalar, units,
+    weights, nominal, leverage, pnl and returns, and feeds the day to the
+    strategy scalar window `scalar_calculator`.
+    """
+    n_inst = len(day["close"])
+    day = dict(day)
+    strat_scalar = 2  # default scaling up for strategy
+    tradable = ~day["halted"]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if prev_day is None:
+            day["capital"] = capital
+            day["daily pnl"] = day["nominal ret"] = day["capital ret"] = np.nan
+        else:
+            day_pnl, nominal_ret, capital_ret = backtest_utils.get_day_stats(
+                prev_units=prev_day["units"],
+                prev_weights=prev_day["weights"],
+                price_change=day["close"] - prev_day["close"],
+                val_fx=prev_day["val_fx"],
+                rets=day["ret"],
+                prev_leverage=prev_day["leverage"],
+            )
+            day["capital"] = prev_day["capital"] + day_pnl
+            day["daily pnl"] = day_pnl
+            day["nominal ret"] = nominal_ret
+            day["capital ret"] = capital_ret
+            strat_scalar = scalar_calculator.get_strat_scalar()
+        day["strat scalar"] = strat_scalar
+
+        units = np.full(n_inst, np.nan)
+        weights = np.full(n_inst, np.nan)
+        units[~tradable] = 0
+        weights[~tradable] = 0
+        nominal_total = 0
+        n_tradable = np.count_nonzero(tradable)
+        if n_tradable:
+            position_vol_target = (
+                (1 / n_tradable) * day["capital"] * vol_target / np.sqrt(253)
+            )
+            dollar_volatility = day["close"] * day["ret_vol"] * day["val_fx"]
+            positions = (
+                strat_scalar
+                * day["forecasts"]
+                * position_vol_target
+                / dollar_volatility
+            )
+            nominal_inst = np.abs(positions * day["dollar_value"])
+            nominal_total = backtest_utils.sequential_sum(nominal_inst[tradable])
+            units[tradable] = positions[tradable]
+            weights[tradable] = nominal_inst[tradable] / nominal_total
+        day["units"] = units
+        day["weights"] = weights
+        day["nominal"] = nominal_total
+        day["leverage"] = nominal_total / day["capital"]
+
+    # Only rows without any NaN enter the window, i.e. the rows
+    # `get_strat_scalar` keeps after `dropna()`
+    if prev_day is not None and not (
+        np.isnan(units).any()
+        or np.isnan(weights).any()
+        or np.isnan(
+            [
+                day[field]
+                for field in [
+                    "capital",
+                    "strat scalar",
+                    "nominal",
+                    "leverage",
+                    "daily pnl",
+                    "nominal ret",
+                    "capital ret",
+                ]
+            ]
+        ).any()
+    ):
+        scalar_calculator.update(day["capital ret"], strat_scalar)
+    return day
+
+
+def simulate_arrays(panels, vol_target, capital=10000, lookback=100):
+    """
+    This function runs the day loop of the momentum backtest over the panels
+    built by `build_panels()` (only the `PANEL_FIELDS` are read) and returns
+    the daily results as arrays: the (dates x instruments) `units` and
+    `weights` and one value per day for the other fields of `portfolio_df`
+    (`capital`, `strat scalar`, `nominal`, ...). `lookback` is the window of
+    the strategy scalar.
+    """
+    n_days, n_inst = panels["close"].shape
+    results = ledger.allocate_values(n_days, n_inst)
+
+    scalar_calculator = backtest_utils.RollingStratScalar(
+        lookback=lookback, vol_target=vol_target, default=2
+    )
+
+    day = None
+    for i in range(n_days):
+        day = simulate_day(
+            {field: panels[field][i] for field in PANEL_FIELDS},
+            day,
+            vol_target,
+            scalar_calculator,
+            capital=capital,
+        )
+        for field, values in results.items():
+            values[i] = day[field]
+    return results
+
+
+def simulate_panels(panels, vol_target, capital=10000, lookback=100, debug=False):
+    """
+    This function runs the day loop of the momentum backtest over the panels
+    built by `build_panels()` and returns `portfolio_df`
+    """
+    results = simulate_arrays(panels, vol_target, capital=capital, lookback=lookback)
+    # instruments halted on the first day get their columns first, as in the
+    # pandas path, see `ledger.PortfolioLedger`
+    portfolio_df = ledger.PortfolioLedger(
+        dates=panels["dates"],
+        instruments=panels["instruments"],
+        first_halted=panels["halted"][0] if len(panels["dates"]) else None,
+        values=results,
+    ).to_frame()
+
+    if debug:
+        for i in portfolio_df.index:
+            print(portfolio_df.loc[i])
+
+    return portfolio_df
@@ -42,6 +42,60 @@ def get_backtest_day_stats(
     return day_pnl
 
 
+def get_ledger_day_stats(portfolio_ledger, date_idx, price_change, val_fx, rets):
+    """
+    This function is 'get_backtest_day_stats()' for a 'ledger.PortfolioLedger',
+    computed with the batched 'get_day_stats()': the previous day's units,
+    weights and leverage are read and the day's capital, PnL and returns are
+    written by row position. 'price_change' (today's close minus the previous
+    close), 'val_fx' (the previous day's row of 'get_unit_conversions()') and
+    'rets' (today's '% ret') are vectors over the instruments in the order of
+    the ledger, taken from arrays built once per run. The sums are accumulated
+    in instrument order, so the results are the same as with the reference.
+    """
+    day_pnl, nominal_ret, capital_ret = get_day_stats(
+        prev_units=portfolio_ledger.units[date_idx - 1],
+        prev_weights=portfolio_ledger.weights[date_idx - 1],
+        price_change=price_change,
+        val_fx=val_fx,
+        rets=rets,
+        prev_leverage=portfolio_ledger.get(date_idx - 1, "leverage"),
+    )
+    portfolio_ledger.set(
+        date_idx, "capital", portfolio_ledger.get(date_idx - 1, "capital") + day_pnl
+    )
+    portfolio_ledger.set(date_idx, "daily pnl", day_pnl)
+    portfolio_ledger.set(date_idx, "nominal ret", nominal_ret)
+    portfolio_ledger.set(date_idx, "capital ret", capital_ret)
+    return day_pnl
+
+
+def get_day_stats(prev_units, prev_weights, price_change, val_fx, rets, prev_leverage):
+    """
+    This function is the batched counterpart of 'get_backtest_day_stats()'. It
+    takes the previous day's units and weights, today's price changes and
+    '% ret', and the USD conversion of a unit value change (see
+    'unit_val_change()') as vectors over all instruments and returns the
+    day's PnL, nominal return and capital return. As in the loop, only
+    instruments with non-zero previous holdings contribute, and the sums are
+    accumulated in instrument order so both give the same result.
+    """
+    held = prev_units != 0
+    inst_pnl = price_change * val_fx * prev_units
+    day_pnl = sequential_sum(inst_pnl[held])
+    nominal_ret = sequential_sum(prev_weights[held] * rets[held])
+    capital_ret = nominal_ret * prev_leverage
+    return day_pnl, nominal_ret, capital_ret
+
+
+def sequential_sum(values):
+    """
+    This function sums values left to right, starting from 0, exactly like
+    accumulating them with '+=' in a Python loop does
+    """
+    return np.cumsum(values)[-1] if len(values) else 0
+
+
 def get_strat_scalar(portfolio_df, lookback, vol_target, idx, default):
     """
     This function calculates a scaling factor ('strat_scalar') based on historical capital
@@ -63,6 +117,149 @@ def get_strat_scalar(portfolio_df, lookback, vol_target, idx, default):
         return default
 
 
+class RollingStratScalar:
+    """
+    This class calculates the same scaling factor as 'get_strat_scalar()' in
+    constant time per day. Instead of re-slicing 'portfolio_df' on every day,
+    it keeps the last 'lookback' complete days (rows that 'dropna()' would
+    keep) in ring buffers and maintains the mean and sum of squared deviations
+    of 'capital ret' and the mean of 'strat scalar' with Welford's updates.
+    'get_strat_scalar()' is kept as the reference implementation, both agree up
+    to floating point rounding.
+    """
+
+    def __init__(self, lookback, vol_target, default):
+        self.lookback = lookback
+        self.vol_target = vol_target
+        self.default = default
+        self.capital_rets = np.zeros(lookback)
+        self.strat_scalars = np.zeros(lookback)
+        self.count = 0
+        self.pos = 0
+        self.ret_mean = 0.0
+        self.ret_m2 = 0.0
+        self.scalar_mean = 0.0
+
+    def update(self, capital_ret, strat_scalar):
+        """
+        Add one complete day to the window, evicting the oldest day once the
+        window holds 'lookback' days
+        """
+        if self.count < self.lookback:
+            self.count += 1
+            delta = capital_ret - self.ret_mean
+            self.ret_mean += delta / self.count
+            self.ret_m2 += delta * (capital_ret - self.ret_mean)
+            self.scalar_mean += (strat_scalar - self.scalar_mean) / self.count
+        else:
+            old_ret = self.capital_rets[self.pos]
+            old_mean = self.ret_mean
+            self.ret_mean += (capital_ret - old_ret) / self.lookback
+            self.ret_m2 += (capital_ret - old_ret) * (
+                capital_ret - self.ret_mean + old_ret - old_mean
+            )
+            self.scalar_mean += (
+                strat_scalar - self.strat_scalars[self.pos]
+            ) / self.lookback
+        self.capital_rets[self.pos] = capital_ret
+        self.strat_scalars[self.pos] = strat_scalar
+        self.pos = (self.pos + 1) % self.lookback
+
+    def get_strat_scalar(self):
+        if self.count == self.lookback:  # enough data
+            annualized_vol = np.sqrt(
+                max(self.ret_m2, 0.0) / (self.lookback - 1)
+            ) * np.sqrt(253)
+            return self.scalar_mean * self.vol_target / annualized_vol
+        else:
+            return self.default
+
+
+def get_consecutive_days(mask):
+    """
+    This function counts, for every row of a (dates x instruments) boolean
+    array, how many consecutive rows up to and including that row are True.
+    It is computed once for the whole history instead of re-slicing the
+    history on every day.
+    """
+    rows = np.arange(len(mask)).reshape(-1, *([1] * (np.ndim(mask) - 1)))
+    last_false = np.maximum.accumulate(np.where(mask, -1, rows), axis=0)
+    return rows - last_false
+
+
+def get_activity_masks(historical_data, instruments, halt_window=5, active_window=25):
+    """
+    This function builds two (dates x instruments) boolean masks from the
+    '{inst} active' columns produced by 'data_utils.extend_dataframe()',
+    to be queried by row position:
+    1. 'halted' - the instrument was inactive on each of the last 'halt_window'
+       days, the same as '(~historical_data[:date].tail(halt_window)[active]).all()'
+    2. 'all_active' - the instrument was active on each of the last
+       'active_window' days, the same as
+       'historical_data[:date].tail(active_window)[active].all()'
+    Near the start of the history the windows are shortened to the rows
+    available, like '.tail()' does.
+    """
+    active = historical_data[[f"{inst} active" for inst in instruments]].to_numpy(
+        dtype=np.float64
+    )
+    tail_len = np.arange(1, len(active) + 1).reshape(-1, 1)
+    inactive_days = get_consecutive_days(active == 0)
+    active_days = get_consecutive_days(active == 1)
+    halted = (inactive_days >= np.minimum(tail_len, halt_window)) & ~np.isnan(active)
+    all_active = active_days >= np.minimum(tail_len, active_window)
+    return halted, all_active
+
+
+def get_denominations(instruments):
+    """
+    This function parses every instrument name once and returns a table
+    {inst: (is_denominated, base, quote)}, e.g. 'HK33_HKD' -> (True, 'HK33', 'HKD').
+    Instruments that are not denominated (AAPL, BTC-USD) are assumed to be
+    in USD and map to (False, inst, 'USD').
+    """
+    denominations = {}
+    for inst in instruments:
+        if len(inst.split("_")) == 2:
+            base, quote = inst.split("_")
+            denominations[inst] = (True, base, quote)
+        else:
+            denominations[inst] = (False, inst, "USD")
+    return denominations
+
+
+def get_unit_conversions(historical_data, instruments, denominations=None):
+    """
+    This function builds, once per run, the USD conversions that
+    'unit_val_change()' and 'unit_dollar_value()' look up on every call, as
+    two (dates x instruments) arrays aligned with 'historical_data':
+    1. 'val_fx' - multiplier converting a value change of one unit into USD,
+       i.e. 'unit_val_change(inst, x, historical_data, date) == x * val_fx'
+    2. 'dollar_value' - the contract dollar value, i.e. the value of
+       'unit_dollar_value(inst, historical_data, date)'
+    """
+    if denominations is None:
+        denominations = get_denominations(instruments)
+    close = historical_data[[f"{inst} close" for inst in instruments]].to_numpy(
+        dtype=np.float64
+    )
+    val_fx = np.ones_like(close)
+    dollar_value = close.copy()  # e.g. AAPL, 1 contract is worth the price of AAPL
+    for j, inst in enumerate(instruments):
+        is_denominated, base, quote = denominations[inst]
+        if not is_denominated:
+            continue
+        quote_fx = (
+            np.ones(len(close))
+            if quote == "USD"
+            else historical_data[f"{quote}_USD close"].to_numpy(dtype=np.float64)
+        )
+        val_fx[:, j] = quote_fx
+        # USD_JPY -> one unit is worth 1 USD, HK33_HKD -> the price in HKD * HKD_USD
+        dollar_value[:, j] = 1 if base == "USD" else close[:, j] * quote_fx
+    return val_fx, dollar_value
+
+
 # Calculate the value change for a single unit
 def unit_val_change(from_prod, val_change, historical_data, date):
     is_denominated = (
@@ -75,7 +272,7 @@ def unit_val_change(from_prod, val_change, historical_data, date):
     else:
         return (
             val_change
-            * historical_data.loc[date, f"{from_prod.split("_")[1]}_USD close"]
+            * historical_data.loc[date, f"{from_prod.split('_')[1]}_USD close"]
         )
 
 
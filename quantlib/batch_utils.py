@@ -0,0 +1,98 @@
+import pandas as pd
+import quantlib.shared_utils as shared_utils
+
+from concurrent.futures import ProcessPoolExecutor
+
+"""
+Running the subsystems of a market in separate processes.
+
+'run_subsystems()' is what the pull scripts call once 'historical_df' is
+ready. The indicators of every subsystem are computed first in the calling
+process (through the IndicatorCache the subsystems share, so that the ADX and
+the EMA spans they have in common are computed once) and joined with the prices
+into a single panel. The panel is copied once into shared memory (see
+'shared_utils.share_frame()'): each worker process receives the subsystem with
+the manifest of the panel instead of a pickled 'historical_df', attaches to it
+without copying and only runs its simulation, so N workers cost roughly one
+copy of the panel in RAM.
+"""
+
+
+def get_panel(strats):
+    """
+    This function returns the price and indicator panel of 'strats', which
+    share one 'historical_df': the columns of every extended frame (see
+    'extend_historicals()'), each taken once
+    """
+    historical_df = strats[0].historical_df
+    if any(strat.historical_df is not historical_df for strat in strats):
+        raise Exception("The subsystems do not share the same historical_df")
+    frames = []
+    for strat in strats:
+        extended = strat.extend_historicals(strat.get_instruments(), historical_df)
+        seen = {col for frame in frames for col in frame.columns}
+        frames.append(extended[[col for col in extended.columns if col not in seen]])
+    return pd.concat(frames, axis=1)
+
+
+def get_subsys_pos(strat):
+    """
+    This function runs one subsystem in a worker process and returns its
+    'portfolio_df', instruments and the stages it added to its memory report
+    """
+    report = strat.memory_report
+    n_stages = len(report.stages) if report is not None else 0
+    portfolio_df, instruments = strat.get_subsys_pos()
+    stages = report.stages[n_stages:] if report is not None else []
+    return portfolio_df, instruments, stages
+
+
+def run_subsystems(strats, max_workers=None):
+    """
+    This function runs 'get_subsys_pos()' of every subsystem of 'strats', one
+    process each (at most 'max_workers' at a time, in this process with
+    max_workers=1), and returns {sysname: (portfolio_df, instruments)}. The
+    stages recorded by a worker in the subsystem's MemoryReport are added to
+    the report of this process. Scripts calling it must be guarded by
+    'if __name__ == "__main__"'.
+    """
+    if max_workers == 1:
+        return {strat.sysname: strat.get_subsys_pos() for strat in strats}
+
+    shm, manifest = shared_utils.share_frame(get_panel(strats))
+    results = {}
+    try:
+        for strat in strats:
+            strat.historical_manifest = manifest
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(get_subsys_pos, strat) for strat in strats]
+            for strat, future in zip(strats, futures):
+                portfolio_df, instruments, stages = future.result()
+                if strat.memory_report is not None:
+                    strat.memory_report.stages.extend(stages)
+                results[strat.sysname] = (portfolio_df, instruments)
+    finally:
+        for strat in strats:
+            strat.historical_manifest = None
+        shm.close()
+        shm.unlink()
+    return results
+
+
+def get_summary(market, results):
+    """
+    This function summarises the results of the subsystems of a market,
+    {sysname: (portfolio_df, instruments)}, for the run summary of the batch
+    runner: the number of instruments and days and the final capital
+    """
+    return {
+        "market": market,
+        "subsystems": {
+            sysname: {
+                "instruments": len(instruments),
+                "days": len(portfolio_df.index),
+                "capital": float(portfolio_df["capital"].iloc[-1]),
+            }
+            for sysname, (portfolio_df, instruments) in results.items()
+        },
+    }
@@ -0,0 +1,195 @@
+import os
+import pandas as pd
+import quantlib.data_utils as data_utils
+import quantlib.storage as storage
+import quantlib.array_engine as array_engine
+import quantlib.profiling_utils as profiling_utils
+
+from concurrent.futures import ProcessPoolExecutor
+from dateutil.relativedelta import relativedelta
+
+"""
+Chunked execution of the subsystems over large universes (e.g. the whole S&P 500).
+
+Instruments are processed in chunks through download -> 'extend_dataframe()'
+-> indicators -> forecasts, and each chunk is reduced to the (dates x
+instruments) panels the day loop reads (see 'array_engine.build_panels()'),
+which are spilled to disk together with the chunk's 'historical_df'. Only one
+chunk's wide frames are held in memory at a time; the day loop, which couples
+all instruments through the shared capital, then runs once over the joined
+panels, a few floats per instrument and day (one process per subsystem, each
+loading its own panels from disk). The spilled 'historical_df' of the chunks
+are joined into the 'historical_df' of all instruments afterwards (see
+'combine_historical_dfs()'), for the scripts reading it like run_portfolio.py.
+
+As the panels of a denominated instrument use the '{quote}_USD close' column,
+such instruments must be in the same chunk as that FX leg, this is not an
+issue for USD listed universes like the S&P 500 or crypto.
+"""
+
+
+def get_chunks(instruments, chunk_size):
+    return [
+        instruments[k : k + chunk_size] for k in range(0, len(instruments), chunk_size)
+    ]
+
+
+def get_panels_path(spill_dir, sysname, chunk_idx):
+    return os.path.join(spill_dir, sysname.lower(), f"panels_{chunk_idx:04d}.npz")
+
+
+def get_historical_path(spill_dir, chunk_idx):
+    return os.path.join(spill_dir, f"historical_df_{chunk_idx:04d}.parquet")
+
+
+@profiling_utils.timed()
+def combine_historical_dfs(spill_dir, n_chunks, path):
+    """
+    This function joins the 'historical_df' spilled by the first 'n_chunks'
+    chunks into the 'historical_df' of all instruments and stores it at 'path'.
+    The joined frame is as large as the one of an in-memory run, it is built
+    once the simulation is done.
+    """
+    historical_dfs = [
+        storage.load_historical_df(get_historical_path(spill_dir, chunk_idx))
+        for chunk_idx in range(n_chunks)
+    ]
+    dates = historical_dfs[0].index
+    for historical_df in historical_dfs[1:]:
+        if not dates.equals(historical_df.index):
+            raise Exception("Chunks cover different dates")
+    historical_df = pd.concat(historical_dfs, axis=1)
+    del historical_dfs
+    storage.save_historical_df(historical_df, path)
+    return historical_df
+
+
+@profiling_utils.timed()
+def spill_chunk(
+    chunk_idx,
+    chunk,
+    get_chunk_df,
+    subsystems,
+    spill_dir,
+    fx_codes,
+    lean,
+    memory_report,
+    sim_years,
+):
+    """
+    This function downloads and extends one chunk of instruments and spills its
+    'historical_df' and the panels of every subsystem to 'spill_dir'. With
+    'sim_years' the 'simulation_start' of the subsystems is set 'sim_years'
+    before the last date of the chunk (the same for all chunks).
+    """
+    historical_data = data_utils.extend_dataframe(
+        traded=chunk,
+        df=get_chunk_df(chunk_idx, chunk),
+        fx_codes=fx_codes,
+        lean=lean,
+    )
+    if memory_report is not None:
+        memory_report.record(f"chunk {chunk_idx} historical_df", historical_data)
+    storage.save_historical_df(
+        historical_data, get_historical_path(spill_dir, chunk_idx)
+    )
+    if sim_years is not None:
+        for subsys in subsystems:
+            subsys.simulation_start = historical_data.index[-1] - relativedelta(
+                years=sim_years
+            )
+    for subsys in subsystems:
+        array_engine.save_panels(
+            get_panels_path(spill_dir, subsys.sysname, chunk_idx),
+            subsys.get_panels(instruments=chunk, historical_data=historical_data),
+        )
+
+
+def simulate_chunks(sysname, vol_target, spill_dir, n_chunks, debug=False):
+    """
+    This function joins the panels spilled by the first 'n_chunks' chunks for
+    the subsystem 'sysname' and runs its simulation over them, it returns the
+    'portfolio_df' and the instruments
+    """
+    panels = array_engine.concat_panels(
+        [
+            array_engine.load_panels(get_panels_path(spill_dir, sysname, chunk_idx))
+            for chunk_idx in range(n_chunks)
+        ]
+    )
+    portfolio_df = array_engine.simulate_panels(
+        panels=panels, vol_target=vol_target, debug=debug
+    )
+    return portfolio_df, panels["instruments"]
+
+
+@profiling_utils.timed()
+def run_chunked(
+    instruments,
+    get_chunk_df,
+    subsystems,
+    spill_dir,
+    chunk_size=50,
+    fx_codes=None,
+    lean=False,
+    sim_years=None,
+    historical_path=None,
+    max_workers=None,
+    memory_report=None,
+    debug=False,
+):
+    """
+    This function runs the subsystems (Lbmom, Lsmom) over 'instruments' in
+    chunks of 'chunk_size'. 'get_chunk_df(chunk_idx, chunk)' returns the OHLCV
+    DataFrame of the chunk 'chunk_idx', all chunks aligned on the same dates
+    (see 'data_utils.get_chunk_df()'). 'fx_codes' are passed to
+    'extend_dataframe()' (none by default). With 'sim_years' the subsystems
+    simulate the last 'sim_years' of the data, instead of from their
+    'simulation_start', and with 'historical_path' the 'historical_df' of all
+    instruments is stored there (see 'combine_historical_dfs()'). Every
+    subsystem trades all of 'instruments'. The simulations of the subsystems
+    run in at most 'max_workers' processes, in this process with
+    max_workers=1. Returns {sysname: (portfolio_df, instruments)}, with the
+    same 'portfolio_df' as the numpy engine over all instruments at once.
+    Scripts calling it must be guarded by 'if __name__ == "__main__"'.
+    """
+    if fx_codes is None:
+        fx_codes = []
+    chunks = get_chunks(instruments, chunk_size)
+    for chunk_idx, chunk in enumerate(chunks):
+        spill_chunk(
+            chunk_idx,
+            chunk,
+            get_chunk_df,
+            subsystems,
+            spill_dir,
+            fx_codes,
+            lean,
+            memory_report,
+            sim_years,
+        )
+
+    args = [
+        (subsys.sysname, subsys.vol_target, spill_dir, len(chunks), debug)
+        for subsys in subsystems
+    ]
+    if max_workers == 1:
+        outputs = [simulate_chunks(*subsys_args) for subsys_args in args]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [
+                pool.submit(simulate_chunks, *subsys_args) for subsys_args in args
+            ]
+            outputs = [future.result() for future in futures]
+
+    results = {}
+    for subsys, (portfolio_df, subsys_instruments) in zip(subsystems, outputs):
+        if memory_report is not None:
+            memory_report.record(f"{subsys.sysname} portfolio_df", portfolio_df)
+        results[subsys.sysname] = (portfolio_df, subsys_instruments)
+
+    if historical_path is not None:
+        historical_df = combine_historical_dfs(spill_dir, len(chunks), historical_path)
+        if memory_report is not None:
+            memory_report.record("historical_df", historical_df)
+    return results
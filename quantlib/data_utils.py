@@ -1,11 +1,23 @@
+import os
 from io import StringIO
 
+import numpy as np
 import pandas as pd
 import requests
 import yfinance as yf
+import quantlib.storage as storage
+import quantlib.fetch_utils as fetch_utils
+import quantlib.profiling_utils as profiling_utils
 from bs4 import BeautifulSoup
 import datetime
 
+OHLCV_FIELDS = ["open", "high", "low", "close", "volume"]
+# the raw fields kept by the lean mode of 'extend_dataframe()', high and low
+# are only needed to compute the ADX
+LEAN_FIELDS = ["high", "low", "close"]
+# the window of the '% ret vol' rolling standard deviation
+VOL_WINDOW = 25
+
 
 def get_sp500_instruments():
     res = requests.get("https://en.wikipedia.org/wiki/List_of_S%26P_500_companies")
@@ -13,82 +25,141 @@ def get_sp500_instruments():
     table = soup.find_all("table")[0]
     df = pd.read_html(StringIO(str(table)))
 
-    return list(df[0]["Symbol"])
+    # Yahoo uses dashes for share classes, e.g. BRK.B -> BRK-B
+    return [symbol.replace(".", "-") for symbol in df[0]["Symbol"]]
 
 
-def get_sp500_df():
-    symbols = get_sp500_instruments()[:30]
+@profiling_utils.timed()
+def get_sp500_df(ohlcv_path=None, n_instruments=30):
+    """
+    This function downloads the OHLCV history of the first 'n_instruments' S&P 500
+    constituents (all of them with None, see 'quantlib.chunked_engine' for
+    running the whole index with bounded memory)
+    """
+    symbols = get_sp500_instruments()[:n_instruments]
+    if ohlcv_path is not None:
+        return refresh_df(symbols, index_ticker="AMZN", path=ohlcv_path, period="5y")
     return get_df(symbols, index_ticker="AMZN", period="5y")
 
 
-def get_crypto_df(crypto_config):
+@profiling_utils.timed()
+def get_crypto_df(crypto_config, ohlcv_path=None):
+    if ohlcv_path is not None:
+        return refresh_df(
+            symbols=crypto_config["crypto_tickers"],
+            index_ticker="BTC-USD",
+            path=ohlcv_path,
+            period="5y",
+        )
     return get_df(
         symbols=crypto_config["crypto_tickers"], index_ticker="BTC-USD", period="5y"
     )
 
 
-def extend_dataframe(traded, df, fx_codes):
+@profiling_utils.timed()
+def extend_dataframe(traded, df, fx_codes, lean=False):
     """
     Function extends a DataFrame containing OHLCV data for multiple instruments by adding
     columns with additional statistics related to percentage returns, return volatility
     and active trading indicators.
+    The statistics of all instruments (and of the inverse legs of FX pairs) are
+    computed as whole 2-D array operations and assembled with a single concat,
+    instead of inserting the columns into the wide DataFrame one at a time.
+    With 'lean=True' the open and volume columns are dropped (only high, low and
+    close are used later on) and prices and statistics are stored as float32,
+    after being computed in float64. float32 keeps about 7 significant digits,
+    i.e. every stored value is within a relative 6e-8 of the float64 one.
+    The active flags are booleans in both modes.
     """
-    df.index = pd.Series(df.index).apply(lambda x: format_date(x))
+    df.index = format_dates(df.index)
 
-    open_cols = list(map(lambda x: str(x) + " open", traded))
-    high_cols = list(map(lambda x: str(x) + " high", traded))
-    low_cols = list(map(lambda x: str(x) + " low", traded))
+    fields = LEAN_FIELDS if lean else OHLCV_FIELDS
+    ohlcv_cols = [f"{inst} {field}" for field in fields for inst in traded]
     close_cols = list(map(lambda x: str(x) + " close", traded))
-    volume_cols = list(map(lambda x: str(x) + " volume", traded))
 
-    historical_data = df.copy()
+    # Forward and back fill missing values in the DataFrame
+    ohlcv = df[ohlcv_cols].ffill().bfill()
 
-    historical_data = historical_data[
-        open_cols + high_cols + low_cols + close_cols + volume_cols
-    ]
+    # Every traded instrument is a leg, an FX pair also gets its inverse leg
+    # (e.g. EUR_USD -> USD_EUR) priced at 1 / close
+    closes = ohlcv[close_cols].to_numpy(dtype=np.float64)
+    legs, leg_closes, inverse_cols = [], [], []
+    for j, inst in enumerate(traded):
+        legs.append(inst)
+        leg_closes.append(closes[:, j])
+        if is_fx(inst, fx_codes):
+            inst_rev = "{}_{}".format(inst.split("_")[1], inst.split("_")[0])
+            legs.append(inst_rev)
+            leg_closes.append(1 / closes[:, j])
+            inverse_cols.append(len(leg_closes) - 1)
+    leg_closes = np.column_stack(leg_closes) if legs else np.empty((len(df), 0))
 
-    # Forward and back fill missing values in the DataFrame
-    historical_data.ffill(inplace=True)
-    historical_data.bfill(inplace=True)
-
-    # Iterate through each instrument and calculate additional statistics
-    for inst in traded:
-        # Calculate percentage return (it divides the closing price of the current day by the closing price of the previous day)
-        # Subtraction by 1 is a common practice in financial calculations to express return as a percentage change
-        historical_data[f"{inst} % ret"] = (
-            historical_data[f"{inst} close"] / historical_data[f"{inst} close"].shift(1)
-            - 1
-        )
+    # Percentage return (the closing price of the current day divided by the closing price of the previous day, minus 1)
+    prev_closes = np.vstack([np.full((1, len(legs)), np.nan), leg_closes[:-1]])
+    rets = leg_closes / prev_closes - 1
 
-        # Calculate percentage return volatility using a 25-day rolling standard deviation
-        # The rolling window is applied to the daily percentage returns and at each position
-        # it considers the previous 25 values, including the current one
-        historical_data[f"{inst} % ret vol"] = (
-            historical_data[f"{inst} % ret"].rolling(25).std()
-        )
+    # Percentage return volatility using a 25-day rolling standard deviation,
+    # considering at each position the previous 25 values, including the current one
+    vols = pd.DataFrame(rets).rolling(VOL_WINDOW).std().to_numpy()
 
-        # Check if the stock is actively traded by comparing closing prices today and yesterday
-        historical_data[f"{inst} active"] = historical_data[
-            f"{inst} close"
-        ] != historical_data[f"{inst} close"].shift(1)
+    # The instrument is actively traded if the closing prices of today and yesterday differ
+    actives = leg_closes != prev_closes
 
-        if is_fx(inst, fx_codes):
-            inst_rev = "{}_{}".format(inst.split("_")[1], inst.split("_")[0])
-            historical_data[f"{inst_rev} close"] = 1 / historical_data[f"{inst} close"]
-            historical_data[f"{inst_rev} % ret"] = (
-                historical_data[f"{inst_rev} close"]
-                / historical_data[f"{inst_rev} close"].shift(1)
-                - 1
-            )
-            historical_data[f"{inst_rev} % ret vol"] = (
-                historical_data[f"{inst_rev} % ret"].rolling(25).std()
-            )
-
-            historical_data[f"{inst_rev} active"] = historical_data[
-                f"{inst_rev} close"
-            ] != historical_data[f"{inst_rev} close"].shift(1)
-    historical_data.bfill(inplace=True)
-    return historical_data
+    # Back fill the NaNs of the returns and volatilities (e.g. the first 25 days)
+    rets, vols = [pd.DataFrame(values).bfill().to_numpy() for values in [rets, vols]]
+
+    if lean:
+        ohlcv = ohlcv.astype(np.float32)
+        rets, vols, leg_closes = [
+            values.astype(np.float32) for values in [rets, vols, leg_closes]
+        ]
+
+    stats = {}
+    for k, leg in enumerate(legs):
+        if k in inverse_cols:
+            stats[f"{leg} close"] = leg_closes[:, k]
+        stats[f"{leg} % ret"] = rets[:, k]
+        stats[f"{leg} % ret vol"] = vols[:, k]
+        stats[f"{leg} active"] = actives[:, k]
+
+    return pd.concat([ohlcv, pd.DataFrame(stats, index=ohlcv.index)], axis=1)
+
+
+@profiling_utils.timed()
+def extend_dataframe_tail(
+    traded, df, fx_codes, historical_data=None, lookback=26, lean=False
+):
+    """
+    This function is the incremental version of 'extend_dataframe()' for a
+    refreshed 'df' that only gained rows after the end of an already extended
+    'historical_data'. The derived columns of the old rows do not change, so
+    only the new rows (plus the last stored bar, which 'refresh_df()' downloads
+    again) are extended, using the previous 'lookback' rows for the shifted
+    returns and the 25-day rolling volatility. Without 'historical_data' the
+    whole 'df' is extended. 'lean' is passed on to 'extend_dataframe()'.
+    """
+    df.index = format_dates(df.index)
+    raw_cols = [
+        f"{inst} {field}"
+        for field in (LEAN_FIELDS if lean else OHLCV_FIELDS)
+        for inst in traded
+    ]
+    if historical_data is None or not set(raw_cols).issubset(historical_data.columns):
+        # nothing stored yet, or new instruments without history to extend from
+        return extend_dataframe(traded, df, fx_codes, lean=lean)
+
+    last_date = historical_data.index[-1]
+    old_rows = historical_data.loc[historical_data.index < last_date, raw_cols]
+    new_rows = df.loc[df.index >= last_date, raw_cols]
+    window = pd.concat([old_rows.tail(lookback), new_rows])
+    extended = extend_dataframe(traded, window, fx_codes, lean=lean)
+    extended = extended.iloc[len(old_rows.tail(lookback)) :]
+    return pd.concat(
+        [
+            historical_data.loc[historical_data.index < last_date, extended.columns],
+            extended,
+        ]
+    )
 
 
 def is_fx(inst, fx_codes):
@@ -105,31 +176,149 @@ def format_date(dates):
     return datetime.date(yymmdd[0], yymmdd[1], yymmdd[2])
 
 
-def get_df(symbols, index_ticker, period="1y"):
-    ohlcvs = {}
-    for symbol in symbols:
-        symbol_df = yf.Ticker(symbol).history(period=period)
+def format_dates(index):
+    """
+    This function is the vectorized version of 'format_date()': it converts a
+    whole index of timestamps (timezone aware ones keep their local date),
+    date strings or dates to an index of 'datetime.date' objects
+    """
+    if index.dtype == object and all(type(x) is datetime.date for x in index):
+        return pd.Index(index, dtype=object, name=index.name)
+    dates = pd.DatetimeIndex(pd.to_datetime(index))
+    if dates.tz is not None:
+        dates = dates.tz_localize(None)
+    return pd.Index(dates.date, dtype=object, name=index.name)
 
-        ohlcvs[symbol] = symbol_df[["Open", "High", "Low", "Close", "Volume"]].rename(
-            columns={
-                "Open": "open",
-                "High": "high",
-                "Low": "low",
-                "Close": "close",
-                "Volume": "volume",
-            }
-        )
 
-    df = pd.DataFrame(index=ohlcvs[index_ticker].index)
-    df.index.name = "date"
-    instruments = list(ohlcvs.keys())
+def get_ohlcv(symbol, provider=yf.Ticker, **history_kwargs):
+    """
+    This function downloads the OHLCV bars of one symbol. 'provider' maps a
+    symbol to an object with a yfinance-like 'history()' method, so a local
+    stand-in can replace yfinance.
+    """
+    symbol_df = provider(symbol).history(**history_kwargs)
+    return symbol_df[["Open", "High", "Low", "Close", "Volume"]].rename(
+        columns={
+            "Open": "open",
+            "High": "high",
+            "Low": "low",
+            "Close": "close",
+            "Volume": "volume",
+        }
+    )
 
-    for inst in instruments:
-        inst_df = ohlcvs[inst]
-        columns = list(map(lambda x: f"{inst} {x}", inst_df.columns))
-        df = pd.concat(
-            [df, inst_df.rename(columns=dict(zip(inst_df.columns, columns)))], axis=1
-        )
+
+def combine_ohlcvs(ohlcvs, index_ticker):
+    """
+    This function joins the OHLCV frames of all symbols into one wide DataFrame
+    with '{inst} {field}' columns, with a single concat
+    """
+    index_df = pd.DataFrame(index=ohlcvs[index_ticker].index)
+    instruments = list(ohlcvs.keys())
+    df = pd.concat(
+        [index_df]
+        + [
+            ohlcvs[inst].rename(columns=lambda x, inst=inst: f"{inst} {x}")
+            for inst in instruments
+        ],
+        axis=1,
+        sort=True,
+    )
     df.index.name = "date"
 
     return df, instruments
+
+
+@profiling_utils.timed()
+def get_df(
+    symbols,
+    index_ticker,
+    period="1y",
+    provider=yf.Ticker,
+    max_workers=8,
+    calls_per_second=None,
+    retries=3,
+):
+    """
+    This function downloads the OHLCV history of all symbols concurrently (see
+    'fetch_utils.fetch_all()') and joins them into one wide DataFrame
+    """
+    ohlcvs = fetch_utils.fetch_all(
+        symbols,
+        lambda symbol: get_ohlcv(symbol, provider, period=period),
+        max_workers=max_workers,
+        calls_per_second=calls_per_second,
+        retries=retries,
+    )
+
+    return combine_ohlcvs(ohlcvs, index_ticker)
+
+
+@profiling_utils.timed()
+def get_chunk_df(
+    symbols,
+    index_ticker,
+    period="1y",
+    provider=yf.Ticker,
+    max_workers=8,
+    ohlcv_path=None,
+):
+    """
+    This function downloads one chunk of a large universe like 'get_df()', or
+    with 'ohlcv_path' refreshes the chunk's history stored there like
+    'refresh_df()'. The 'index_ticker' is always downloaded with it and the
+    chunk keeps only its dates, so that every chunk has the same dates.
+    """
+    symbols = [index_ticker] + [symbol for symbol in symbols if symbol != index_ticker]
+    if ohlcv_path is None:
+        df, _ = get_df(symbols, index_ticker, period, provider, max_workers=max_workers)
+    else:
+        df, _ = refresh_df(
+            symbols, index_ticker, ohlcv_path, period, provider, max_workers=max_workers
+        )
+    # the bars of a symbol on dates the index ticker has no bar for would add
+    # rows to this chunk only
+    return df[df[f"{index_ticker} close"].notna()]
+
+
+@profiling_utils.timed()
+def refresh_df(
+    symbols, index_ticker, path, period="1y", provider=yf.Ticker, max_workers=8
+):
+    """
+    This function is the incremental version of 'get_df()'. It reads the OHLCV
+    history stored at 'path' (Parquet, see quantlib.storage), requests per symbol
+    only the bars from its last stored date onwards (that bar is downloaded again
+    as it may have been incomplete), and stores the updated history. Symbols
+    without stored history are downloaded in full for 'period'.
+    """
+    if not os.path.exists(path):
+        df, instruments = get_df(
+            symbols, index_ticker, period, provider, max_workers=max_workers
+        )
+        storage.save_frame(df, path)
+        return df, instruments
+
+    stored = storage.load_frame(path)
+
+    def fetch(symbol):
+        close_col = f"{symbol} close"
+        last_date = (
+            stored[close_col].last_valid_index() if close_col in stored else None
+        )
+        if last_date is None:
+            return get_ohlcv(symbol, provider, period=period)
+        return get_ohlcv(symbol, provider, start=last_date.strftime("%Y-%m-%d"))
+
+    ohlcvs = fetch_utils.fetch_all(symbols, fetch, max_workers=max_workers)
+    new_df, instruments = combine_ohlcvs(ohlcvs, index_ticker)
+
+    # New bars take precedence over the stored ones they overlap with
+    df = new_df.combine_first(stored)
+    columns = list(stored.columns) + [
+        col for col in new_df.columns if col not in stored.columns
+    ]
+    df = df[columns]
+    df.index.name = "date"
+    storage.save_frame(df, path)
+    return df[[col for col in columns if col.split(" ")[0] in symbols]], instruments
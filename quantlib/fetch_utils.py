@@ -0,0 +1,60 @@
+import time
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RateLimiter:
+    """
+    The class RateLimiter spaces out calls made from several threads so that
+    at most 'calls_per_second' calls start in any second
+    """
+
+    def __init__(self, calls_per_second):
+        self.interval = 1.0 / calls_per_second
+        self.next_call = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+def fetch_with_retries(fetch, key, retries=3, backoff=1.0, rate_limiter=None):
+    """
+    This function calls 'fetch(key)', retrying up to 'retries' times with an
+    exponential backoff ('backoff', 2 * 'backoff', 4 * 'backoff', ... seconds)
+    and re-raising the last error if every attempt fails
+    """
+    for attempt in range(retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.wait()
+        try:
+            return fetch(key)
+        except Exception as err:
+            if attempt == retries:
+                raise Exception(f"Failed to fetch {key}: {str(err)}")
+            time.sleep(backoff * 2**attempt)
+
+
+def fetch_all(
+    keys, fetch, max_workers=8, calls_per_second=None, retries=3, backoff=1.0
+):
+    """
+    This function calls 'fetch(key)' for every key (e.g. a symbol) concurrently
+    on a bounded thread pool, with optional rate limiting and retries, and
+    returns the results as a dict in the order of 'keys'
+    """
+    rate_limiter = RateLimiter(calls_per_second) if calls_per_second else None
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            key: pool.submit(
+                fetch_with_retries, fetch, key, retries, backoff, rate_limiter
+            )
+            for key in keys
+        }
+        return {key: future.result() for key, future in futures.items()}
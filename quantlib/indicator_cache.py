@@ -0,0 +1,145 @@
+import os
+import hashlib
+import threading
+import numpy as np
+import quantlib.general_utils as general_utils
+
+from collections import OrderedDict
+
+
+class IndicatorCache:
+    """
+    The class IndicatorCache stores computed indicator series so that they are
+    computed once and shared by every subsystem (and rerun) using the same
+    prices. Entries are content-addressed: the key is made of the instrument,
+    the indicator name, its parameters and a hash of the input price arrays,
+    so a changed price history never hits a stale entry.
+    Entries live in an in-memory LRU holding at most 'max_entries' series
+    (grown with 'reserve()' to the number of series of a run) and, if
+    'disk_dir' is given, are also pickled to disk so later runs reuse them.
+    As the key hashes the whole input column, appending a bar (see
+    'data_utils.refresh_df()') changes every key: the disk entries only serve
+    reruns over the same history, and the entries of the previous history are
+    never hit again. 'prune()' removes them at the end of a run and can cap the
+    size of 'disk_dir'.
+    """
+
+    def __init__(self, max_entries=4096, disk_dir=None):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        # the disk entries read or written by this cache, kept by 'prune()'
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def get_key(inst, indicator, params, inputs, backend=None):
+        """
+        Key of an indicator series, e.g. ('AAPL', 'ema', (21,), 'talib',
+        <hash of close>). The backends of quantlib.indicators_cal only agree up
+        to rounding, so the backend computing the series is part of the key.
+        """
+        digest = hashlib.sha1()
+        for values in inputs:
+            values = np.ascontiguousarray(values, dtype=np.float64)
+            digest.update(str(values.shape).encode())
+            digest.update(values.tobytes())
+        return (inst, indicator, tuple(params), backend, digest.hexdigest())
+
+    def get_path(self, key):
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.disk_dir, f"{name}.pkl")
+
+    def get(self, key):
+        """
+        Return the cached series for 'key', or None if it was never computed
+        """
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+        path = self.get_path(key) if self.disk_dir is not None else None
+        if path is not None and os.path.exists(path):
+            value = general_utils.load_file(path)
+            if value is not None:
+                # the modification time orders the entries for 'prune()'
+                os.utime(path)
+                self.used.add(path)
+                self.put(key, value, persist=False)
+                with self.lock:
+                    self.hits += 1
+                return value
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value, persist=True):
+        with self.lock:
+            self.memory[key] = value
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+        if persist and self.disk_dir is not None:
+            general_utils.save_file(self.get_path(key), value)
+            self.used.add(self.get_path(key))
+
+    def reserve(self, n_entries):
+        """
+        Grow the in-memory LRU to hold at least 'n_entries' series, e.g. every
+        indicator of every instrument of a run, so that computing them does not
+        evict the series the next subsystem reads
+        """
+        with self.lock:
+            self.max_entries = max(self.max_entries, n_entries)
+
+    def prune(self, max_bytes=None):
+        """
+        Remove from 'disk_dir' the entries this cache neither read nor wrote,
+        the series of earlier histories, then, with 'max_bytes', the least
+        recently used entries until 'disk_dir' holds at most 'max_bytes'.
+        Returns the number of entries removed.
+        """
+        if self.disk_dir is None:
+            return 0
+        removed = 0
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            if name.endswith(".pkl") and path not in self.used:
+                os.remove(path)
+                removed += 1
+        if max_bytes is not None:
+            entries = sorted(
+                (os.path.getmtime(path), os.path.getsize(path), path)
+                for path in self.used
+                if os.path.exists(path)
+            )
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= max_bytes:
+                    break
+                os.remove(path)
+                self.used.discard(path)
+                total -= size
+                removed += 1
+        return removed
+
+    def __getstate__(self):
+        # a cache sent to a worker process keeps its disk directory, the
+        # in-memory entries and the lock stay in this process
+        state = dict(self.__dict__)
+        state["memory"] = OrderedDict()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
@@ -1,25 +1,770 @@
-import talib  # libraty for Technical Analysis
+import os
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    import talib  # libraty for Technical Analysis
+except ImportError:
+    talib = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+"""
+The indicators are computed by one of three backends, chosen at import time
+with the QUANTLIB_INDICATORS environment variable:
+
+- "talib": TA-Lib, one instrument at a time
+- "numpy": the NumPy ports of TA-Lib's algorithms below, which step through
+  the dates for all instruments of a (dates x instruments) array at once
+- "numba": the same algorithms as plain loops compiled with Numba
+
+By default TA-Lib is used when it is installed, then Numba, then NumPy. The
+ports follow TA-Lib's warm-up (the same leading NaNs, the EMA seeded with the
+SMA of its first 'n' values, the ADX starting after 2 * 'n' bars) and its
+arithmetic, so they give the same values (TA-Lib builds that compile the EMA
+step into a fused multiply-add can differ in the last bit).
+"""
+
+if talib is not None:
+    default_backend = "talib"
+elif numba is not None:
+    default_backend = "numba"
+else:
+    default_backend = "numpy"
+BACKEND = os.environ.get("QUANTLIB_INDICATORS", default_backend)
+if BACKEND not in ("talib", "numpy", "numba"):
+    raise ValueError(f"Unknown indicators backend: {BACKEND}")
+if BACKEND == "talib" and talib is None:
+    raise Exception("TA-Lib is not installed, use QUANTLIB_INDICATORS=numpy")
+if BACKEND == "numba" and numba is None:
+    raise Exception("Numba is not installed, use QUANTLIB_INDICATORS=numpy")
+
+
+def jit(function):
+    # the loop versions are compiled on their first call
+    if numba is None:
+        return function
+    return numba.njit(cache=True, error_model="numpy")(function)
+
+
+def get_zero_tolerance():
+    """
+    This function returns the tolerance of TA_IS_ZERO of the installed TA-Lib:
+    1e-8 up to its 0.4 C library, 1e-14 since 0.6 (and without TA-Lib)
+    """
+    if talib is None:
+        return 1e-14
+    version = talib.__ta_version__
+    if isinstance(version, bytes):
+        version = version.decode()
+    major, minor = [int(part) for part in version.split()[0].split(".")[:2]]
+    return 1e-8 if (major, minor) < (0, 6) else 1e-14
+
+
+ZERO_TOLERANCE = get_zero_tolerance()
+
+
+def is_zero(values):
+    # TA_IS_ZERO of TA-Lib
+    return (-ZERO_TOLERANCE < values) & (values < ZERO_TOLERANCE)
+
+
+def get_true_range(high, low, prev_close):
+    """
+    The true range, taking the larger values as TA-Lib does (a NaN previous
+    close is ignored)
+    """
+    true_range = high - low
+    up = np.abs(high - prev_close)
+    true_range = np.where(up > true_range, up, true_range)
+    down = np.abs(low - prev_close)
+    return np.where(down > true_range, down, true_range)
+
+
+def numpy_ema(values, n):
+    """
+    TA-Lib's EMA of the columns of 'values', which have no leading NaN
+    """
+    out = np.full(values.shape, np.nan)
+    if len(values) < n:
+        return out
+    k = 2.0 / (n + 1)
+    prev = values[0].copy()
+    for t in range(1, n):
+        prev = prev + values[t]
+    out[n - 1] = prev = prev / n
+    for t in range(n, len(values)):
+        out[t] = prev = ((values[t] - prev) * k) + prev
+    return out
+
+
+def numpy_sma(values, n):
+    """
+    TA-Lib's SMA of the columns of 'values', which have no leading NaN
+    """
+    out = np.full(values.shape, np.nan)
+    if len(values) < n:
+        return out
+    total = np.zeros(values.shape[1])
+    for t in range(n - 1):
+        total = total + values[t]
+    for t in range(n - 1, len(values)):
+        total = total + values[t]
+        out[t] = total / n
+        total = total - values[t - n + 1]
+    return out
+
+
+def numpy_adx(high, low, close, n):
+    """
+    TA-Lib's ADX of the columns of 'high', 'low' and 'close', which have no
+    leading NaN
+    """
+    out = np.full(high.shape, np.nan)
+    if len(high) < 2 * n:
+        return out
+    size = high.shape[1]
+    plus_dm, minus_dm, tr, sum_dx = [np.zeros(size) for _ in range(4)]
+    adx = np.full(size, np.nan)
+    for today in range(1, len(high)):
+        diff_p = high[today] - high[today - 1]  # plus delta
+        diff_m = low[today - 1] - low[today]  # minus delta
+        if today >= n:
+            minus_dm = minus_dm - minus_dm / n
+            plus_dm = plus_dm - plus_dm / n
+        is_minus = (diff_m > 0) & (diff_p < diff_m)
+        is_plus = ~is_minus & (diff_p > 0) & (diff_p > diff_m)
+        minus_dm = np.where(is_minus, minus_dm + diff_m, minus_dm)
+        plus_dm = np.where(is_plus, plus_dm + diff_p, plus_dm)
+
+        true_range = get_true_range(high[today], low[today], close[today - 1])
+        if today < n:
+            tr = tr + true_range
+            continue
+        tr = tr - (tr / n) + true_range
+
+        # TA-Lib skips the bars with a zero true range or a zero sum of the DIs
+        minus_di = 100.0 * (minus_dm / tr)
+        plus_di = 100.0 * (plus_dm / tr)
+        total = minus_di + plus_di
+        dx = 100.0 * (np.abs(minus_di - plus_di) / total)
+        has_dx = ~is_zero(tr) & ~is_zero(total)
+        if today < 2 * n:
+            sum_dx = np.where(has_dx, sum_dx + dx, sum_dx)
+            if today == 2 * n - 1:
+                out[today] = adx = sum_dx / n
+        else:
+            out[today] = adx = np.where(has_dx, ((adx * (n - 1)) + dx) / n, adx)
+    return out
+
+
+@jit
+def numba_ema(values, n):
+    """
+    The loop version of 'numpy_ema()'
+    """
+    out = np.full(values.shape, np.nan)
+    n_dates, size = values.shape
+    if n_dates < n:
+        return out
+    k = 2.0 / (n + 1)
+    prev = values[0].copy()
+    for t in range(1, n):
+        for j in range(size):
+            prev[j] = prev[j] + values[t, j]
+    for j in range(size):
+        out[n - 1, j] = prev[j] = prev[j] / n
+    for t in range(n, n_dates):
+        for j in range(size):
+            out[t, j] = prev[j] = ((values[t, j] - prev[j]) * k) + prev[j]
+    return out
+
+
+@jit
+def numba_sma(values, n):
+    """
+    The loop version of 'numpy_sma()'
+    """
+    out = np.full(values.shape, np.nan)
+    n_dates, size = values.shape
+    if n_dates < n:
+        return out
+    total = np.zeros(size)
+    for t in range(n - 1):
+        for j in range(size):
+            total[j] = total[j] + values[t, j]
+    for t in range(n - 1, n_dates):
+        for j in range(size):
+            total[j] = total[j] + values[t, j]
+            out[t, j] = total[j] / n
+            total[j] = total[j] - values[t - n + 1, j]
+    return out
+
+
+@jit
+def numba_adx(high, low, close, n):
+    """
+    The loop version of 'numpy_adx()'
+    """
+    out = np.full(high.shape, np.nan)
+    n_dates, size = high.shape
+    if n_dates < 2 * n:
+        return out
+    plus_dm, minus_dm, tr, sum_dx = [np.zeros(size) for _ in range(4)]
+    adx = np.full(size, np.nan)
+    for today in range(1, n_dates):
+        for j in range(size):
+            diff_p = high[today, j] - high[today - 1, j]  # plus delta
+            diff_m = low[today - 1, j] - low[today, j]  # minus delta
+            if today >= n:
+                minus_dm[j] = minus_dm[j] - minus_dm[j] / n
+                plus_dm[j] = plus_dm[j] - plus_dm[j] / n
+            if (diff_m > 0) and (diff_p < diff_m):
+                minus_dm[j] = minus_dm[j] + diff_m
+            elif (diff_p > 0) and (diff_p > diff_m):
+                plus_dm[j] = plus_dm[j] + diff_p
+
+            true_range = high[today, j] - low[today, j]
+            up = abs(high[today, j] - close[today - 1, j])
+            if up > true_range:
+                true_range = up
+            down = abs(low[today, j] - close[today - 1, j])
+            if down > true_range:
+                true_range = down
+            if today < n:
+                tr[j] = tr[j] + true_range
+                continue
+            tr[j] = tr[j] - (tr[j] / n) + true_range
+
+            # TA-Lib skips the bars with a zero true range or a zero sum of the DIs
+            has_dx, dx = False, 0.0
+            if not (-ZERO_TOLERANCE < tr[j] < ZERO_TOLERANCE):
+                minus_di = 100.0 * (minus_dm[j] / tr[j])
+                plus_di = 100.0 * (plus_dm[j] / tr[j])
+                total = minus_di + plus_di
+                if not (-ZERO_TOLERANCE < total < ZERO_TOLERANCE):
+                    has_dx, dx = True, 100.0 * (abs(minus_di - plus_di) / total)
+            if today < 2 * n:
+                if has_dx:
+                    sum_dx[j] = sum_dx[j] + dx
+                if today == 2 * n - 1:
+                    out[today, j] = adx[j] = sum_dx[j] / n
+            else:
+                if has_dx:
+                    adx[j] = ((adx[j] * (n - 1)) + dx) / n
+                out[today, j] = adx[j]
+    return out
+
+
+KERNELS = {
+    "numpy": {"adx": numpy_adx, "ema": numpy_ema, "sma": numpy_sma},
+    "numba": {"adx": numba_adx, "ema": numba_ema, "sma": numba_sma},
+}
+
+
+def by_column(function, inputs, **kwargs):
+    """
+    Calls the TA-Lib 'function' on one series, or on every column of
+    (dates x instruments) arrays
+    """
+    inputs = [np.asarray(values, dtype=np.float64) for values in inputs]
+    if inputs[0].ndim == 1:
+        return function(*inputs, **kwargs)
+    return np.column_stack(
+        [
+            function(
+                *[np.ascontiguousarray(values[:, j]) for values in inputs], **kwargs
+            )
+            for j in range(inputs[0].shape[1])
+        ]
+    )
+
+
+def by_start(function, inputs, n):
+    """
+    Calls the NumPy port 'function' on one series, or on (dates x instruments)
+    arrays, with every instrument starting at its first row without NaN
+    inputs as TA-Lib does
+    """
+    inputs = [np.asarray(values, dtype=np.float64) for values in inputs]
+    is_series = inputs[0].ndim == 1
+    if is_series:
+        inputs = [values[:, None] for values in inputs]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if not np.any([np.isnan(values[0]).any() for values in inputs]):
+            out = function(*[np.ascontiguousarray(values) for values in inputs], n)
+            return out[:, 0] if is_series else out
+        valid = np.logical_and.reduce([~np.isnan(values) for values in inputs])
+        starts = np.where(valid.any(axis=0), valid.argmax(axis=0), len(valid))
+        out = np.full(inputs[0].shape, np.nan)
+        for start in np.unique(starts[starts < len(valid)]):
+            cols = np.flatnonzero(starts == start)
+            out[start:, cols] = function(
+                *[np.ascontiguousarray(values[start:, cols]) for values in inputs], n
+            )
+    return out[:, 0] if is_series else out
 
 
 def adx_series(high, low, close, n):
     """
     This function calculates the Average Directional Index (ADX)
-    based on the provided high, low and close price
+    based on the provided high, low and close price, of one instrument
+    or of (dates x instruments) arrays
     """
-    return talib.ADX(high, low, close, timeperiod=n)
+    if BACKEND == "talib":
+        return by_column(talib.ADX, [high, low, close], timeperiod=n)
+    return by_start(KERNELS[BACKEND]["adx"], [high, low, close], n)
 
 
 def ema_series(series, n):
     """
     This function calculates the Exponential Moving Average (EMA)
-    based on a given input series.
+    based on a given input series, or on the columns of a
+    (dates x instruments) array.
     """
-    return talib.EMA(series, timeperiod=n)
+    if BACKEND == "talib":
+        return by_column(talib.EMA, [series], timeperiod=n)
+    return by_start(KERNELS[BACKEND]["ema"], [series], n)
 
 
 def sma_series(series, n):
     """
     This function calculates the Simple Moving Average (SMA)
-    based on a given input series.
+    based on a given input series, or on the columns of a
+    (dates x instruments) array.
+    """
+    if BACKEND == "talib":
+        return by_column(talib.SMA, [series], timeperiod=n)
+    return by_start(KERNELS[BACKEND]["sma"], [series], n)
+
+
+def get_inst_indicators(high, low, close, specs):
+    """
+    This function calculates the indicators of a single instrument (or of
+    (dates x instruments) arrays) listed in 'specs' as (indicator, params)
+    tuples, e.g. ('adx', (14,)) or ('ema', (21,)), and returns them as a dict
+    keyed by the same tuples
+    """
+    indicators = {}
+    for indicator, params in specs:
+        if indicator == "adx":
+            indicators[(indicator, params)] = adx_series(high, low, close, *params)
+        elif indicator == "ema":
+            indicators[(indicator, params)] = ema_series(close, *params)
+    return indicators
+
+
+def get_momentum_columns(instruments, pairs):
+    """
+    This function returns the names of the columns of 'get_momentum_indicators()'
+    """
+    return [
+        name
+        for inst in instruments
+        for name in [f"{inst} adx"] + [f"{inst} ema{str(pair)}" for pair in pairs]
+    ]
+
+
+def get_momentum_indicators(
+    historical_data,
+    instruments,
+    pairs,
+    adx_period=14,
+    max_workers=None,
+    use_processes=False,
+    cache=None,
+    dtype=np.float64,
+):
+    """
+    This function calculates the '{inst} adx' and '{inst} ema{pair}' columns for
+    all instruments. Every EMA span is computed only once per instrument, even
+    when it appears in several pairs, and series already held by the optional
+    'quantlib.indicator_cache.IndicatorCache' are reused. The remaining work is
+    fanned out by instrument over a thread pool (or a process pool with
+    'use_processes=True', which requires the calling script to be guarded by
+    'if __name__ == "__main__"'); the NumPy backends instead compute every
+    indicator for all instruments at once. The result is assembled into a single
+    DataFrame aligned with 'historical_data', with the columns ordered per
+    instrument: adx first, then the pairs in the given order, and stored as
+    'dtype' (the indicators are always computed in float64).
+    """
+    spans = sorted({span for pair in pairs for span in pair})
+    specs = [("adx", (adx_period,))] + [("ema", (span,)) for span in spans]
+
+    if cache is not None:
+        # every series of this call stays in memory for the next subsystem
+        cache.reserve(len(instruments) * len(specs))
+    inputs, indicators, keys, missing = [], [], [], []
+    for inst in instruments:
+        high, low, close = [
+            historical_data[f"{inst} {col}"].to_numpy(dtype=np.float64)
+            for col in ["high", "low", "close"]
+        ]
+        inst_keys, inst_indicators, inst_missing = {}, {}, []
+        for indicator, params in specs:
+            if cache is not None:
+                spec_inputs = [high, low, close] if indicator == "adx" else [close]
+                key = cache.get_key(
+                    inst, indicator, params, spec_inputs, backend=BACKEND
+                )
+                inst_keys[(indicator, params)] = key
+                value = cache.get(key)
+                if value is not None:
+                    inst_indicators[(indicator, params)] = value
+                    continue
+            inst_missing.append((indicator, params))
+        inputs.append((high, low, close))
+        indicators.append(inst_indicators)
+        keys.append(inst_keys)
+        missing.append(inst_missing)
+
+    todo = [j for j in range(len(instruments)) if missing[j]]
+    if todo and BACKEND != "talib":
+        # the NumPy ports compute each indicator for all instruments at once
+        for spec in specs:
+            cols = [j for j in todo if spec in missing[j]]
+            if not cols:
+                continue
+            high, low, close = [
+                np.column_stack([inputs[j][k] for j in cols]) for k in range(3)
+            ]
+            computed = get_inst_indicators(high, low, close, [spec])[spec]
+            for k, j in enumerate(cols):
+                indicators[j][spec] = computed[:, k].copy()
+                if cache is not None:
+                    cache.put(keys[j][spec], indicators[j][spec])
+    elif todo:
+        executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with executor(max_workers=max_workers) as pool:
+            results = pool.map(
+                get_inst_indicators,
+                *zip(*[inputs[j] for j in todo]),
+                [missing[j] for j in todo],
+            )
+            for j, computed in zip(todo, results):
+                indicators[j].update(computed)
+                if cache is not None:
+                    for spec, value in computed.items():
+                        cache.put(keys[j][spec], value)
+
+    n_cols = 1 + len(pairs)
+    values = np.empty(
+        (len(historical_data.index), len(instruments) * n_cols), dtype=dtype
+    )
+    for j, inst in enumerate(instruments):
+        values[:, j * n_cols] = indicators[j][("adx", (adx_period,))]
+        for k, (fast, slow) in enumerate(pairs):
+            values[:, j * n_cols + 1 + k] = (
+                indicators[j][("ema", (fast,))] - indicators[j][("ema", (slow,))]
+            )
+    return pd.DataFrame(
+        values,
+        index=historical_data.index,
+        columns=get_momentum_columns(instruments, pairs),
+    )
+
+
+"""
+Incremental indicators, updated one bar at a time in O(1).
+
+Every indicator keeps the state TA-Lib (or pandas, for the rolling standard
+deviation) carries from one bar to the next, so feeding it a history bar by
+bar gives the same values as the batch functions above. The state is held as
+arrays, so one object tracks the indicator for many instruments at once, and
+'from_history()' builds an indicator that has already seen a history. The
+prices are expected to be filled (no NaN), as in 'historical_df'.
+"""
+
+
+class IncrementalIndicator:
+    """
+    Base class of the incremental indicators. 'update()' takes the inputs of
+    one bar (scalars, or arrays with one value per instrument) and returns the
+    indicator for that bar, NaN until enough bars have been seen.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_history(cls, period, *history):
+        """
+        Returns the indicator after the bars of 'history', one (dates) or
+        (dates x instruments) array per input of 'update()'
+        """
+        history = [np.asarray(values, dtype=np.float64) for values in history]
+        indicator = cls(period, size=history[0].shape[1] if history[0].ndim == 2 else 1)
+        for bar in zip(*history):
+            indicator.update(*bar)
+        return indicator
+
+
+class IncrementalEMA(IncrementalIndicator):
+    """
+    The class IncrementalEMA is the incremental version of 'ema_series()': the
+    first value is the SMA of the first 'period' values, the following ones are
+    'prev + (x - prev) * k' with k = 2 / (period + 1).
+    TA-Lib builds that compile this step into a fused multiply-add can differ
+    from it in the last bit.
+    """
+
+    __slots__ = ("period", "k", "n_values", "total", "value")
+
+    def __init__(self, period, size=1):
+        self.period = period
+        self.k = 2.0 / (period + 1)
+        self.n_values = 0
+        self.total = np.zeros(size)
+        self.value = np.full(size, np.nan)
+
+    @classmethod
+    def from_history(cls, period, values):
+        """
+        Returns the EMA after 'values', taking its last value from
+        'ema_series()' once the EMA is seeded
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) < period:
+            return super().from_history(period, values)
+        ema = cls(period, size=values.shape[1] if values.ndim == 2 else 1)
+        ema.n_values = len(values)
+        ema.value = np.atleast_1d(ema_series(values, period)[-1])
+        return ema
+
+    def update(self, x):
+        self.n_values += 1
+        if self.n_values < self.period:
+            self.total = self.total + x
+        elif self.n_values == self.period:
+            self.total = self.total + x
+            self.value = self.total / self.period
+        else:
+            self.value = ((x - self.value) * self.k) + self.value
+        return self.value
+
+
+class IncrementalSMA(IncrementalIndicator):
+    """
+    The class IncrementalSMA is the incremental version of 'sma_series()',
+    keeping TA-Lib's running total of the last 'period' values
+    """
+
+    __slots__ = ("period", "n_values", "total", "values")
+
+    def __init__(self, period, size=1):
+        self.period = period
+        self.n_values = 0
+        self.total = np.zeros(size)
+        self.values = np.zeros((period, size))
+
+    def update(self, x):
+        self.total = self.total + x
+        self.values[self.n_values % self.period] = x
+        self.n_values += 1
+        if self.n_values < self.period:
+            return np.full(len(self.total), np.nan)
+        value = self.total / self.period
+        # drop the oldest value of the window from the running total
+        self.total = self.total - self.values[self.n_values % self.period]
+        return value
+
+
+class IncrementalADX(IncrementalIndicator):
+    """
+    The class IncrementalADX is the incremental version of 'adx_series()', with
+    Wilder's smoothing of +DM, -DM and the true range. The first ADX is the
+    mean of the first 'period' DX values, available after 2 * 'period' bars.
+    """
+
+    __slots__ = (
+        "period",
+        "n_values",
+        "prev_high",
+        "prev_low",
+        "prev_close",
+        "plus_dm",
+        "minus_dm",
+        "tr",
+        "sum_dx",
+        "value",
+    )
+
+    def __init__(self, period, size=1):
+        self.period = period
+        self.n_values = 0
+        self.prev_high = np.full(size, np.nan)
+        self.prev_low = np.full(size, np.nan)
+        self.prev_close = np.full(size, np.nan)
+        self.plus_dm = np.zeros(size)
+        self.minus_dm = np.zeros(size)
+        self.tr = np.zeros(size)
+        self.sum_dx = np.zeros(size)
+        self.value = np.full(size, np.nan)
+
+    def get_dx(self):
+        """
+        Returns the DX of the current bar and where it is defined (TA-Lib skips
+        the bars with a zero true range or a zero sum of the DIs)
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            minus_di = 100.0 * (self.minus_dm / self.tr)
+            plus_di = 100.0 * (self.plus_dm / self.tr)
+            total = minus_di + plus_di
+            dx = 100.0 * (np.abs(minus_di - plus_di) / total)
+        return dx, ~is_zero(self.tr) & ~is_zero(total)
+
+    def update(self, high, low, close):
+        n = self.period
+        today = self.n_values
+        self.n_values += 1
+        if today == 0:
+            self.prev_high = high
+            self.prev_low = low
+            self.prev_close = close
+            return self.value
+
+        diff_p = high - self.prev_high  # plus delta
+        diff_m = self.prev_low - low  # minus delta
+        self.prev_high = high
+        self.prev_low = low
+        if today >= n:
+            self.minus_dm = self.minus_dm - self.minus_dm / n
+            self.plus_dm = self.plus_dm - self.plus_dm / n
+        is_minus = (diff_m > 0) & (diff_p < diff_m)
+        is_plus = ~is_minus & (diff_p > 0) & (diff_p > diff_m)
+        self.minus_dm = np.where(is_minus, self.minus_dm + diff_m, self.minus_dm)
+        self.plus_dm = np.where(is_plus, self.plus_dm + diff_p, self.plus_dm)
+
+        true_range = get_true_range(high, low, self.prev_close)
+        if today < n:
+            self.tr = self.tr + true_range
+        else:
+            self.tr = self.tr - (self.tr / n) + true_range
+        self.prev_close = close
+        if today < n:
+            return self.value
+
+        dx, has_dx = self.get_dx()
+        if today < 2 * n:
+            self.sum_dx = np.where(has_dx, self.sum_dx + dx, self.sum_dx)
+            if today == 2 * n - 1:
+                self.value = self.sum_dx / n
+        else:
+            self.value = np.where(has_dx, ((self.value * (n - 1)) + dx) / n, self.value)
+        return self.value
+
+
+class RollingStd(IncrementalIndicator):
+    """
+    The class RollingStd is the incremental version of
+    'pd.Series.rolling(period).std()', with pandas' online algorithm: Welford's
+    updates with Kahan compensation as values enter and leave the window, and
+    the window recomputed from scratch when an update cancels most of the sum
+    of squared deviations. NaN values are skipped.
     """
-    return talib.SMA(series, n)
+
+    # the relative drop of the sum of squared deviations pandas treats as a
+    # catastrophic cancellation
+    inv_cond_tol = np.finfo(np.float64).eps * 1e3
+
+    __slots__ = (
+        "period",
+        "n_values",
+        "values",
+        "nobs",
+        "mean",
+        "ssqdm",
+        "compensation_add",
+        "compensation_remove",
+        "unstable",
+    )
+
+    def __init__(self, period, size=1):
+        self.period = period
+        self.n_values = 0
+        self.values = np.full((period, size), np.nan)
+        self.nobs = np.zeros(size)
+        self.mean = np.zeros(size)
+        self.ssqdm = np.zeros(size)
+        self.compensation_add = np.zeros(size)
+        self.compensation_remove = np.zeros(size)
+        self.unstable = np.zeros(size, dtype=bool)
+
+    def add(self, x):
+        valid = ~np.isnan(x)
+        nobs = self.nobs + valid
+        with np.errstate(divide="ignore", invalid="ignore"):
+            prev_mean = self.mean - self.compensation_add
+            y = x - self.compensation_add
+            t = y - self.mean
+            compensation = t + self.mean - y
+            mean = self.mean + t / nobs
+            ssqdm = self.ssqdm + (x - prev_mean) * (x - mean)
+        self.unstable |= valid & (self.ssqdm * self.inv_cond_tol > ssqdm)
+        self.nobs = nobs
+        self.compensation_add = np.where(valid, compensation, self.compensation_add)
+        self.mean = np.where(valid, mean, self.mean)
+        self.ssqdm = np.where(valid, ssqdm, self.ssqdm)
+
+    def remove(self, x):
+        valid = ~np.isnan(x)
+        nobs = self.nobs - valid
+        with np.errstate(divide="ignore", invalid="ignore"):
+            prev_mean = self.mean - self.compensation_remove
+            y = x - self.compensation_remove
+            t = y - self.mean
+            compensation = t + self.mean - y
+            mean = self.mean - t / nobs
+            ssqdm = self.ssqdm - (x - prev_mean) * (x - mean)
+        update = valid & (nobs != 0)
+        empty = valid & (nobs == 0)
+        self.unstable = np.where(
+            empty,
+            False,
+            self.unstable | update & (self.ssqdm * self.inv_cond_tol > ssqdm),
+        )
+        self.nobs = nobs
+        self.compensation_remove = np.where(
+            update, compensation, self.compensation_remove
+        )
+        self.mean = np.where(update, mean, np.where(empty, 0.0, self.mean))
+        self.ssqdm = np.where(update, ssqdm, np.where(empty, 0.0, self.ssqdm))
+
+    def recompute(self):
+        """
+        Rebuilds the state of the unstable instruments from the values of
+        their window, oldest first
+        """
+        cols = self.unstable
+        for state in [
+            self.nobs,
+            self.mean,
+            self.ssqdm,
+            self.compensation_add,
+            self.compensation_remove,
+        ]:
+            state[cols] = 0.0
+        window = np.roll(self.values, -(self.n_values % self.period), axis=0)
+        for x in window:
+            self.add(np.where(cols, x, np.nan))
+        self.unstable = np.zeros(len(cols), dtype=bool)
+
+    def update(self, x):
+        x = np.broadcast_to(np.asarray(x, dtype=np.float64), self.nobs.shape)
+        slot = self.n_values % self.period
+        if self.n_values >= self.period:
+            self.remove(self.values[slot])
+        self.add(x)
+        self.values[slot] = x
+        self.n_values += 1
+        if self.unstable.any():
+            self.recompute()
+        with np.errstate(invalid="ignore"):
+            var = np.where(
+                self.nobs >= self.period, self.ssqdm / (self.nobs - 1.0), np.nan
+            )
+        return np.sqrt(np.maximum(var, 0.0))
@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+
+"""
+Preallocated storage of the daily results of a backtest.
+
+'portfolio_df' used to be grown cell by cell with '.loc' enlargement: every
+new '{inst} units' / '{inst} w' column and every new row reallocated the
+frame. A PortfolioLedger allocates its arrays once, from the simulation dates
+and the instruments, the day loop writes into them by integer position and
+'to_frame()' materialises the usual 'portfolio_df' (same columns, column
+order and values) only when it is needed, e.g. to store it as CSV.
+"""
+
+# the portfolio level fields, one value per day
+FIELDS = [
+    "capital",
+    "strat scalar",
+    "nominal",
+    "leverage",
+    "daily pnl",
+    "nominal ret",
+    "capital ret",
+]
+
+
+def allocate_values(n_days, n_inst):
+    """
+    This function allocates the NaN-filled arrays of a ledger: one array of
+    'n_days' per field of 'FIELDS' and the (dates x instruments) 'units' and
+    'weights'
+    """
+    values = {field: np.full(n_days, np.nan) for field in FIELDS}
+    values["units"] = np.full((n_days, n_inst), np.nan)
+    values["weights"] = np.full((n_days, n_inst), np.nan)
+    return values
+
+
+class PortfolioLedger:
+    """
+    The class PortfolioLedger holds the daily results of a backtest over
+    'dates' and 'instruments' in preallocated float64 arrays, 'values' (see
+    'allocate_values()'), filled in by row position.
+    'first_halted' flags the instruments halted on the first day: the
+    pandas path wrote their units and weights before those of the tradable
+    instruments, and 'to_frame()' keeps that column order.
+    """
+
+    def __init__(self, dates, instruments, first_halted=None, values=None):
+        self.dates = dates
+        self.instruments = list(instruments)
+        self.inst_idx = {inst: j for j, inst in enumerate(self.instruments)}
+        self.first_halted = (
+            np.zeros(len(self.instruments), dtype=bool)
+            if first_halted is None
+            else np.asarray(first_halted, dtype=bool)
+        )
+        self.values = (
+            allocate_values(len(dates), len(self.instruments))
+            if values is None
+            else values
+        )
+        self.units = self.values["units"]
+        self.weights = self.values["weights"]
+
+    def __len__(self):
+        return len(self.dates)
+
+    def set(self, i, field, value):
+        self.values[field][i] = value
+
+    def get(self, i, field):
+        return self.values[field][i]
+
+    def has_nan(self, i):
+        """
+        Whether row 'i' holds a NaN, i.e. whether 'dropna()' would drop it
+        """
+        return bool(
+            np.isnan(self.units[i]).any()
+            or np.isnan(self.weights[i]).any()
+            or any(np.isnan(self.values[field][i]) for field in FIELDS)
+        )
+
+    def get_columns(self):
+        """
+        Returns the columns of 'portfolio_df' as {name: array}, in the order
+        the pandas path creates them
+        """
+        n_days = len(self.dates)
+        columns = {field: self.values[field] for field in ["capital", "strat scalar"]}
+        if n_days:
+            halted = [j for j in range(len(self.instruments)) if self.first_halted[j]]
+            tradable = [
+                j for j in range(len(self.instruments)) if not self.first_halted[j]
+            ]
+            for j in halted:
+                columns[f"{self.instruments[j]} units"] = self.units[:, j]
+                columns[f"{self.instruments[j]} w"] = self.weights[:, j]
+            for j in tradable:
+                columns[f"{self.instruments[j]} units"] = self.units[:, j]
+            for j in tradable:
+                columns[f"{self.instruments[j]} w"] = self.weights[:, j]
+            columns["nominal"] = self.values["nominal"]
+            columns["leverage"] = self.values["leverage"]
+        # the returns are only created from the second day on
+        if n_days > 1:
+            for field in ["daily pnl", "nominal ret", "capital ret"]:
+                columns[field] = self.values[field]
+        return columns
+
+    def get_row(self, i):
+        """
+        Returns row 'i' of 'portfolio_df' as a Series, e.g. for debug prints
+        """
+        row = {"date": self.dates[i]}
+        row.update({name: values[i] for name, values in self.get_columns().items()})
+        return pd.Series(row, name=i)
+
+    def to_frame(self):
+        """
+        Returns 'portfolio_df', with a 'date' column and a RangeIndex
+        """
+        portfolio_df = pd.DataFrame(index=self.dates).reset_index()
+        return pd.concat(
+            [
+                portfolio_df,
+                pd.DataFrame(self.get_columns(), index=portfolio_df.index),
+            ],
+            axis=1,
+        )
+
+    def to_csv(self, path):
+        """
+        Writes 'portfolio_df' in the CSV layout of the pull scripts
+        """
+        self.to_frame().to_csv(path)
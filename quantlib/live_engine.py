@@ -0,0 +1,203 @@
+import numpy as np
+import pandas as pd
+import quantlib.array_engine as array_engine
+import quantlib.backtest_utils as backtest_utils
+
+from quantlib.indicators_cal import IncrementalADX, IncrementalEMA, RollingStd
+
+"""
+Live updates of the momentum subsystems, one daily bar at a time.
+
+'get_subsys_pos()' recomputes every indicator and replays the whole simulation
+from 'simulation_start' on each run, although in production only the latest
+bar is new. A LiveSimulation runs the backtest once and keeps its state: the
+EMA and ADX states, the windows of the returns and of the activity flags, the
+last prices and FX rates, the capital, positions and the strategy scalar
+window. Each new bar then only advances that state by one day with
+'array_engine.simulate_day()', the same day step as the numpy engine.
+
+The EMA and ADX follow TA-Lib's recursions and the volatility follows pandas'
+rolling standard deviation (see the incremental indicators of
+quantlib.indicators_cal), so the live rows match the batch backtest, up to
+the last bits with TA-Lib builds using fused multiply-adds.
+"""
+
+
+class LiveSimulation:
+    """
+    The class LiveSimulation holds the state of the momentum backtest over
+    'instruments' so that a new daily bar can be appended with 'update()'
+    """
+
+    def __init__(
+        self,
+        instruments,
+        pairs,
+        get_votes,
+        vol_target,
+        adx_period=14,
+        vol_window=25,
+        halt_window=5,
+        active_window=25,
+        capital=10000,
+    ):
+        self.instruments = list(instruments)
+        self.pairs = pairs
+        self.get_votes = get_votes
+        self.vol_target = vol_target
+        self.adx_period = adx_period
+        self.vol_window = vol_window
+        self.halt_window = halt_window
+        self.active_window = active_window
+        self.capital = capital
+        self.denominations = backtest_utils.get_denominations(self.instruments)
+        self.day = None
+
+    def start(self, historical_data, panels):
+        """
+        This function runs the backtest over 'panels' (see
+        'array_engine.build_panels()') and builds the indicator and window
+        states from 'historical_data', the frame extended by
+        'data_utils.extend_dataframe()' (with its raw high and low columns)
+        """
+        high, low, close = [
+            array_engine.get_panel(historical_data, self.instruments, field)
+            for field in ["high", "low", "close"]
+        ]
+        rets = array_engine.get_panel(historical_data, self.instruments, "% ret")
+        active = array_engine.get_panel(historical_data, self.instruments, "active")
+
+        self.emas = {
+            span: IncrementalEMA.from_history(span, close)
+            for span in sorted({span for pair in self.pairs for span in pair})
+        }
+        self.adx = IncrementalADX.from_history(self.adx_period, high, low, close)
+        # the volatility is computed before the first return is back filled
+        rets = rets.astype(np.float64)
+        rets[0] = np.nan
+        self.ret_vol = RollingStd.from_history(self.vol_window, rets)
+
+        self.n_days = len(close)
+        self.inactive_days = backtest_utils.get_consecutive_days(active == 0)[-1]
+        self.active_days = backtest_utils.get_consecutive_days(active == 1)[-1]
+        self.high, self.low, self.close = high[-1], low[-1], close[-1]
+        self.fx_closes = {
+            quote: historical_data[f"{quote}_USD close"].iloc[-1]
+            for is_denominated, base, quote in self.denominations.values()
+            if is_denominated and quote != "USD"
+        }
+
+        self.scalar_calculator = backtest_utils.RollingStratScalar(
+            lookback=100, vol_target=self.vol_target, default=2
+        )
+        self.day = None
+        for i in range(len(panels["dates"])):
+            self.day = array_engine.simulate_day(
+                {field: panels[field][i] for field in array_engine.PANEL_FIELDS},
+                self.day,
+                self.vol_target,
+                self.scalar_calculator,
+                capital=self.capital,
+            )
+
+    def get_bar_field(self, bar, field, last):
+        """
+        The '{inst} {field}' values of the bar, forward filled with 'last'
+        """
+        values = np.array(
+            [bar.get(f"{inst} {field}", np.nan) for inst in self.instruments],
+            dtype=np.float64,
+        )
+        return np.where(np.isnan(values), last, values)
+
+    def get_fx_close(self, quote, bar):
+        """
+        The '{quote}_USD close' of the bar, also accepting the 'USD_{quote}'
+        pair, and the last known rate if the bar has neither
+        """
+        if not np.isnan(bar.get(f"{quote}_USD close", np.nan)):
+            self.fx_closes[quote] = bar[f"{quote}_USD close"]
+        elif not np.isnan(bar.get(f"USD_{quote} close", np.nan)):
+            self.fx_closes[quote] = 1 / bar[f"USD_{quote} close"]
+        return self.fx_closes[quote]
+
+    def update(self, date, bar):
+        """
+        This function appends the bar of 'date' and returns that day's row of
+        'portfolio_df' (capital, strategy scalar, units and weights, ...).
+        'bar' maps '{inst} high', '{inst} low' and '{inst} close' (and the
+        '{quote}_USD close' of denominated instruments) to their values, e.g.
+        a row of the OHLCV DataFrame; missing values keep the last price.
+        """
+        high = self.get_bar_field(bar, "high", self.high)
+        low = self.get_bar_field(bar, "low", self.low)
+        close = self.get_bar_field(bar, "close", self.close)
+
+        # Returns, volatility and activity flags as in 'extend_dataframe()'
+        ret = close / self.close - 1
+        ret_vol = self.ret_vol.update(ret)
+        is_active = close != self.close
+        self.n_days += 1
+        self.inactive_days = np.where(is_active, 0, self.inactive_days + 1)
+        self.active_days = np.where(is_active, self.active_days + 1, 0)
+        halted = self.inactive_days >= min(self.n_days, self.halt_window)
+        all_active = self.active_days >= min(self.n_days, self.active_window)
+
+        # Votes and forecasts as in 'array_engine.build_panels()'
+        emas = {span: ema.update(close) for span, ema in self.emas.items()}
+        adx = self.adx.update(high, low, close)
+        votes = np.zeros(len(self.instruments))
+        for fast, slow in self.pairs:
+            votes += self.get_votes(emas[fast] - emas[slow])
+        forecasts = np.where(adx < 25, 0, votes / len(self.pairs))
+
+        # USD conversions as in 'backtest_utils.get_unit_conversions()'
+        val_fx = np.ones(len(self.instruments))
+        dollar_value = close.copy()
+        for j, inst in enumerate(self.instruments):
+            is_denominated, base, quote = self.denominations[inst]
+            if not is_denominated:
+                continue
+            quote_fx = 1.0 if quote == "USD" else self.get_fx_close(quote, bar)
+            val_fx[j] = quote_fx
+            dollar_value[j] = 1 if base == "USD" else close[j] * quote_fx
+
+        self.high, self.low, self.close = high, low, close
+        self.day = array_engine.simulate_day(
+            {
+                "halted": halted,
+                "close": close,
+                "ret": ret,
+                "ret_vol": np.where(all_active, ret_vol, 0.025),
+                "forecasts": forecasts,
+                "val_fx": val_fx,
+                "dollar_value": dollar_value,
+            },
+            self.day,
+            self.vol_target,
+            self.scalar_calculator,
+            capital=self.capital,
+        )
+        return self.get_row(date)
+
+    def get_row(self, date):
+        row = {
+            "date": date,
+            "capital": self.day["capital"],
+            "strat scalar": self.day["strat scalar"],
+        }
+        row.update(
+            {
+                f"{inst} units": units
+                for inst, units in zip(self.instruments, self.day["units"])
+            }
+        )
+        row.update(
+            {
+                f"{inst} w": weight
+                for inst, weight in zip(self.instruments, self.day["weights"])
+            }
+        )
+        for field in ["nominal", "leverage", "daily pnl", "nominal ret", "capital ret"]:
+            row[field] = self.day[field]
+        return pd.Series(row)
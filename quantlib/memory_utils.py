@@ -0,0 +1,60 @@
+import sys
+import pandas as pd
+
+try:
+    import resource  # not available on Windows
+except ImportError:
+    resource = None
+
+
+def get_frame_memory(df):
+    """
+    This function returns the memory held by a DataFrame in bytes, including
+    its index
+    """
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def get_peak_rss():
+    """
+    This function returns the peak resident memory of the process in bytes,
+    or None where it cannot be measured
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryReport:
+    """
+    The class MemoryReport records the size of the frame produced by each stage
+    of a run (raw OHLCV, 'historical_df', the frame extended with indicators,
+    'portfolio_df', ...) together with the peak memory of the process at that
+    point, to size machines for a given universe and history length
+    """
+
+    def __init__(self):
+        self.stages = []
+
+    def record(self, stage, df):
+        self.stages.append(
+            {
+                "stage": stage,
+                "rows": len(df.index),
+                "columns": len(df.columns),
+                "frame MB": get_frame_memory(df) / 2**20,
+                "peak rss MB": (
+                    get_peak_rss() / 2**20 if get_peak_rss() is not None else None
+                ),
+            }
+        )
+
+    def to_frame(self):
+        return pd.DataFrame(
+            self.stages, columns=["stage", "rows", "columns", "frame MB", "peak rss MB"]
+        ).set_index("stage")
+
+    def print_report(self):
+        print(self.to_frame().round(1).to_string())
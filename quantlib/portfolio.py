@@ -0,0 +1,276 @@
+import numpy as np
+import pandas as pd
+import quantlib.analytics as analytics
+import quantlib.array_engine as array_engine
+import quantlib.backtest_utils as backtest_utils
+import quantlib.ledger as ledger
+import quantlib.storage as storage
+
+from concurrent.futures import ProcessPoolExecutor
+from dateutil.relativedelta import relativedelta
+from quantlib.indicator_cache import IndicatorCache
+
+"""
+Multi-subsystem portfolio driven by config/portfolio_config.json.
+
+The config lists, per market, the subsystems traded and their weights, the
+instruments config of every subsystem in every market, the 'vol_target' and the
+number of simulated years ('sim_years'). The portfolio is built in three steps:
+1. 'run_market()' runs all subsystems of one market over its stored
+   'historical_df'. The frame is loaded once and the subsystems share one
+   IndicatorCache, so the ADX and the EMA spans they have in common are only
+   computed once. The markets run concurrently, one process each.
+2. 'combine_markets()' aligns the positions of every subsystem on the union of
+   the market calendars. A subsystem position is kept as units per dollar of
+   the subsystem capital, held (forward filled) on the days its market is
+   closed, and weighted by the subsystem weight over the sum of all weights.
+3. 'simulate_portfolio()' runs the combined positions on one capital with a
+   portfolio level strategy scalar, which targets 'vol_target' on the combined
+   capital returns as the subsystems do on their own.
+"""
+
+
+def get_allocations(subsystems_config):
+    """
+    This function returns the share of the portfolio capital of every
+    subsystem, {(market, subsys): weight}, from the 'subsystems' section of the
+    portfolio config. The weights are normalised by their sum.
+    """
+    total = sum(
+        weight for weights in subsystems_config.values() for weight in weights.values()
+    )
+    if total <= 0:
+        raise Exception("The subsystem weights of the portfolio config sum to 0")
+    return {
+        (market, subsys): weight / total
+        for market, weights in subsystems_config.items()
+        for subsys, weight in weights.items()
+    }
+
+
+def run_market(
+    historical_path,
+    subsystems,
+    sim_years,
+    vol_target,
+    engine="numpy",
+    instruments_keys=None,
+):
+    """
+    This function runs the subsystems of one market, {name: (subsys class,
+    instruments config path)}, over the 'historical_df' stored at
+    'historical_path' and returns the arrays 'combine_markets()' needs: the
+    simulation 'dates', the 'instruments' traded by any of the subsystems, their
+    'close', 'val_fx' and 'dollar_value' (see
+    'backtest_utils.get_unit_conversions()') and, per subsystem, its units per
+    dollar of capital as a (dates x instruments) array. 'instruments_keys'
+    selects the lists of the instruments configs to trade (all by default).
+    """
+    historical_df = storage.load_historical_df(historical_path)
+    simulation_start = historical_df.index[-1] - relativedelta(years=sim_years)
+    indicator_cache = IndicatorCache()
+
+    positions = {}
+    for name, (subsys, instruments_config) in subsystems.items():
+        strat = subsys(
+            instruments_config=instruments_config,
+            historical_df=historical_df,
+            simulation_start=simulation_start,
+            vol_target=vol_target,
+            engine=engine,
+            indicator_cache=indicator_cache,
+            instruments_keys=instruments_keys,
+        )
+        portfolio_df, subsys_instruments = strat.get_subsys_pos()
+        units = portfolio_df[[f"{inst} units" for inst in subsys_instruments]]
+        positions[name] = (
+            subsys_instruments,
+            np.nan_to_num(units.to_numpy(dtype=np.float64))
+            / portfolio_df["capital"].to_numpy()[:, None],
+        )
+    dates = pd.Index(portfolio_df["date"], name="date")
+
+    instruments = list(
+        dict.fromkeys(inst for insts, _ in positions.values() for inst in insts)
+    )
+    inst_idx = {inst: j for j, inst in enumerate(instruments)}
+    start = len(historical_df.index) - len(dates)
+    val_fx, dollar_value = backtest_utils.get_unit_conversions(
+        historical_df, instruments
+    )
+    market = {
+        "dates": dates,
+        "instruments": instruments,
+        "close": array_engine.get_panel(historical_df, instruments, "close")[start:],
+        "val_fx": val_fx[start:],
+        "dollar_value": dollar_value[start:],
+        "units per capital": {},
+    }
+    for name, (subsys_instruments, units_per_capital) in positions.items():
+        aligned = np.zeros((len(dates), len(instruments)))
+        aligned[:, [inst_idx[inst] for inst in subsys_instruments]] = units_per_capital
+        market["units per capital"][name] = aligned
+    return market
+
+
+def combine_markets(markets, allocations):
+    """
+    This function aligns the markets returned by 'run_market()', {market:
+    arrays}, on the union of their dates and returns the (dates x instruments)
+    arrays of the portfolio: the 'close', 'ret', 'val_fx' and 'dollar_value' of
+    every instrument, forward filled over the days its market is closed, and
+    the 'units per capital' of the combined subsystems, weighted by
+    'allocations' (see 'get_allocations()')
+    """
+    dates = markets[next(iter(markets))]["dates"]
+    for market in markets.values():
+        dates = dates.union(market["dates"])
+    instruments = [
+        inst for market in markets.values() for inst in market["instruments"]
+    ]
+    if len(set(instruments)) != len(instruments):
+        raise Exception("An instrument is traded in more than one market")
+
+    def align(market, values):
+        return pd.DataFrame(values, index=market["dates"]).reindex(dates).ffill()
+
+    panels = {"dates": dates, "instruments": instruments}
+    for field in ["close", "val_fx", "dollar_value"]:
+        panels[field] = np.hstack(
+            [align(market, market[field]).to_numpy() for market in markets.values()]
+        )
+    units_per_capital = []
+    for name, market in markets.items():
+        combined = np.zeros(market["close"].shape)
+        for subsys, values in market["units per capital"].items():
+            combined += allocations[(name, subsys)] * values
+        # positions are held over the days the market is closed, and are 0
+        # before its simulation starts
+        units_per_capital.append(align(market, combined).fillna(0).to_numpy())
+    panels["units per capital"] = np.hstack(units_per_capital)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        panels["ret"] = np.vstack(
+            [
+                np.full((1, len(instruments)), np.nan),
+                panels["close"][1:] / panels["close"][:-1] - 1,
+            ]
+        )
+    return panels
+
+
+def simulate_portfolio(panels, vol_target, capital=10000, lookback=100):
+    """
+    This function runs the combined positions of 'combine_markets()' on one
+    capital and returns the daily results as arrays, with the same fields as
+    'array_engine.simulate_arrays()'. The units of a day are its 'units per
+    capital' times the capital times the strategy scalar, which starts at 1
+    (the subsystems already target 'vol_target') and is then rolled over the
+    last 'lookback' capital returns (see 'backtest_utils.RollingStratScalar').
+    """
+    n_days, n_inst = panels["close"].shape
+    results = ledger.allocate_values(n_days, n_inst)
+    scalar_calculator = backtest_utils.RollingStratScalar(
+        lookback=lookback, vol_target=vol_target, default=1
+    )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for i in range(n_days):
+            strat_scalar = 1
+            if i == 0:
+                results["capital"][i] = capital
+            else:
+                day_pnl, nominal_ret, capital_ret = backtest_utils.get_day_stats(
+                    prev_units=results["units"][i - 1],
+                    prev_weights=results["weights"][i - 1],
+                    price_change=panels["close"][i] - panels["close"][i - 1],
+                    val_fx=panels["val_fx"][i - 1],
+                    rets=panels["ret"][i],
+                    prev_leverage=results["leverage"][i - 1],
+                )
+                results["capital"][i] = results["capital"][i - 1] + day_pnl
+                results["daily pnl"][i] = day_pnl
+                results["nominal ret"][i] = nominal_ret
+                results["capital ret"][i] = capital_ret
+                strat_scalar = scalar_calculator.get_strat_scalar()
+            results["strat scalar"][i] = strat_scalar
+
+            units = (
+                strat_scalar * results["capital"][i] * panels["units per capital"][i]
+            )
+            held = units != 0
+            nominal_inst = np.zeros(n_inst)
+            nominal_inst[held] = np.abs(units[held] * panels["dollar_value"][i][held])
+            nominal_total = backtest_utils.sequential_sum(nominal_inst[held])
+            results["units"][i] = units
+            results["weights"][i] = nominal_inst / nominal_total if nominal_total else 0
+            results["nominal"][i] = nominal_total
+            results["leverage"][i] = nominal_total / results["capital"][i]
+
+            if i != 0 and not np.isnan(results["capital ret"][i]):
+                scalar_calculator.update(results["capital ret"][i], strat_scalar)
+    return results
+
+
+def get_portfolio_df(panels, results):
+    """
+    This function builds the portfolio 'portfolio_df' from the results of
+    'simulate_portfolio()', with the columns of a subsystem 'portfolio_df'
+    """
+    return ledger.PortfolioLedger(
+        panels["dates"], panels["instruments"], values=results
+    ).to_frame()
+
+
+def run_portfolio(
+    portfolio_config,
+    historical_paths,
+    subsystems,
+    engine="numpy",
+    capital=10000,
+    lookback=100,
+    max_workers=None,
+):
+    """
+    This function runs the portfolio of 'portfolio_config' (the contents of
+    config/portfolio_config.json) and returns its 'portfolio_df' and metrics
+    (see 'analytics.get_metrics()'). 'historical_paths' maps every market to its
+    stored 'historical_df' and 'subsystems' maps the subsystem names of the
+    config to their classes, e.g. {"lbmom": Lbmom}. The markets run in a process
+    pool, scripts calling it must be guarded by 'if __name__ == "__main__"'.
+    """
+    allocations = get_allocations(portfolio_config["subsystems"])
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            market: pool.submit(
+                run_market,
+                historical_paths[market],
+                {
+                    name: (
+                        subsystems[name],
+                        portfolio_config["instruments_config"][name][market],
+                    )
+                    for name in weights
+                },
+                portfolio_config["sim_years"],
+                portfolio_config["vol_target"],
+                engine=engine,
+                instruments_keys=portfolio_config.get("instruments_keys", {}).get(
+                    market
+                ),
+            )
+            for market, weights in portfolio_config["subsystems"].items()
+        }
+        markets = {market: future.result() for market, future in futures.items()}
+
+    panels = combine_markets(markets, allocations)
+    results = simulate_portfolio(
+        panels, portfolio_config["vol_target"], capital=capital, lookback=lookback
+    )
+    series = analytics.get_series(results, np.nan_to_num(panels["dollar_value"]))
+    metrics = {
+        name: values[0]
+        for name, values in analytics.get_metrics(
+            analytics.stack_series([series])
+        ).items()
+    }
+    return get_portfolio_df(panels, results), metrics
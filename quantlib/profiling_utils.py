@@ -0,0 +1,229 @@
+import os
+import io
+import json
+import time
+import pstats
+import cProfile
+import functools
+import threading
+
+from contextlib import contextmanager, nullcontext
+
+"""
+Timers, counters and optional cProfile capture for the stages of a run.
+
+Instrumentation is disabled by default and then costs one attribute check per
+timer or counter: 'timer()' returns a shared no-op context manager, functions
+decorated with 'timed()' are called directly and 'count()' returns at once.
+It is enabled with the QUANTLIB_PROFILE environment variable, or 'enable()':
+- QUANTLIB_PROFILE=1 records the timers and counters
+- QUANTLIB_PROFILE=cprofile also runs cProfile between 'start_cprofile()' and
+  'print_summary()' / 'get_summary()'
+
+e.g. QUANTLIB_PROFILE=1 python pull_crypto.py prints, at the end of the run,
+the calls and seconds of the download, 'extend_dataframe()', the indicators
+and the day loop of each subsystem, the days simulated and the '.loc' calls
+made by the pandas engine.
+"""
+
+# 'timer()' returns this context manager while the instrumentation is disabled
+NULL_TIMER = nullcontext()
+
+
+class Profiler:
+    """
+    The class Profiler accumulates the calls and seconds of named timers and
+    the totals of named counters, from any thread
+    """
+
+    def __init__(self, enabled=False, cprofile=False):
+        self.enabled = enabled
+        self.cprofile = cprofile
+        self.timings = {}
+        self.counters = {}
+        self.profile = None
+        self.lock = threading.Lock()
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            calls, total = self.timings.get(name, (0, 0.0))
+            self.timings[name] = (calls + 1, total + seconds)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def record_time(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timer(self, name):
+        """
+        Context manager adding the time spent in its block to the timer 'name'
+        """
+        return self.record_time(name) if self.enabled else NULL_TIMER
+
+    @contextmanager
+    def record_calls(self, name, owner, methods):
+        originals = {method: owner.__dict__.get(method) for method in methods}
+
+        def wrap(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                self.count(name)
+                return function(*args, **kwargs)
+
+            return wrapper
+
+        for method in methods:
+            setattr(owner, method, wrap(getattr(owner, method)))
+        try:
+            yield
+        finally:
+            for method, original in originals.items():
+                if original is None:
+                    delattr(owner, method)
+                else:
+                    setattr(owner, method, original)
+
+    def count_calls(self, name, owner, methods):
+        """
+        Context manager counting in 'name' the calls of the 'methods' of the
+        class 'owner' made in its block, by any thread
+        """
+        return self.record_calls(name, owner, methods) if self.enabled else NULL_TIMER
+
+    def start_cprofile(self):
+        if self.enabled and self.cprofile and self.profile is None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def stop_cprofile(self):
+        if self.profile is not None:
+            self.profile.disable()
+
+    def get_summary(self, top=20):
+        """
+        Returns the timers {name: {"calls", "seconds"}}, the counters and, if
+        cProfile ran, its 'top' functions by cumulative time as text
+        """
+        self.stop_cprofile()
+        summary = {
+            "timers": {
+                name: {"calls": calls, "seconds": seconds}
+                for name, (calls, seconds) in sorted(
+                    self.timings.items(), key=lambda item: -item[1][1]
+                )
+            },
+            "counters": dict(self.counters),
+        }
+        if self.profile is not None:
+            stream = io.StringIO()
+            pstats.Stats(self.profile, stream=stream).sort_stats(
+                "cumulative"
+            ).print_stats(top)
+            summary["cprofile"] = stream.getvalue()
+        return summary
+
+    def reset(self):
+        self.stop_cprofile()
+        self.timings, self.counters, self.profile = {}, {}, None
+
+
+profiler = Profiler(
+    enabled=os.environ.get("QUANTLIB_PROFILE", "") not in ("", "0"),
+    cprofile=os.environ.get("QUANTLIB_PROFILE") == "cprofile",
+)
+
+
+def enable(cprofile=False):
+    profiler.enabled = True
+    profiler.cprofile = cprofile
+
+
+def timer(name):
+    """
+    This function returns a context manager timing its block as 'name', e.g.
+    with profiling_utils.timer("download"): ...
+    """
+    return profiler.timer(name)
+
+
+def timed(name=None):
+    """
+    This function returns a decorator timing every call of the decorated
+    function as 'name' (its qualified name by default)
+    """
+
+    def decorator(function):
+        timer_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            with profiler.record_time(timer_name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name, n=1):
+    profiler.count(name, n)
+
+
+def count_loc_calls(name):
+    """
+    This function returns a context manager counting in 'name' the DataFrame
+    '.loc' lookups and assignments made in its block
+    """
+    if not profiler.enabled:
+        return NULL_TIMER
+    # '.loc' is implemented by a private pandas class, it is only imported
+    # when the instrumentation is enabled and nothing is counted without it
+    try:
+        from pandas.core.indexing import _LocIndexer
+    except ImportError:
+        return NULL_TIMER
+    return profiler.count_calls(name, _LocIndexer, ["__getitem__", "__setitem__"])
+
+
+def start_cprofile():
+    profiler.start_cprofile()
+
+
+def get_summary(top=20):
+    return profiler.get_summary(top)
+
+
+def print_summary(top=20):
+    """
+    This function prints the timers, the counters and the cProfile report of
+    the run, if the instrumentation is enabled
+    """
+    if not profiler.enabled:
+        return
+    summary = get_summary(top)
+    print("timer".ljust(40), "calls".rjust(8), "seconds".rjust(12))
+    for name, timing in summary["timers"].items():
+        print(name.ljust(40), f"{timing['calls']:8d}", f"{timing['seconds']:12.4f}")
+    for name, total in summary["counters"].items():
+        print(name.ljust(40), f"{total:8d}")
+    if "cprofile" in summary:
+        print(summary["cprofile"])
+
+
+def save_summary(path, top=20):
+    """
+    This function writes the summary of 'get_summary()' to 'path' as JSON
+    """
+    with open(path, "w") as f:
+        json.dump(get_summary(top), f, indent=2)
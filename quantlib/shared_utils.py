@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+
+from multiprocessing import shared_memory
+
+"""
+Read-only NumPy arrays shared between processes.
+
+'share_arrays()' copies named arrays once into a single shared memory block and
+returns a small manifest (the name of the block and the dtype, shape and offset
+of every array). The manifest is all a worker process needs to receive: with
+'attach_arrays()' it maps the arrays from the block without copying them, so N
+workers cost roughly one copy of the data instead of one pickled copy per task.
+'share_frame()' and 'attach_frame()' do the same for a whole DataFrame, e.g. the
+price and indicator panel of the subsystems (see quantlib.batch_utils).
+"""
+
+# offsets are aligned to cache lines
+ALIGNMENT = 64
+
+
+def share_arrays(arrays):
+    """
+    This function copies the arrays of the dict 'arrays' into a new shared
+    memory block and returns the block and its manifest. The caller owns the
+    block and must 'close()' and 'unlink()' it once the workers are done.
+    """
+    arrays = {name: np.ascontiguousarray(values) for name, values in arrays.items()}
+    layout, size = {}, 0
+    for name, values in arrays.items():
+        layout[name] = (values.dtype.str, values.shape, size)
+        size += -(-values.nbytes // ALIGNMENT) * ALIGNMENT
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for name, values in arrays.items():
+        dtype, shape, offset = layout[name]
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)[...] = values
+    return shm, {"name": shm.name, "arrays": layout}
+
+
+def attach_arrays(manifest):
+    """
+    This function attaches to the shared memory block of 'manifest' and
+    returns the block and a dict of read-only arrays viewing it. The block
+    must stay referenced (and open) as long as the arrays are used.
+    """
+    shm = shared_memory.SharedMemory(name=manifest["name"])
+    arrays = {}
+    for name, (dtype, shape, offset) in manifest["arrays"].items():
+        values = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        values.flags.writeable = False
+        arrays[name] = values
+    return shm, arrays
+
+
+def share_frame(df):
+    """
+    This function copies the DataFrame 'df' into a new shared memory block, one
+    2-D array per dtype holding its columns, and returns the block and its
+    manifest. Besides the arrays the manifest holds the index of 'df' and the
+    column index, the block and position of every column in the order of 'df'.
+    The caller owns the block as with 'share_arrays()'.
+    """
+    dtypes = df.dtypes.astype(str).tolist()
+    blocks, positions = {}, {}
+    for dtype in dict.fromkeys(dtypes):
+        idx = [j for j, d in enumerate(dtypes) if d == dtype]
+        blocks[dtype] = df.iloc[:, idx].to_numpy(dtype=dtype).T
+        positions.update({j: (dtype, k) for k, j in enumerate(idx)})
+    columns = [(col, *positions[j]) for j, col in enumerate(df.columns)]
+    shm, manifest = share_arrays(blocks)
+    manifest.update(index=df.index, columns=columns)
+    return shm, manifest
+
+
+def get_frame(blocks, index, columns):
+    """
+    This function returns a DataFrame holding the 2-D arrays of 'blocks', a
+    list of (values, positions) with one array of (columns x rows) per dtype
+    and the positions of its columns in 'columns', as its blocks without
+    copying them. pd.concat() and column selections copy the arrays unless
+    copy-on-write is enabled (before pandas 3), the frame is built from its
+    blocks instead.
+    """
+    try:
+        from pandas.api.internals import create_dataframe_from_blocks
+    except ImportError:
+        # pandas < 3
+        from pandas.core.internals import BlockManager
+        from pandas.core.internals.api import make_block
+
+        manager = BlockManager(
+            [
+                make_block(values, placement=positions, ndim=2)
+                for values, positions in blocks
+            ],
+            [pd.Index(columns), index],
+        )
+        return pd.DataFrame._from_mgr(manager, axes=manager.axes)
+    return create_dataframe_from_blocks(blocks, index=index, columns=pd.Index(columns))
+
+
+def attach_frame(manifest):
+    """
+    This function attaches to the shared memory block of a manifest of
+    'share_frame()' and returns the block and a DataFrame viewing it without
+    copying, one block per dtype with the columns in their original order. The
+    frame is read-only: an assignment copies the modified columns first under
+    copy-on-write and fails otherwise.
+    """
+    shm, arrays = attach_arrays(manifest)
+    blocks = [
+        (
+            values,
+            np.array(
+                [j for j, (_, d, _) in enumerate(manifest["columns"]) if d == dtype],
+                dtype=np.intp,
+            ),
+        )
+        for dtype, values in arrays.items()
+    ]
+    df = get_frame(
+        blocks, manifest["index"], [col for col, _, _ in manifest["columns"]]
+    )
+    return shm, df
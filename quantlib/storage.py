@@ -0,0 +1,147 @@
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+import quantlib.profiling_utils as profiling_utils
+
+"""
+Columnar on-disk storage for 'historical_df' and portfolio frames.
+
+Frames are written as Parquet files (one column per '{inst} {field}' series),
+so a later run can read back only the instruments, fields and dates it needs
+instead of loading the whole file. Excel stays available as an explicit export.
+"""
+
+PORTFOLIO_COLUMNS = [
+    "date",
+    "capital",
+    "strat scalar",
+    "nominal",
+    "leverage",
+    "daily pnl",
+    "nominal ret",
+    "capital ret",
+]
+
+
+def save_frame(df, path):
+    """
+    This function writes a DataFrame (including its index) to a Parquet file
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    df.to_parquet(path, engine="pyarrow")
+
+
+def get_columns(path):
+    """
+    This function returns the column names stored in a Parquet file without
+    reading any data
+    """
+    schema = pq.read_schema(path)
+    index_columns = [
+        col
+        for col in (schema.pandas_metadata or {}).get("index_columns", [])
+        if isinstance(col, str)
+    ]
+    return [name for name in schema.names if name not in index_columns]
+
+
+def select_columns(columns, instruments=None, fields=None):
+    """
+    This function selects the '{inst} {field}' columns for the given instruments
+    and/or fields, keeping the stored column order, e.g. fields=['close', '% ret']
+    """
+    selected = []
+    for col in columns:
+        inst_ok = instruments is None or any(
+            col.startswith(f"{inst} ") for inst in instruments
+        )
+        field_ok = fields is None or any(col.endswith(f" {field}") for field in fields)
+        if inst_ok and field_ok:
+            selected.append(col)
+    return selected
+
+
+def load_frame(
+    path,
+    instruments=None,
+    fields=None,
+    columns=None,
+    start=None,
+    end=None,
+    date_col="date",
+):
+    """
+    This function reads a frame saved with 'save_frame()'. Only the requested
+    columns (explicit 'columns', or those matching 'instruments' / 'fields') are
+    read, and 'start' / 'end' are pushed down to the reader as filters on
+    'date_col' (the 'date' index of 'historical_df' or the 'date' column of
+    portfolio frames), both ends inclusive.
+    """
+    if columns is None and (instruments is not None or fields is not None):
+        columns = select_columns(get_columns(path), instruments, fields)
+    filters = []
+    if start is not None:
+        filters.append((date_col, ">=", start))
+    if end is not None:
+        filters.append((date_col, "<=", end))
+    if (
+        columns is not None
+        and date_col not in columns
+        and date_col in get_columns(path)
+    ):
+        # keep the 'date' column of portfolio frames, the 'date' index of
+        # 'historical_df' is restored from the pandas metadata anyway
+        columns = [date_col] + list(columns)
+    return pd.read_parquet(
+        path, engine="pyarrow", columns=columns, filters=filters or None
+    )
+
+
+@profiling_utils.timed()
+def save_historical_df(historical_df, path, excel_path=None):
+    """
+    This function stores 'historical_df' in Parquet and, only if 'excel_path'
+    is given, also exports it to Excel as the pull scripts used to do
+    """
+    save_frame(historical_df, path)
+    if excel_path is not None:
+        historical_df.to_excel(excel_path)
+
+
+@profiling_utils.timed()
+def load_historical_df(path, instruments=None, fields=None, start=None, end=None):
+    """
+    This function loads (a subset of) a stored 'historical_df'
+    """
+    return load_frame(
+        path, instruments=instruments, fields=fields, start=start, end=end
+    )
+
+
+@profiling_utils.timed()
+def save_portfolio_df(portfolio_df, path, csv_path=None):
+    """
+    This function stores a subsystem 'portfolio_df' in Parquet and, if
+    'csv_path' is given, also exports it to CSV
+    """
+    save_frame(portfolio_df, path)
+    if csv_path is not None:
+        portfolio_df.to_csv(csv_path)
+
+
+def load_portfolio_df(path, instruments=None, fields=None, start=None, end=None):
+    """
+    This function loads (a subset of) a stored 'portfolio_df', e.g.
+    fields=['units'] for the positions only. The 'date' column and the
+    portfolio level columns ('capital', 'leverage', ...) are always kept.
+    """
+    columns = None
+    if instruments is not None or fields is not None:
+        stored = get_columns(path)
+        inst_cols = select_columns(
+            [col for col in stored if col not in PORTFOLIO_COLUMNS], instruments, fields
+        )
+        columns = [
+            col for col in stored if col in PORTFOLIO_COLUMNS or col in inst_cols
+        ]
+    return load_frame(path, columns=columns, start=start, end=end)
@@ -0,0 +1,200 @@
+import itertools
+import numpy as np
+import pandas as pd
+import quantlib.analytics as analytics
+import quantlib.array_engine as array_engine
+import quantlib.backtest_utils as backtest_utils
+import quantlib.data_utils as data_utils
+import quantlib.indicators_cal as indicators_cal
+import quantlib.shared_utils as shared_utils
+
+from concurrent.futures import ProcessPoolExecutor
+
+"""
+Parameter sweeps of the momentum subsystems.
+
+A sweep runs the backtest of a subsystem for every configuration of a grid of
+its parameters:
+- 'pairs': the EMA pairs voting on the forecast, given as named sets (required)
+- 'adx_threshold': the ADX below which the forecast is 0 (25)
+- 'vol_window': the window of the returns volatility, also the number of
+  active days required before it is used (25)
+- 'lookback': the window of the strategy scalar (100)
+- 'vol_target': the annualised volatility target (0.2)
+
+Everything the configurations share is computed once in the calling process:
+the indicators of every EMA span and the ADX, the votes of every pair, the
+volatilities of every window and the price and FX arrays of the day loop.
+These arrays are placed in shared memory (see quantlib.shared_utils), the
+worker processes attach to them once and only receive the parameters of each
+configuration, instead of a pickled 'historical_df' per task.
+"""
+
+# the parameters as the subsystems hard-code them, and the vol target of the
+# runner scripts
+DEFAULT_PARAMETERS = {
+    "adx_threshold": 25,
+    "vol_window": data_utils.VOL_WINDOW,
+    "lookback": 100,
+    "vol_target": 0.2,
+}
+
+# the fields of the day loop which do not depend on the parameters
+BASE_FIELDS = ["halted", "close", "ret", "val_fx", "dollar_value"]
+
+
+def get_configs(grid):
+    """
+    This function expands 'grid', a dict mapping the parameters to the lists of
+    their values, into the list of all configurations. The values of 'pairs'
+    are a dict of named sets of EMA pairs and a configuration holds the name of
+    its set. 'pairs' is required, the other parameters missing from 'grid' take
+    their default value.
+    """
+    if "pairs" not in grid:
+        raise ValueError("The sweep grid has no 'pairs'")
+    grid = {**{name: [value] for name, value in DEFAULT_PARAMETERS.items()}, **grid}
+    names = ["pairs", "adx_threshold", "vol_window", "lookback", "vol_target"]
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*[list(grid[name]) for name in names])
+    ]
+
+
+def get_ret_vol(historical_data, instruments, window):
+    """
+    This function returns the '% ret vol' of the instruments for a rolling
+    window of 'window' days, as 'data_utils.extend_dataframe()' computes it
+    """
+    if window == data_utils.VOL_WINDOW:
+        return array_engine.get_panel(historical_data, instruments, "% ret vol")
+    rets = array_engine.get_panel(historical_data, instruments, "% ret").copy()
+    # the first return is back filled by 'extend_dataframe()'
+    rets[0] = np.nan
+    return pd.DataFrame(rets).rolling(window).std().bfill().to_numpy()
+
+
+def build_sweep_arrays(
+    historical_data,
+    instruments,
+    simulation_start,
+    pair_sets,
+    get_votes,
+    vol_windows,
+    adx_period=14,
+):
+    """
+    This function computes the (dates x instruments) arrays shared by all
+    configurations, over the simulation period: the fields of the day loop
+    which do not depend on the parameters (see 'array_engine.build_panels()'),
+    the 'adx', the 'votes {pair}' of every pair of 'pair_sets' and the
+    'ret_vol {window}' of every window of 'vol_windows'
+    """
+    sim_index = historical_data[simulation_start:].index
+    start = len(historical_data.index) - len(sim_index)
+    pairs = sorted({pair for pairs in pair_sets.values() for pair in pairs})
+    indicators = indicators_cal.get_momentum_indicators(
+        historical_data=historical_data,
+        instruments=instruments,
+        pairs=pairs,
+        adx_period=adx_period,
+    )
+
+    halted, _ = backtest_utils.get_activity_masks(historical_data, instruments)
+    val_fx, dollar_value = backtest_utils.get_unit_conversions(
+        historical_data, instruments
+    )
+    arrays = {
+        "halted": halted,
+        "close": array_engine.get_panel(historical_data, instruments, "close"),
+        "ret": array_engine.get_panel(historical_data, instruments, "% ret"),
+        "val_fx": val_fx,
+        "dollar_value": dollar_value,
+        "adx": array_engine.get_panel(indicators, instruments, "adx"),
+    }
+    for pair in pairs:
+        # votes are -1, 0 or 1, their sums are exact in any order
+        arrays[f"votes {pair}"] = get_votes(
+            array_engine.get_panel(indicators, instruments, f"ema{str(pair)}")
+        ).astype(np.int8)
+    for window in vol_windows:
+        _, all_active = backtest_utils.get_activity_masks(
+            historical_data, instruments, active_window=window
+        )
+        arrays[f"ret_vol {window}"] = np.where(
+            all_active, get_ret_vol(historical_data, instruments, window), 0.025
+        )
+    return {name: values[start:] for name, values in arrays.items()}
+
+
+# the shared arrays and the pair sets, attached once per worker process
+worker_state = {}
+
+
+def init_worker(manifest, pair_sets):
+    shm, arrays = shared_utils.attach_arrays(manifest)
+    worker_state.update(shm=shm, arrays=arrays, pair_sets=pair_sets)
+
+
+def run_config(config):
+    """
+    This function runs the backtest of one configuration in a worker process
+    and returns the series its metrics are computed from (see
+    'analytics.get_series()')
+    """
+    arrays, pairs = worker_state["arrays"], worker_state["pair_sets"][config["pairs"]]
+    votes = np.zeros(arrays["close"].shape)
+    for pair in pairs:
+        votes += arrays[f"votes {pair}"]
+    panels = {field: arrays[field] for field in BASE_FIELDS}
+    panels["ret_vol"] = arrays[f"ret_vol {config['vol_window']}"]
+    panels["forecasts"] = np.where(
+        arrays["adx"] < config["adx_threshold"], 0, votes / len(pairs)
+    )
+    results = array_engine.simulate_arrays(
+        panels, config["vol_target"], lookback=config["lookback"]
+    )
+    return analytics.get_series(results, arrays["dollar_value"])
+
+
+def run_sweep(
+    historical_data,
+    instruments,
+    simulation_start,
+    get_votes,
+    grid,
+    adx_period=14,
+    max_workers=None,
+):
+    """
+    This function runs the backtest of every configuration of 'grid' (see
+    'get_configs()') over a process pool and returns the summary table, one
+    row per configuration with its parameters and metrics (see
+    'analytics.get_metrics()', computed for all configurations at once).
+    'get_votes' is the voting system of the subsystem, e.g. 'Lbmom.get_votes'.
+    Scripts calling it must be guarded by 'if __name__ == "__main__"'.
+    """
+    configs = get_configs(grid)
+    arrays = build_sweep_arrays(
+        historical_data=historical_data,
+        instruments=instruments,
+        simulation_start=simulation_start,
+        pair_sets=grid["pairs"],
+        get_votes=get_votes,
+        vol_windows=sorted({config["vol_window"] for config in configs}),
+        adx_period=adx_period,
+    )
+    shm, manifest = shared_utils.share_arrays(arrays)
+    del arrays
+    try:
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=init_worker,
+            initargs=(manifest, grid["pairs"]),
+        ) as pool:
+            series = list(pool.map(run_config, configs))
+    finally:
+        shm.close()
+        shm.unlink()
+    metrics = analytics.get_metrics(analytics.stack_series(series))
+    return pd.concat([pd.DataFrame(configs), pd.DataFrame(metrics)], axis=1)
@@ -0,0 +1,145 @@
+import datetime
+import pandas as pd
+import quantlib.analytics as analytics
+import quantlib.array_engine as array_engine
+import quantlib.shared_utils as shared_utils
+
+from concurrent.futures import ProcessPoolExecutor
+
+"""
+Walk-forward backtests of the momentum subsystems.
+
+Instead of one simulation from a fixed 'simulation_start', a walk-forward run
+simulates many windows of the history, to see how stable the strategy is
+across periods:
+- "rolling": windows of a fixed 'length' starting every 'step', e.g. one year
+  starting every quarter
+- "expanding": windows all starting at the first start and ending 'step'
+  apart, the first one 'length' long
+
+Every window is the backtest the subsystem would run from the window's start
+(with 10000 of capital and the default strategy scalar) on the history cut at
+the window's end, since every input of the day loop only looks back. So the
+history is extended with the indicators once, the panels of the day loop (see
+'array_engine.build_panels()') are built once from the first start and each
+window simulates a slice of their rows. The panels are placed in shared memory
+(see quantlib.shared_utils) and the windows run over a process pool.
+"""
+
+MODES = ["rolling", "expanding"]
+
+
+def get_windows(dates, first_start, step, length, mode="rolling"):
+    """
+    This function returns the (start, end) dates of the windows of a
+    walk-forward run over 'dates', end excluded, see the modes above. 'step'
+    and 'length' are relativedelta, e.g. relativedelta(months=3). Only the
+    windows ending by the last date are kept.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown walk-forward mode: {mode}")
+    last = dates[-1] + datetime.timedelta(days=1)
+    windows, k = [], 0
+    while True:
+        if mode == "rolling":
+            start = first_start + step * k
+            end = start + length
+        else:
+            start = first_start
+            end = first_start + length + step * k
+        if end > last:
+            return windows
+        windows.append((start, end))
+        k += 1
+
+
+# the shared panels, attached once per worker process
+worker_state = {}
+
+
+def init_worker(manifest):
+    shm, panels = shared_utils.attach_arrays(manifest)
+    worker_state.update(shm=shm, panels=panels)
+
+
+def run_window(first, last, vol_target, capital, lookback):
+    """
+    This function runs the backtest over the rows 'first' to 'last' (excluded)
+    of the shared panels in a worker process and returns the series its
+    metrics are computed from (see 'analytics.get_series()')
+    """
+    panels = {
+        field: values[first:last] for field, values in worker_state["panels"].items()
+    }
+    results = array_engine.simulate_arrays(
+        panels, vol_target, capital=capital, lookback=lookback
+    )
+    return analytics.get_series(results, panels["dollar_value"])
+
+
+def run_walk_forward(
+    strat,
+    step,
+    length,
+    mode="rolling",
+    first_start=None,
+    capital=10000,
+    lookback=100,
+    max_workers=None,
+):
+    """
+    This function runs the backtest of the subsystem 'strat' (Lbmom or Lsmom,
+    with its 'historical_df', instruments and 'vol_target') over every window
+    of 'get_windows()', from 'first_start' ('strat.simulation_start' by
+    default), and returns the summary table, one row per window with its
+    start, end, number of days and metrics (see 'analytics.get_metrics()').
+    Scripts calling it must be guarded by 'if __name__ == "__main__"'.
+    """
+    if first_start is None:
+        first_start = strat.simulation_start
+    instruments = strat.get_instruments()
+    historical_data = strat.extend_historicals(instruments, strat.historical_df)
+    panels = array_engine.build_panels(
+        historical_data=historical_data,
+        instruments=instruments,
+        simulation_start=first_start,
+        pairs=strat.pairs,
+        get_votes=strat.get_votes,
+    )
+    del historical_data
+
+    dates = panels["dates"]
+    windows = get_windows(dates, first_start, step, length, mode=mode)
+    rows = [
+        (dates.searchsorted(start), dates.searchsorted(end)) for start, end in windows
+    ]
+    # windows without any date of the history, e.g. over a weekend, are dropped
+    rows = [(first, last) for first, last in rows if last > first]
+    shm, manifest = shared_utils.share_arrays(
+        {field: panels[field] for field in array_engine.PANEL_FIELDS}
+    )
+    del panels
+    try:
+        with ProcessPoolExecutor(
+            max_workers=max_workers, initializer=init_worker, initargs=(manifest,)
+        ) as pool:
+            futures = [
+                pool.submit(
+                    run_window, first, last, strat.vol_target, capital, lookback
+                )
+                for first, last in rows
+            ]
+            series = [future.result() for future in futures]
+    finally:
+        shm.close()
+        shm.unlink()
+
+    summary = pd.DataFrame(
+        {
+            "start": [dates[first] for first, last in rows],
+            "end": [dates[last - 1] for first, last in rows],
+            "days": [last - first for first, last in rows],
+        }
+    )
+    metrics = analytics.get_metrics(analytics.stack_series(series))
+    return pd.concat([summary, pd.DataFrame(metrics)], axis=1)
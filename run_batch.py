@@ -0,0 +1,95 @@
+import sys
+import json
+import argparse
+import datetime
+import importlib
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor
+
+"""
+THIS SCRIPT RUNS THE PULL SCRIPTS OF SEVERAL MARKETS IN PARALLEL
+
+Every market runs the 'main()' of its pull script (download -> extend ->
+Lbmom / Lsmom) in its own process, and the subsystems of a market run in
+processes of their own (see quantlib.batch_utils). The instruments traded in
+each market are the lists of the 'instruments_keys' of
+config/portfolio_config.json. The script prints a summary of every market
+and exits with status 1 if any market failed, e.g.
+
+    python run_batch.py --markets sp500,crypto --json ./Data/batch_summary.json
+"""
+
+PORTFOLIO_CONFIG = "config/portfolio_config.json"
+PULL_SCRIPTS = {"sp500": "pull_sp500", "oan": "pull_oanda", "crypto": "pull_crypto"}
+
+
+def run_market(market, instruments_keys, max_workers):
+    """
+    This function runs the pull script of 'market' in a worker process and
+    returns its summary, with the status of the run and its duration
+    """
+    start = datetime.datetime.now()
+    try:
+        module = importlib.import_module(PULL_SCRIPTS[market])
+        summary = module.main(
+            instruments_keys=instruments_keys, max_workers=max_workers
+        )
+        summary["status"] = "ok"
+    except Exception:
+        summary = {
+            "market": market,
+            "status": "failed",
+            "error": traceback.format_exc(),
+        }
+    summary["seconds"] = (datetime.datetime.now() - start).total_seconds()
+    return summary
+
+
+def main():
+    with open(PORTFOLIO_CONFIG) as f:
+        portfolio_config = json.load(f)
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--markets", default=",".join(portfolio_config["subsystems"]))
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=None,
+        help="subsystem processes per market, 1 runs them in the market process",
+    )
+    parser.add_argument("--json", help="also write the summary to this file")
+    args = parser.parse_args()
+
+    markets = args.markets.split(",")
+    for market in markets:
+        if market not in PULL_SCRIPTS:
+            raise ValueError(f"Unknown market: {market}")
+
+    instruments_keys = portfolio_config.get("instruments_keys", {})
+    with ProcessPoolExecutor(max_workers=len(markets)) as pool:
+        futures = [
+            pool.submit(
+                run_market, market, instruments_keys.get(market), args.max_workers
+            )
+            for market in markets
+        ]
+        summaries = [future.result() for future in futures]
+
+    for summary in summaries:
+        print(f"{summary['market']}: {summary['status']} in {summary['seconds']:.1f}s")
+        for sysname, stats in summary.get("subsystems", {}).items():
+            print(
+                f"    {sysname}: {stats['instruments']} instruments, "
+                f"{stats['days']} days, capital {stats['capital']:.2f}"
+            )
+        if summary["status"] != "ok":
+            print(summary["error"])
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(summaries, f, indent=2)
+    return 0 if all(summary["status"] == "ok" for summary in summaries) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+import json
+import datetime
+import quantlib.portfolio as portfolio
+import quantlib.storage as storage
+
+from subsystems.lbmom.subsys import Lbmom
+from subsystems.lsmom.subsys import Lsmom
+
+"""
+THIS SCRIPT RUNS THE PORTFOLIO OF config/portfolio_config.json
+
+It reads the historical_df stored by each pull script (also by the chunked mode
+of pull_sp500.py), runs the subsystems of every market with their configured
+weights and writes the combined positions and PnL, under one portfolio level
+vol target (see quantlib.portfolio).
+"""
+
+PORTFOLIO_CONFIG = "config/portfolio_config.json"
+HISTORICAL_PATHS = {
+    "sp500": "./Data/sp500/historical_df.parquet",
+    "oan": "./Data/oanda/historical_df.parquet",
+    "crypto": "./Data/crypto/historical_df.parquet",
+}
+SUBSYSTEMS = {"lbmom": Lbmom, "lsmom": Lsmom}
+PORTFOLIO_PATH = "./Data/portfolio_df.parquet"
+ENGINE = "numpy"
+# None uses one worker process per CPU
+MAX_WORKERS = None
+
+if __name__ == "__main__":
+    with open(PORTFOLIO_CONFIG) as f:
+        portfolio_config = json.load(f)
+
+    start = datetime.datetime.now()
+    portfolio_df, metrics = portfolio.run_portfolio(
+        portfolio_config=portfolio_config,
+        historical_paths=HISTORICAL_PATHS,
+        subsystems=SUBSYSTEMS,
+        engine=ENGINE,
+        max_workers=MAX_WORKERS,
+    )
+    print(
+        f"{len(portfolio_config['subsystems'])} markets in "
+        f"{(datetime.datetime.now() - start).total_seconds():.1f}s"
+    )
+    for name, value in metrics.items():
+        print(f"{name}: {value:.4f}")
+    print(f"capital: {portfolio_df['capital'].iloc[-1]:.2f}")
+    storage.save_portfolio_df(
+        portfolio_df, PORTFOLIO_PATH, csv_path="./Data/portfolio_df.csv"
+    )
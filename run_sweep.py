@@ -0,0 +1,67 @@
+import datetime
+import quantlib.storage as storage
+import quantlib.sweep as sweep
+
+from dateutil.relativedelta import relativedelta
+from subsystems.lbmom.subsys import Lbmom
+from subsystems.lsmom.subsys import Lsmom
+
+"""
+THIS SCRIPT SWEEPS THE PARAMETERS OF THE LBMOM AND LSMOM SUBSYSTEMS
+
+It reads the historical_df stored by a pull script (pull_crypto.py by default)
+and writes one summary table per subsystem, with the Sharpe ratio, volatility,
+maximum drawdown and turnover of every configuration (see quantlib.sweep).
+"""
+
+HISTORICAL_PATH = "./Data/crypto/historical_df.parquet"
+SUBSYSTEMS = {
+    "lbmom": (Lbmom, "./subsystems/lbmom/crypto_instruments.json"),
+    "lsmom": (Lsmom, "./subsystems/lsmom/crypto_instruments.json"),
+}
+SUMMARY_PATH = "./Data/crypto/{}_sweep.csv"
+SIM_YEARS = 3
+# None uses one worker process per CPU
+MAX_WORKERS = None
+
+if __name__ == "__main__":
+    historical_df = storage.load_historical_df(HISTORICAL_PATH)
+    simulation_start = historical_df.index[-1] - relativedelta(years=SIM_YEARS)
+
+    for name, (subsys, instruments_config) in SUBSYSTEMS.items():
+        strat = subsys(
+            instruments_config=instruments_config,
+            historical_df=historical_df,
+            simulation_start=simulation_start,
+            vol_target=0.2,
+        )
+        # fast and slow are the pairs whose fast EMA is below / above the median
+        spans = sorted(fast for fast, slow in strat.pairs)
+        median = spans[len(spans) // 2]
+        grid = {
+            "pairs": {
+                "all": strat.pairs,
+                "fast": [pair for pair in strat.pairs if pair[0] < median],
+                "slow": [pair for pair in strat.pairs if pair[0] >= median],
+            },
+            "adx_threshold": [20, 25, 30],
+            "vol_window": [25, 50],
+            "lookback": [100, 200],
+            "vol_target": [0.1, 0.2, 0.3],
+        }
+
+        start = datetime.datetime.now()
+        summary = sweep.run_sweep(
+            historical_data=historical_df,
+            instruments=strat.get_instruments(),
+            simulation_start=simulation_start,
+            get_votes=strat.get_votes,
+            grid=grid,
+            max_workers=MAX_WORKERS,
+        )
+        print(
+            f"{name}: {len(summary)} configurations in "
+            f"{(datetime.datetime.now() - start).total_seconds():.1f}s"
+        )
+        print(summary.sort_values("sharpe", ascending=False).to_string(index=False))
+        summary.to_csv(SUMMARY_PATH.format(name), index=False)
@@ -0,0 +1,54 @@
+import datetime
+import quantlib.storage as storage
+import quantlib.walk_forward as walk_forward
+
+from dateutil.relativedelta import relativedelta
+from subsystems.lbmom.subsys import Lbmom
+from subsystems.lsmom.subsys import Lsmom
+
+"""
+THIS SCRIPT RUNS WALK-FORWARD BACKTESTS OF THE LBMOM AND LSMOM SUBSYSTEMS
+
+It reads the historical_df stored by a pull script (pull_crypto.py by default)
+and writes one summary table per subsystem, with the Sharpe ratio, volatility,
+maximum drawdown and turnover of every window (see quantlib.walk_forward), and
+prints how much they vary across the windows.
+"""
+
+HISTORICAL_PATH = "./Data/crypto/historical_df.parquet"
+SUBSYSTEMS = {
+    "lbmom": (Lbmom, "./subsystems/lbmom/crypto_instruments.json"),
+    "lsmom": (Lsmom, "./subsystems/lsmom/crypto_instruments.json"),
+}
+SUMMARY_PATH = "./Data/crypto/{}_walk_forward.csv"
+SIM_YEARS = 3
+# one year windows starting every quarter, "expanding" grows them by a quarter
+MODE = "rolling"
+STEP = relativedelta(months=3)
+LENGTH = relativedelta(years=1)
+# None uses one worker process per CPU
+MAX_WORKERS = None
+
+if __name__ == "__main__":
+    historical_df = storage.load_historical_df(HISTORICAL_PATH)
+    simulation_start = historical_df.index[-1] - relativedelta(years=SIM_YEARS)
+
+    for name, (subsys, instruments_config) in SUBSYSTEMS.items():
+        strat = subsys(
+            instruments_config=instruments_config,
+            historical_df=historical_df,
+            simulation_start=simulation_start,
+            vol_target=0.2,
+        )
+
+        start = datetime.datetime.now()
+        summary = walk_forward.run_walk_forward(
+            strat, step=STEP, length=LENGTH, mode=MODE, max_workers=MAX_WORKERS
+        )
+        print(
+            f"{name}: {len(summary)} windows in "
+            f"{(datetime.datetime.now() - start).total_seconds():.1f}s"
+        )
+        print(summary.to_string(index=False))
+        print(summary[["return", "vol", "sharpe", "max drawdown"]].describe())
+        summary.to_csv(SUMMARY_PATH.format(name), index=False)
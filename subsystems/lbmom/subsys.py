@@ -3,6 +3,11 @@ import pandas as pd
 import json
 import quantlib.indicators_cal as indicators_cal
 import quantlib.backtest_utils as backtest_utils
+import quantlib.array_engine as array_engine
+import quantlib.live_engine as live_engine
+import quantlib.ledger as ledger
+import quantlib.profiling_utils as profiling_utils
+import quantlib.shared_utils as shared_utils
 
 """
 # About volatility read this post: 
@@ -18,7 +23,18 @@ class Lbmom:
     financial market data
     """
 
-    def __init__(self, instruments_config, historical_df, simulation_start, vol_target):
+    def __init__(
+        self,
+        instruments_config,
+        historical_df,
+        simulation_start,
+        vol_target,
+        engine="pandas",
+        indicator_cache=None,
+        lean=False,
+        memory_report=None,
+        instruments_keys=None,
+    ):
         self.pairs = self.pairs = [
             (32, 155),
             (218, 234),
@@ -45,68 +61,131 @@ class Lbmom:
         self.historical_df = historical_df
         self.simulation_start = simulation_start
         self.vol_target = vol_target
+        # "pandas" replays the simulation with label lookups, "numpy" runs the
+        # same simulation on arrays with quantlib.array_engine
+        if engine not in ("pandas", "numpy"):
+            raise ValueError(f"Unknown simulation engine: {engine}")
+        self.engine = engine
+        # optional quantlib.indicator_cache.IndicatorCache shared between subsystems
+        self.indicator_cache = indicator_cache
+        # lean keeps the indicators in float32 and drops the raw columns the
+        # simulation does not use, see 'data_utils.extend_dataframe()'
+        self.lean = lean
+        # optional quantlib.memory_utils.MemoryReport recording the frame sizes
+        self.memory_report = memory_report
+        # manifest of a shared memory copy of 'historical_df' (see
+        # 'shared_utils.share_frame()'), set while the subsystem is sent to
+        # worker processes, which then attach to it instead of unpickling it
+        self.historical_manifest = None
         self.sysname = "LBMOM"
         with open(instruments_config) as f:
             self.instruments_config = json.load(f)
+        # the keys of the instruments config listing the traded instruments,
+        # e.g. ["indices", "bonds"] for oan_instruments.json, all keys by default
+        self.instruments_keys = (
+            list(self.instruments_config)
+            if instruments_keys is None
+            else list(instruments_keys)
+        )
 
-    def extend_historicals(self, instruments, historical_data):
-        new_historical_data = historical_data.copy()
-
-        for inst in instruments:
-            # Calculate Average Directional Index (ADX)
-            new_historical_data[f"{inst} adx"] = indicators_cal.adx_series(
-                high=historical_data[inst + " high"],
-                low=historical_data[inst + " low"],
-                close=historical_data[inst + " close"],
-                n=14,
-            )
-
-            ema_differences = []
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop("historical_shm", None)
+        if self.historical_manifest is not None:
+            state["historical_df"] = None
+        return state
 
-            # Calculate moving average crossover for each pair
-            for pair in self.pairs:
-                ema_difference = indicators_cal.ema_series(
-                    series=historical_data[inst + " close"], n=pair[0]
-                ) - indicators_cal.ema_series(
-                    series=historical_data[inst + " close"], n=pair[1]
-                )
-                ema_differences.append(ema_difference)
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.historical_manifest is not None:
+            self.historical_shm, self.historical_df = shared_utils.attach_frame(
+                self.historical_manifest
+            )
 
-            # Concatenate all EMA differences at once
-            ema_difference_df = pd.concat(ema_differences, axis=1)
-            ema_difference_df.columns = [
-                f"{inst} ema{str(pair)}" for pair in self.pairs
-            ]
+    def get_instruments(self):
+        return [
+            inst
+            for key in self.instruments_keys
+            for inst in self.instruments_config[key]
+        ]
 
-            # Add the concatenated DataFrame to the new_historical_data
-            new_historical_data = pd.concat(
-                [new_historical_data, ema_difference_df], axis=1
+    @profiling_utils.timed()
+    def extend_historicals(self, instruments, historical_data):
+        # Calculate Average Directional Index (ADX) and the moving average
+        # crossover for each pair, for all instruments at once, unless
+        # 'historical_data' is a panel which already holds them (see
+        # 'batch_utils.run_subsystems()')
+        indicators = None
+        columns = indicators_cal.get_momentum_columns(instruments, self.pairs)
+        if not set(columns).issubset(historical_data.columns):
+            indicators = indicators_cal.get_momentum_indicators(
+                historical_data=historical_data,
+                instruments=instruments,
+                pairs=self.pairs,
+                adx_period=14,
+                cache=self.indicator_cache,
+                dtype=np.float32 if self.lean else np.float64,
             )
+        if self.lean:
+            # open, high, low and volume are not needed once the ADX is computed
+            historical_data = historical_data.drop(
+                columns=[
+                    col
+                    for col in historical_data.columns
+                    if col.split(" ")[-1] in ["open", "high", "low", "volume"]
+                ]
+            )
+        if indicators is not None:
+            historical_data = pd.concat([historical_data, indicators], axis=1)
+        if self.memory_report is not None:
+            self.memory_report.record(f"{self.sysname} extended", historical_data)
+        return historical_data
 
-        return new_historical_data
+    def get_votes(self, ema_difference):
+        """
+        Votes cast by one EMA pair for every date and instrument, the array
+        counterpart of the voting system in 'run_simulation()'
+        """
+        return (ema_difference > 0).astype(np.float64)
 
+    @profiling_utils.timed()
     def run_simulation(self, historical_data, debug=False):
         """
         Init & Pre-process
         """
 
-        instruments = self.instruments_config["crypto_tickers"]
+        instruments = self.get_instruments()
         # Calculate/pre-process indicators
         historical_data = self.extend_historicals(
             instruments=instruments, historical_data=historical_data
         )
         # historical_data.bfill(inplace=True)
 
-        # Perform simulation
-        portfolio_df = pd.DataFrame(
-            index=historical_data[self.simulation_start :].index
-        ).reset_index()
-        portfolio_df.loc[0, "capital"] = 10000
+        # Define a function to check if an instrument is halted from trading,
+        # the activity masks are built once and queried by row position
+        sim_index = historical_data[self.simulation_start :].index
+        halted, all_active = backtest_utils.get_activity_masks(
+            historical_data, instruments, halt_window=5, active_window=25
+        )
+        start = len(historical_data.index) - len(sim_index)
+        inst_idx = {inst: j for j, inst in enumerate(instruments)}
 
-        # Define a function to check if an instrument is halted from trading
-        is_halted = (
-            lambda inst, date: not np.isnan(historical_data.loc[date, f"{inst} active"])
-            and (~historical_data[:date].tail(5)[f"{inst} active"]).all()
+        # Perform simulation, the daily results are written by row and
+        # instrument position into arrays allocated once (see quantlib.ledger)
+        portfolio_ledger = ledger.PortfolioLedger(
+            sim_index, instruments, first_halted=halted[start]
+        )
+        portfolio_ledger.set(0, "capital", 10000)
+        is_halted = lambda inst, i: halted[start + i, inst_idx[inst]]
+        # USD conversions of value changes and contract values, built once
+        val_fx, dollar_value = backtest_utils.get_unit_conversions(
+            historical_data, instruments
+        )
+        # prices and returns for the day stats, by row and instrument position
+        close = array_engine.get_panel(historical_data, instruments, "close")
+        rets = array_engine.get_panel(historical_data, instruments, "% ret")
+        scalar_calculator = backtest_utils.RollingStratScalar(
+            lookback=100, vol_target=self.vol_target, default=2
         )
         """
         Position Sizing with 3 different techniques combined:
@@ -115,32 +194,33 @@ class Lbmom:
             3. Voting system to account for degree of 'momentum'
         """
         # Loop through each date in the simulation period
-        for i in portfolio_df.index:
-            date = portfolio_df.loc[i, "date"]
+        for i in range(len(portfolio_ledger)):
+            date = sim_index[i]
             strat_scalar = 2  # default scaling up for strategy
 
             # Get the list of tradable and non-tradable instruments
-            tradable = [inst for inst in instruments if not is_halted(inst, date)]
+            tradable = [inst for inst in instruments if not is_halted(inst, i)]
             non_tradable = [inst for inst in instruments if inst not in tradable]
 
             """
             Get PnL and Scalar for Portfolio
             """
             if i != 0:
-                date_prev = portfolio_df.loc[i - 1, "date"]
-                pnl = backtest_utils.get_backtest_day_stats(
-                    portfolio_df, instruments, date, date_prev, i, historical_data
-                )
-                strat_scalar = backtest_utils.get_strat_scalar(
-                    portfolio_df, 100, self.vol_target, i, strat_scalar
+                pnl = backtest_utils.get_ledger_day_stats(
+                    portfolio_ledger,
+                    i,
+                    price_change=close[start + i] - close[start + i - 1],
+                    val_fx=val_fx[start + i - 1],
+                    rets=rets[start + i],
                 )
-            portfolio_df.loc[i, "strat scalar"] = strat_scalar
+                strat_scalar = scalar_calculator.get_strat_scalar()
+            portfolio_ledger.set(i, "strat scalar", strat_scalar)
             """
             Get Positions for Traded Instruments, Assign 0 to Non-Traded
             """
             for inst in non_tradable:
-                portfolio_df.loc[i, f"{inst} units"] = 0
-                portfolio_df.loc[i, f"{inst} w"] = 0
+                portfolio_ledger.units[i, inst_idx[inst]] = 0
+                portfolio_ledger.weights[i, inst_idx[inst]] = 0
 
             nominal_total = 0
             for inst in tradable:
@@ -162,54 +242,129 @@ class Lbmom:
                 # volatility targetting
                 position_vol_target = (
                     (1 / len(tradable))
-                    * portfolio_df.loc[i, "capital"]
+                    * portfolio_ledger.get(i, "capital")
                     * self.vol_target
                     / np.sqrt(253)
                 )
 
-                inst_price = historical_data.loc[date, f"{inst} close"]
+                # the cells are read as float64 (exact for the float32 columns
+                # of the lean mode) so that the arithmetic is the numpy engine's
+                inst_price = float(historical_data.loc[date, f"{inst} close"])
                 percent_ret_vol = (
-                    historical_data.loc[date, f"{inst} % ret vol"]
-                    if historical_data[:date].tail(25)[f"{inst} active"].all()
+                    float(historical_data.loc[date, f"{inst} % ret vol"])
+                    if all_active[start + i, inst_idx[inst]]
                     else 0.025
                 )
 
-                dollar_volatility = backtest_utils.unit_val_change(
-                    inst, inst_price * percent_ret_vol, historical_data, date
+                dollar_volatility = (
+                    inst_price * percent_ret_vol * val_fx[start + i, inst_idx[inst]]
                 )
 
                 position = (
                     strat_scalar * forecast * position_vol_target / dollar_volatility
                 )
-                portfolio_df.loc[i, f"{inst} units"] = position
+                portfolio_ledger.units[i, inst_idx[inst]] = position
                 nominal_total += abs(
-                    position
-                    * backtest_utils.unit_dollar_value(inst, historical_data, date)
+                    position * dollar_value[start + i, inst_idx[inst]]
                 )  # assuming all denominated in same currency
             for inst in tradable:
-                units = portfolio_df.loc[i, f"{inst} units"]
-                nominal_inst = abs(
-                    units
-                    * backtest_utils.unit_dollar_value(inst, historical_data, date)
-                )
+                units = portfolio_ledger.units[i, inst_idx[inst]]
+                nominal_inst = abs(units * dollar_value[start + i, inst_idx[inst]])
                 inst_w = nominal_inst / nominal_total
-                portfolio_df.loc[i, f"{inst} w"] = inst_w
+                portfolio_ledger.weights[i, inst_idx[inst]] = inst_w
 
             """
             Perform Logging and Calculations
             """
-            portfolio_df.loc[i, "nominal"] = nominal_total
-            portfolio_df.loc[i, "leverage"] = (
-                portfolio_df.loc[i, "nominal"] / portfolio_df.loc[i, "capital"]
+            portfolio_ledger.set(i, "nominal", nominal_total)
+            portfolio_ledger.set(
+                i,
+                "leverage",
+                portfolio_ledger.get(i, "nominal") / portfolio_ledger.get(i, "capital"),
             )
 
+            # Feed the completed day to the strategy scalar window, skipping
+            # rows with NaN the same way 'get_strat_scalar()' drops them
+            if i != 0 and not portfolio_ledger.has_nan(i):
+                scalar_calculator.update(
+                    portfolio_ledger.get(i, "capital ret"),
+                    portfolio_ledger.get(i, "strat scalar"),
+                )
+
             if debug:
-                print(portfolio_df.loc[i])
+                print(portfolio_ledger.get_row(i))
+
+        profiling_utils.count(f"{self.sysname} days", len(portfolio_ledger))
+        return portfolio_ledger.to_frame(), instruments
 
+    @profiling_utils.timed()
+    def get_panels(self, instruments, historical_data):
+        """
+        Extends 'historical_data' for 'instruments' and reduces it to the
+        arrays the simulation reads, see 'array_engine.build_panels()'
+        """
+        historical_data = self.extend_historicals(
+            instruments=instruments, historical_data=historical_data
+        )
+        return array_engine.build_panels(
+            historical_data=historical_data,
+            instruments=instruments,
+            simulation_start=self.simulation_start,
+            pairs=self.pairs,
+            get_votes=self.get_votes,
+        )
+
+    @profiling_utils.timed()
+    def run_array_simulation(self, historical_data, debug=False):
+        instruments = self.get_instruments()
+        portfolio_df = array_engine.simulate_panels(
+            panels=self.get_panels(instruments, historical_data),
+            vol_target=self.vol_target,
+            debug=debug,
+        )
+        profiling_utils.count(f"{self.sysname} days", len(portfolio_df.index))
         return portfolio_df, instruments
 
-    def get_subsys_pos(self, debug=False):
-        portfolio_df, instruments = self.run_simulation(
-            historical_data=self.historical_df, debug=debug
+    def start_live(self, historical_data=None):
+        """
+        Runs the backtest once over 'historical_data' (the 'historical_df' of
+        the subsystem by default) and keeps its state, so that each new daily
+        bar is then appended with 'update_live()' instead of replaying the
+        whole simulation
+        """
+        if historical_data is None:
+            historical_data = self.historical_df
+        instruments = self.get_instruments()
+        self.live_simulation = live_engine.LiveSimulation(
+            instruments=instruments,
+            pairs=self.pairs,
+            get_votes=self.get_votes,
+            vol_target=self.vol_target,
+        )
+        self.live_simulation.start(
+            historical_data, self.get_panels(instruments, historical_data)
         )
+
+    @profiling_utils.timed()
+    def update_live(self, date, bar):
+        """
+        Appends the bar of 'date' and returns that day's units, weights and
+        capital as a row of 'portfolio_df', see 'LiveSimulation.update()'
+        """
+        return self.live_simulation.update(date, bar)
+
+    @profiling_utils.timed()
+    def get_subsys_pos(self, debug=False):
+        if self.engine == "numpy":
+            portfolio_df, instruments = self.run_array_simulation(
+                historical_data=self.historical_df, debug=debug
+            )
+        else:
+            # the pandas engine reads and writes single cells with '.loc'
+            with profiling_utils.count_loc_calls(f"{self.sysname} .loc calls"):
+                portfolio_df, instruments = self.run_simulation(
+                    historical_data=self.historical_df, debug=debug
+                )
+        if self.memory_report is not None:
+            self.memory_report.record(f"{self.sysname} portfolio_df", portfolio_df)
         return portfolio_df, instruments
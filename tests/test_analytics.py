@@ -0,0 +1,65 @@
+import json
+import numpy as np
+import quantlib.analytics as analytics
+import quantlib.array_engine as array_engine
+import quantlib.data_utils as data_utils
+
+from benchmarks.pipeline import get_ohlcv_df
+from subsystems.lbmom.subsys import Lbmom
+
+
+def get_series(capital):
+    capital = np.array(capital, dtype=np.float64)
+    rets = np.concatenate([[np.nan], capital[1:] / capital[:-1] - 1])
+    traded = np.concatenate([[np.nan], np.full(len(capital) - 1, 50.0)])
+    return {"capital": capital, "capital ret": rets, "traded": traded}
+
+
+def test_drawdowns_of_a_capital_path():
+    capital = np.array(
+        [
+            # under water for 2 days after 110, then a new maximum
+            [100.0, 110.0, 99.0, 104.5, 121.0, 110.0],
+            # never recovers from 100
+            [100.0, 90.0, 80.0, 85.0, 95.0, 90.0],
+        ]
+    )
+    np.testing.assert_allclose(analytics.get_max_drawdown(capital), [0.1, 0.2])
+    np.testing.assert_array_equal(analytics.get_drawdown_days(capital), [2, 5])
+
+
+def test_metrics_ignore_the_padding_of_shorter_series():
+    long_series = get_series([100, 110, 99, 104.5, 121, 110, 115, 120])
+    short_series = get_series([100, 90, 95, 80, 85])
+    stacked = analytics.get_metrics(analytics.stack_series([long_series, short_series]))
+    alone = analytics.get_metrics(analytics.stack_series([short_series]))
+    for name, values in alone.items():
+        np.testing.assert_allclose(stacked[name][1], values[0], err_msg=name)
+
+
+def test_attribution_sums_to_the_daily_pnl(tmp_path):
+    # FX pairs, CFDs quoted in their currencies and USD instruments
+    df, instruments, fx_codes = get_ohlcv_df(8, 1.5, fx_share=0.5)
+    instruments_config = str(tmp_path / "instruments.json")
+    with open(instruments_config, "w") as f:
+        json.dump({"instruments": instruments}, f)
+
+    historical_df = data_utils.extend_dataframe(instruments, df, fx_codes)
+    strat = Lbmom(
+        instruments_config,
+        historical_df,
+        historical_df.index[len(df) - 120],
+        0.2,
+        engine="numpy",
+    )
+    panels = strat.get_panels(instruments, historical_df)
+    results = array_engine.simulate_arrays(panels, 0.2)
+
+    attribution = analytics.get_attribution(
+        results["units"][np.newaxis], panels["close"], panels["val_fx"]
+    )[0]
+    assert np.isnan(attribution[0]).all()
+    assert np.count_nonzero(attribution[1:]) > 0
+    np.testing.assert_allclose(
+        attribution[1:].sum(axis=-1), results["daily pnl"][1:], rtol=1e-12
+    )
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+import quantlib.backtest_utils as backtest_utils
+import quantlib.ledger as ledger
+
+
+def get_scalar_df(n_days, nan_share, seed):
+    """
+    Random 'capital ret' and 'strat scalar' columns, with NaN on a share of
+    the rows (as on the first day and on the days 'dropna()' skips)
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(
+        {
+            "capital ret": rng.normal(0.0005, 0.01, n_days),
+            "strat scalar": rng.uniform(0.5, 3, n_days),
+            "leverage": rng.uniform(0, 2, n_days),
+        }
+    )
+    df.loc[0, "capital ret"] = np.nan
+    for col in df.columns:
+        df.loc[rng.random(n_days) < nan_share / len(df.columns), col] = np.nan
+    return df
+
+
+@pytest.mark.parametrize("lookback", [2, 5, 20, 100])
+@pytest.mark.parametrize("nan_share", [0, 0.1, 0.5])
+@pytest.mark.parametrize("seed", [0, 1])
+def test_rolling_strat_scalar_matches_get_strat_scalar(lookback, nan_share, seed):
+    df = get_scalar_df(300, nan_share, seed)
+    scalar_calculator = backtest_utils.RollingStratScalar(
+        lookback=lookback, vol_target=0.2, default=2
+    )
+    for idx in df.index:
+        if not df.loc[idx].isna().any():
+            scalar_calculator.update(
+                df.loc[idx, "capital ret"], df.loc[idx, "strat scalar"]
+            )
+        expected = backtest_utils.get_strat_scalar(
+            df, lookback=lookback, vol_target=0.2, idx=idx, default=2
+        )
+        # the running sums only agree with the re-sliced window up to rounding,
+        # which matters most for the variance of very short windows
+        assert scalar_calculator.get_strat_scalar() == pytest.approx(expected, rel=1e-6)
+
+
+def test_rolling_strat_scalar_default_until_window_is_full():
+    df = get_scalar_df(30, 0.3, 2)
+    scalar_calculator = backtest_utils.RollingStratScalar(
+        lookback=50, vol_target=0.2, default=2
+    )
+    for idx in df.index:
+        if not df.loc[idx].isna().any():
+            scalar_calculator.update(
+                df.loc[idx, "capital ret"], df.loc[idx, "strat scalar"]
+            )
+        assert scalar_calculator.get_strat_scalar() == 2
+        assert (
+            backtest_utils.get_strat_scalar(
+                df, lookback=50, vol_target=0.2, idx=idx, default=2
+            )
+            == 2
+        )
+
+
+def test_ledger_day_stats_match_backtest_day_stats():
+    rng = np.random.default_rng(3)
+    instruments = ["EUR_USD", "HK33_HKD", "USD_JPY", "AAPL"]
+    dates = pd.Index(pd.date_range("2024-01-01", periods=6).date, name="date")
+    historical_data = pd.DataFrame(index=dates)
+    for inst in instruments + ["HKD_USD", "JPY_USD"]:
+        historical_data[f"{inst} close"] = 100 * np.exp(
+            np.cumsum(rng.normal(0, 0.01, len(dates)))
+        )
+        historical_data[f"{inst} % ret"] = historical_data[f"{inst} close"].pct_change()
+    val_fx, _ = backtest_utils.get_unit_conversions(historical_data, instruments)
+    close = historical_data[[f"{inst} close" for inst in instruments]].to_numpy()
+    rets = historical_data[[f"{inst} % ret" for inst in instruments]].to_numpy()
+
+    portfolio_df = pd.DataFrame(index=range(len(dates)), dtype=np.float64)
+    portfolio_ledger = ledger.PortfolioLedger(dates, instruments)
+    for i in range(len(dates) - 1):
+        # AAPL is not held on every other day
+        units = rng.normal(0, 100, len(instruments)) * [1, 1, 1, i % 2]
+        weights = np.abs(units) / np.abs(units).sum()
+        for j, inst in enumerate(instruments):
+            portfolio_df.loc[i, f"{inst} units"] = units[j]
+            portfolio_df.loc[i, f"{inst} w"] = weights[j]
+        portfolio_df.loc[i, ["capital", "leverage"]] = [10000 + i, 1.5]
+        portfolio_ledger.units[i] = units
+        portfolio_ledger.weights[i] = weights
+        portfolio_ledger.set(i, "capital", 10000 + i)
+        portfolio_ledger.set(i, "leverage", 1.5)
+
+        backtest_utils.get_backtest_day_stats(
+            portfolio_df, instruments, dates[i + 1], dates[i], i + 1, historical_data
+        )
+        backtest_utils.get_ledger_day_stats(
+            portfolio_ledger,
+            i + 1,
+            price_change=close[i + 1] - close[i],
+            val_fx=val_fx[i],
+            rets=rets[i + 1],
+        )
+        for field in ["capital", "daily pnl", "nominal ret", "capital ret"]:
+            assert portfolio_ledger.get(i + 1, field) == portfolio_df.loc[i + 1, field]
@@ -0,0 +1,56 @@
+import json
+import pandas as pd
+import pytest
+import quantlib.chunked_engine as chunked_engine
+import quantlib.data_utils as data_utils
+import quantlib.storage as storage
+
+from benchmarks.pipeline import get_ohlcv_df
+from dateutil.relativedelta import relativedelta
+from subsystems.lbmom.subsys import Lbmom
+from subsystems.lsmom.subsys import Lsmom
+
+
+@pytest.mark.parametrize("max_workers", [1, None])
+def test_chunked_run_matches_in_memory_run(max_workers, tmp_path):
+    df, instruments, _ = get_ohlcv_df(6, 2)
+    instruments_config = str(tmp_path / "instruments.json")
+    with open(instruments_config, "w") as f:
+        json.dump({"stocks": instruments}, f)
+
+    def get_chunk_df(chunk_idx, chunk):
+        return df[[col for col in df.columns if col.split(" ")[0] in chunk]].copy()
+
+    strats = [
+        subsys(instruments_config, None, None, vol_target=0.2, engine="numpy")
+        for subsys in [Lbmom, Lsmom]
+    ]
+    historical_path = str(tmp_path / "historical_df.parquet")
+    results = chunked_engine.run_chunked(
+        instruments=instruments,
+        get_chunk_df=get_chunk_df,
+        subsystems=strats,
+        spill_dir=str(tmp_path / "chunks"),
+        chunk_size=4,
+        sim_years=1,
+        historical_path=historical_path,
+        max_workers=max_workers,
+    )
+
+    historical_df = data_utils.extend_dataframe(instruments, df.copy(), fx_codes=[])
+    simulation_start = historical_df.index[-1] - relativedelta(years=1)
+    for subsys in [Lbmom, Lsmom]:
+        strat = subsys(
+            instruments_config, historical_df, simulation_start, 0.2, engine="numpy"
+        )
+        expected, expected_instruments = strat.get_subsys_pos()
+        portfolio_df, chunked_instruments = results[strat.sysname]
+        assert chunked_instruments == expected_instruments
+        pd.testing.assert_frame_equal(portfolio_df, expected)
+
+    # the spilled chunks are joined into the historical_df of all instruments
+    combined = storage.load_historical_df(historical_path)
+    assert sorted(combined.columns) == sorted(historical_df.columns)
+    pd.testing.assert_frame_equal(
+        combined, historical_df[combined.columns], check_index_type=False
+    )
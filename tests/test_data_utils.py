@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import quantlib.data_utils as data_utils
+
+SYMBOLS = ["AAPL", "MSFT", "AMZN"]
+DATES = pd.bdate_range("2023-01-02", periods=120, tz="America/New_York")
+
+
+class StubTicker:
+    """
+    A local stand-in for 'yfinance.Ticker': 'history()' returns the bars of a
+    fixed random history up to 'StubTicker.today'. Today's bar is still
+    incomplete, its close differs from the close it settles at.
+    """
+
+    today = DATES[-1]
+
+    def __init__(self, symbol):
+        rng = np.random.default_rng(SYMBOLS.index(symbol))
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, len(DATES))))
+        self.bars = pd.DataFrame(
+            {
+                "Open": close * (1 + rng.normal(0, 0.005, len(DATES))),
+                "High": close * 1.01,
+                "Low": close * 0.99,
+                "Close": close,
+                "Volume": rng.integers(1000, 5000, len(DATES)).astype(float),
+                "Dividends": 0.0,
+            },
+            index=DATES,
+        )
+
+    def history(self, period=None, start=None):
+        bars = self.bars[self.bars.index <= StubTicker.today].copy()
+        if start is not None:
+            bars = bars[bars.index >= pd.Timestamp(start, tz=DATES.tz)]
+        bars.loc[StubTicker.today, "Close"] *= 1.003
+        return bars
+
+
+def test_refresh_and_tail_extension_match_full_download(tmp_path, monkeypatch):
+    path = str(tmp_path / "ohlcv.parquet")
+
+    # first run 5 days ago, then the daily refresh
+    monkeypatch.setattr(StubTicker, "today", DATES[-6])
+    df, instruments = data_utils.refresh_df(SYMBOLS, "AAPL", path, provider=StubTicker)
+    historical_df = data_utils.extend_dataframe_tail(instruments, df, fx_codes=[])
+    for today in DATES[-5:]:
+        monkeypatch.setattr(StubTicker, "today", today)
+        df, instruments = data_utils.refresh_df(
+            SYMBOLS, "AAPL", path, provider=StubTicker
+        )
+        historical_df = data_utils.extend_dataframe_tail(
+            instruments, df, fx_codes=[], historical_data=historical_df
+        )
+
+    full_df, full_instruments = data_utils.get_df(SYMBOLS, "AAPL", provider=StubTicker)
+    full_df.index = data_utils.format_dates(full_df.index)
+    expected = data_utils.extend_dataframe(full_instruments, full_df, fx_codes=[])
+
+    assert instruments == full_instruments
+    pd.testing.assert_frame_equal(
+        df, full_df, check_index_type=False, check_freq=False, check_names=False
+    )
+    # the rolling volatility of the tail is computed over a shorter window
+    # of rows, it only agrees up to rounding
+    pd.testing.assert_frame_equal(
+        historical_df,
+        expected,
+        check_index_type=False,
+        check_names=False,
+        rtol=1e-12,
+        atol=0,
+    )
+
+
+class ExtraBarTicker(StubTicker):
+    """
+    A 'StubTicker' where MSFT also has a bar on a Saturday
+    """
+
+    def __init__(self, symbol):
+        super().__init__(symbol)
+        if symbol == "MSFT":
+            saturday = pd.Timestamp("2023-03-04", tz=DATES.tz)
+            self.bars.loc[saturday] = self.bars.iloc[0]
+            self.bars = self.bars.sort_index()
+
+
+def test_chunks_keep_the_dates_of_the_index_ticker():
+    chunks = [
+        data_utils.get_chunk_df(chunk, "AAPL", provider=ExtraBarTicker)
+        for chunk in [["MSFT"], ["AMZN"]]
+    ]
+    assert chunks[0].index.equals(chunks[1].index)
+    assert len(chunks[0].index) == len(DATES)
+    assert chunks[0].index.name == "date"
+
+
+def test_refreshed_chunk_matches_downloaded_chunk(tmp_path, monkeypatch):
+    path = str(tmp_path / "ohlcv_0000.parquet")
+    monkeypatch.setattr(StubTicker, "today", DATES[-6])
+    data_utils.get_chunk_df(["MSFT"], "AAPL", provider=ExtraBarTicker, ohlcv_path=path)
+    monkeypatch.setattr(StubTicker, "today", DATES[-1])
+    refreshed = data_utils.get_chunk_df(
+        ["MSFT"], "AAPL", provider=ExtraBarTicker, ohlcv_path=path
+    )
+    downloaded = data_utils.get_chunk_df(["MSFT"], "AAPL", provider=ExtraBarTicker)
+    pd.testing.assert_frame_equal(refreshed, downloaded, check_freq=False)
@@ -0,0 +1,43 @@
+import json
+import pytest
+import pandas as pd
+import quantlib.data_utils as data_utils
+
+from benchmarks.pipeline import get_ohlcv_df
+from subsystems.lbmom.subsys import Lbmom
+from subsystems.lsmom.subsys import Lsmom
+
+
+@pytest.mark.parametrize("subsys", [Lbmom, Lsmom])
+def test_numpy_engine_matches_pandas_engine(subsys, tmp_path):
+    # FX pairs, CFDs quoted in their currencies and USD instruments
+    df, instruments, fx_codes = get_ohlcv_df(8, 1.5, fx_share=0.5)
+    # the last instrument does not trade for the days up to the first
+    # simulated day, it is halted on that day and its columns come first
+    start = len(df) - 120
+    halted = f"{instruments[-1]} close"
+    df.iloc[start - 6 : start + 1, df.columns.get_loc(halted)] = df[halted].iloc[
+        start - 6
+    ]
+    instruments_config = str(tmp_path / "instruments.json")
+    with open(instruments_config, "w") as f:
+        json.dump({"instruments": instruments}, f)
+
+    historical_df = data_utils.extend_dataframe(instruments, df, fx_codes)
+    portfolio_dfs = [
+        subsys(
+            instruments_config,
+            historical_df,
+            historical_df.index[start],
+            0.2,
+            engine=engine,
+        ).get_subsys_pos()
+        for engine in ["pandas", "numpy"]
+    ]
+    (pandas_df, pandas_instruments), (numpy_df, numpy_instruments) = portfolio_dfs
+    assert numpy_instruments == pandas_instruments
+    assert list(pandas_df.columns[3:5]) == [
+        f"{instruments[-1]} units",
+        f"{instruments[-1]} w",
+    ]
+    pd.testing.assert_frame_equal(numpy_df, pandas_df, check_exact=True)
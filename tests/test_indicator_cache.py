@@ -0,0 +1,69 @@
+import os
+import numpy as np
+import pandas as pd
+import quantlib.indicators_cal as indicators_cal
+
+from quantlib.indicator_cache import IndicatorCache
+
+
+def get_key(cache, inst, close, backend="numpy"):
+    return cache.get_key(inst, "ema", (10,), [close], backend=backend)
+
+
+def test_key_depends_on_backend_and_inputs():
+    close = np.arange(20, dtype=np.float64)
+    cache = IndicatorCache()
+    assert get_key(cache, "AAPL", close) != get_key(cache, "AAPL", close, "talib")
+    # appending a bar changes the key of the whole series
+    assert get_key(cache, "AAPL", close) != get_key(
+        cache, "AAPL", np.append(close, 20.0)
+    )
+
+
+def test_prune_removes_entries_of_earlier_runs(tmp_path):
+    close = np.arange(20, dtype=np.float64)
+    first = IndicatorCache(disk_dir=str(tmp_path))
+    first.put(get_key(first, "AAPL", close), close)
+    first.put(get_key(first, "MSFT", close), close)
+
+    # the next run only reads AAPL, MSFT is not used any more
+    second = IndicatorCache(disk_dir=str(tmp_path))
+    assert second.get(get_key(second, "AAPL", close)) is not None
+    assert second.prune() == 1
+    assert len(os.listdir(tmp_path)) == 1
+    assert (
+        IndicatorCache(disk_dir=str(tmp_path)).get(get_key(second, "AAPL", close))
+        is not None
+    )
+
+
+def test_prune_caps_the_disk_size(tmp_path):
+    cache = IndicatorCache(disk_dir=str(tmp_path))
+    for k in range(5):
+        cache.put(
+            get_key(cache, f"I{k}", np.full(100, k, dtype=np.float64)), np.ones(100)
+        )
+    size = os.path.getsize(os.path.join(tmp_path, os.listdir(tmp_path)[0]))
+    assert cache.prune(max_bytes=2 * size) == 3
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_lru_holds_every_series_of_a_run():
+    rng = np.random.default_rng(0)
+    instruments = [f"S{k:03d}" for k in range(30)]
+    historical_data = pd.DataFrame(
+        {
+            f"{inst} {col}": 100 + np.cumsum(rng.normal(0, 1, 300))
+            for inst in instruments
+            for col in ["high", "low", "close"]
+        }
+    )
+    pairs = [(10, 20), (15, 40), (30, 60)]
+    cache = IndicatorCache(max_entries=10)
+    for _ in range(2):
+        indicators_cal.get_momentum_indicators(
+            historical_data, instruments, pairs, cache=cache
+        )
+    # 1 ADX and 6 EMA spans per instrument, all computed once and hit once
+    assert cache.max_entries >= len(instruments) * 7
+    assert cache.misses == cache.hits == len(instruments) * 7
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+import quantlib.indicators_cal as indicators_cal
+
+from benchmarks.indicators import get_ohlc
+from quantlib.indicators_cal import (
+    IncrementalADX,
+    IncrementalEMA,
+    IncrementalSMA,
+    RollingStd,
+)
+
+
+def feed(indicator, *inputs):
+    """
+    Feeds the (dates x instruments) 'inputs' bar by bar and stacks the values
+    """
+    return np.vstack([indicator.update(*bar) for bar in zip(*inputs)])
+
+
+@pytest.mark.parametrize("period", [2, 14, 50])
+def test_incremental_indicators_match_batch(period):
+    high, low, close = get_ohlc(300, 4, seed=period)
+    np.testing.assert_array_equal(
+        feed(IncrementalEMA(period, 4), close),
+        indicators_cal.ema_series(close, period),
+    )
+    np.testing.assert_array_equal(
+        feed(IncrementalSMA(period, 4), close),
+        indicators_cal.sma_series(close, period),
+    )
+    np.testing.assert_array_equal(
+        feed(IncrementalADX(period, 4), high, low, close),
+        indicators_cal.adx_series(high, low, close, period),
+    )
+
+    rets = close / np.vstack([np.full((1, 4), np.nan), close[:-1]]) - 1
+    np.testing.assert_array_equal(
+        feed(RollingStd(period, 4), rets),
+        pd.DataFrame(rets).rolling(period).std().to_numpy(),
+    )
+
+
+def test_from_history_continues_the_batch_values():
+    high, low, close = get_ohlc(300, 4, seed=0)
+    ema = IncrementalEMA.from_history(20, close[:-10])
+    adx = IncrementalADX.from_history(14, high[:-10], low[:-10], close[:-10])
+    np.testing.assert_array_equal(
+        feed(ema, close[-10:]), indicators_cal.ema_series(close, 20)[-10:]
+    )
+    np.testing.assert_array_equal(
+        feed(adx, high[-10:], low[-10:], close[-10:]),
+        indicators_cal.adx_series(high, low, close, 14)[-10:],
+    )
+
+
+def get_kernel_inputs(n_days=300):
+    """
+    Random walk OHLC prices with a column starting after leading NaNs, one
+    with only its last 10 bars, one of flat prices and one flat for a stretch
+    of days
+    """
+    high, low, close = get_ohlc(n_days, 5, seed=1)
+    for values in [high, low, close]:
+        values[:40, 1] = np.nan
+        values[:-10, 2] = np.nan
+        values[:, 3] = 100.0
+        values[100:160, 4] = values[100, 4]
+    return high, low, close
+
+
+@pytest.mark.parametrize("backend", ["numpy", "numba"])
+@pytest.mark.parametrize("period", [2, 14, 50])
+def test_kernels_match_talib(backend, period):
+    talib = pytest.importorskip("talib")
+    if backend == "numba":
+        pytest.importorskip("numba")
+    kernels = indicators_cal.KERNELS[backend]
+    high, low, close = get_kernel_inputs()
+    cases = [
+        ("ema", talib.EMA, [close]),
+        ("sma", talib.SMA, [close]),
+        ("adx", talib.ADX, [high, low, close]),
+        # series shorter than the warm-up
+        ("ema", talib.EMA, [close[: period - 1, 0]]),
+        ("sma", talib.SMA, [close[: period - 1, 0]]),
+        (
+            "adx",
+            talib.ADX,
+            [values[: 2 * period - 1, 0] for values in [high, low, close]],
+        ),
+    ]
+    for name, function, inputs in cases:
+        np.testing.assert_array_equal(
+            indicators_cal.by_start(kernels[name], inputs, period),
+            indicators_cal.by_column(function, inputs, timeperiod=period),
+            err_msg=f"{backend} {name}",
+        )
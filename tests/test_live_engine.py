@@ -0,0 +1,44 @@
+import json
+import pytest
+import pandas as pd
+import quantlib.data_utils as data_utils
+
+from benchmarks.pipeline import get_ohlcv_df
+from dateutil.relativedelta import relativedelta
+from subsystems.lbmom.subsys import Lbmom
+from subsystems.lsmom.subsys import Lsmom
+
+# the bars fed one at a time after the start of the live mode
+N_BARS = 10
+
+
+@pytest.mark.parametrize("subsys", [Lbmom, Lsmom])
+def test_live_rows_match_backtest(subsys, tmp_path):
+    # FX pairs, CFDs quoted in their currencies and USD instruments
+    df, instruments, fx_codes = get_ohlcv_df(12, 2, fx_share=0.5)
+    instruments_config = str(tmp_path / "instruments.json")
+    with open(instruments_config, "w") as f:
+        json.dump({"instruments": instruments}, f)
+
+    historical_df = data_utils.extend_dataframe(instruments, df.copy(), fx_codes)
+    simulation_start = historical_df.index[-1] - relativedelta(years=1)
+    strat = subsys(
+        instruments_config, historical_df, simulation_start, 0.2, engine="numpy"
+    )
+    portfolio_df, _ = strat.get_subsys_pos()
+
+    strat.start_live(
+        data_utils.extend_dataframe(instruments, df.iloc[:-N_BARS].copy(), fx_codes)
+    )
+    for k in range(len(df) - N_BARS, len(df)):
+        date = df.index[k]
+        row = strat.update_live(date, df.iloc[k].to_dict())
+        expected = portfolio_df.iloc[len(portfolio_df) - len(df) + k]
+        assert expected["date"] == date
+        pd.testing.assert_series_equal(
+            row[expected.index],
+            expected,
+            check_names=False,
+            check_dtype=False,
+            check_exact=True,
+        )
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+import quantlib.shared_utils as shared_utils
+
+
+def test_attach_frame_views_the_shared_block():
+    rng = np.random.default_rng(0)
+    columns = {}
+    for inst in ["AAPL", "EUR_USD", "HK33_HKD"]:
+        columns[f"{inst} close"] = rng.random(50)
+        columns[f"{inst} active"] = rng.random(50) > 0.5
+        columns[f"{inst} % ret vol"] = rng.random(50).astype(np.float32)
+    df = pd.DataFrame(columns, index=pd.Index(range(50), name="date"))
+
+    shm, manifest = shared_utils.share_frame(df)
+    try:
+        attached_shm, attached = shared_utils.attach_frame(manifest)
+        pd.testing.assert_frame_equal(attached, df)
+        # one block per dtype, every column a view of the shared memory block
+        buffer = np.ndarray(attached_shm.size, dtype=np.uint8, buffer=attached_shm.buf)
+        assert len(attached._mgr.blocks) == 3
+        for col in df.columns:
+            assert np.shares_memory(attached[col].to_numpy(), buffer)
+        del attached, buffer
+        attached_shm.close()
+    finally:
+        shm.close()
+        shm.unlink()
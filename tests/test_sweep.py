@@ -0,0 +1,21 @@
+import pytest
+import quantlib.sweep as sweep
+
+
+def test_configs_take_the_default_parameters():
+    configs = sweep.get_configs({"pairs": {"all": [(8, 32)]}, "lookback": [50, 100]})
+    assert configs == [
+        {
+            "pairs": "all",
+            "adx_threshold": 25,
+            "vol_window": 25,
+            "lookback": lookback,
+            "vol_target": 0.2,
+        }
+        for lookback in [50, 100]
+    ]
+
+
+def test_configs_require_pairs():
+    with pytest.raises(ValueError):
+        sweep.get_configs({"lookback": [50]})